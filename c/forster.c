@@ -16,6 +16,7 @@ static double* UnitVector(double  *vector, int n);
 
 static PyObject* DipoleExtended(PyObject* self, PyObject *arg, PyObject *keywords);
 static PyObject* Dipole(PyObject* self, PyObject *arg, PyObject *keywords);
+static PyObject* KmcWalk(PyObject* self, PyObject *arg, PyObject *keywords);
 
 
 //  Python Interface
@@ -23,11 +24,17 @@ static char function_docstring_1[] =
     "dipole_extended(r_vector, mu_1, mu_2, n=1, longitude=1, n_divisions=10)\n\n Dipole-dipole interaction extended";
 static char function_docstring_2[] =
     "dipole(r_vector, mu_1, mu_2, n=1)\n\n Dipole-dipole interaction";
+static char function_docstring_3[] =
+    "kmc_walk(indptr, neighbours, cumulative_rates, decay_rates, total_rates, site, hops, times, seed)\n\n"
+    " Single exciton KMC trajectory on a CSR rate table. Hops (table entries) and times are written in the\n"
+    " preallocated arrays hops (int64) and times (float64). The GIL is released during the walk.\n"
+    " Returns (number of steps, 1 if the last step is a decay else 0)";
 
 
 static PyMethodDef extension_funcs[] = {
     {"dipole_extended",  (PyCFunction)DipoleExtended, METH_VARARGS|METH_KEYWORDS, function_docstring_1},
     {"dipole",  (PyCFunction)Dipole, METH_VARARGS|METH_KEYWORDS, function_docstring_2},
+    {"kmc_walk",  (PyCFunction)KmcWalk, METH_VARARGS|METH_KEYWORDS, function_docstring_3},
     {NULL, NULL, 0, NULL}
 };
 
@@ -249,3 +256,200 @@ static PyObject* DipoleExtended (PyObject* self, PyObject *arg, PyObject *keywor
     //Returning Python array
     return Py_BuildValue("d", Coupling);
 }
+
+
+
+// xoshiro256+ random number generator (seeded with splitmix64)
+typedef struct {
+    unsigned long long s[4];
+} RandomState;
+
+static unsigned long long SplitMix64(unsigned long long *x)
+{
+    unsigned long long z = (*x += 0x9E3779B97F4A7C15ULL);
+    z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9ULL;
+    z = (z ^ (z >> 27)) * 0x94D049BB133111EBULL;
+    return z ^ (z >> 31);
+}
+
+static void SeedRandom(RandomState *state, unsigned long long seed)
+{
+    for (int i = 0; i < 4; i++)
+        state->s[i] = SplitMix64(&seed);
+}
+
+static inline unsigned long long RotateLeft(unsigned long long x, int k)
+{
+    return (x << k) | (x >> (64 - k));
+}
+
+// uniform random number in the interval [0, 1)
+static inline double RandomUniform(RandomState *state)
+{
+    unsigned long long *s = state->s;
+    unsigned long long result = s[0] + s[3];
+    unsigned long long t = s[1] << 17;
+
+    s[2] ^= s[0];
+    s[3] ^= s[1];
+    s[1] ^= s[2];
+    s[0] ^= s[3];
+    s[2] ^= t;
+    s[3] = RotateLeft(s[3], 45);
+
+    return (result >> 11) * (1.0 / 9007199254740992.0);
+}
+
+
+static PyArrayObject* GetArray(PyObject *object, int type, int requirements, const char *name)
+{
+    PyArrayObject *array = (PyArrayObject*)PyArray_FROM_OTF(object, type, requirements);
+    if (array == NULL) return NULL;
+
+    if (PyArray_NDIM(array) != 1) {
+        PyErr_Format(PyExc_ValueError, "%s must be a 1D array", name);
+        Py_DECREF(array);
+        return NULL;
+    }
+    return array;
+}
+
+
+// 1 if the CSR rate table is consistent: indptr is non decreasing from 0 to the number of entries, the
+// neighbours are valid sites and the sites without entries have no transfer rate
+static int CheckRateTable(npy_int64 *Indptr, npy_intp IndptrSize, npy_int64 *Neighbours, npy_intp NeighboursSize,
+                          npy_intp CumulativeSize, double *Decay, npy_intp DecaySize, double *Total,
+                          npy_intp NumberOfSites)
+{
+    if (IndptrSize != NumberOfSites + 1 || DecaySize != NumberOfSites || CumulativeSize != NeighboursSize)
+        return 0;
+
+    if (Indptr[0] != 0 || Indptr[NumberOfSites] != NeighboursSize) return 0;
+
+    for (npy_intp i = 0; i < NumberOfSites; i++) {
+        if (Indptr[i + 1] < Indptr[i]) return 0;
+        if (Indptr[i + 1] == Indptr[i] && Total[i] > Decay[i]) return 0;
+    }
+
+    for (npy_intp i = 0; i < NeighboursSize; i++) {
+        if (Neighbours[i] < 0 || Neighbours[i] >= NumberOfSites) return 0;
+    }
+
+    return 1;
+}
+
+
+static PyObject* KmcWalk(PyObject* self, PyObject *arg, PyObject *keywords)
+{
+    long Site;
+    unsigned long long Seed;
+
+    //  Interface with Python
+    PyObject *indptr_obj, *neighbours_obj, *cumulative_obj, *decay_obj, *total_obj, *hops_obj, *times_obj;
+    static char *kwlist[] = {"indptr", "neighbours", "cumulative_rates", "decay_rates", "total_rates",
+                             "site", "hops", "times", "seed", NULL};
+    if (!PyArg_ParseTupleAndKeywords(arg, keywords, "OOOOOlOOK", kwlist, &indptr_obj, &neighbours_obj,
+                                     &cumulative_obj, &decay_obj, &total_obj, &Site, &hops_obj, &times_obj,
+                                     &Seed))  return NULL;
+
+    // output buffers are written in place, so they must be of the exact type
+    if (!PyArray_Check(hops_obj) || PyArray_TYPE((PyArrayObject*)hops_obj) != NPY_INT64 ||
+        !PyArray_ISCARRAY((PyArrayObject*)hops_obj) || PyArray_NDIM((PyArrayObject*)hops_obj) != 1 ||
+        !PyArray_Check(times_obj) || PyArray_TYPE((PyArrayObject*)times_obj) != NPY_DOUBLE ||
+        !PyArray_ISCARRAY((PyArrayObject*)times_obj) || PyArray_NDIM((PyArrayObject*)times_obj) != 1) {
+        PyErr_SetString(PyExc_TypeError, "hops and times must be writable contiguous 1D int64/float64 arrays");
+        return NULL;
+    }
+
+    PyArrayObject *indptr_array = GetArray(indptr_obj, NPY_INT64, NPY_ARRAY_IN_ARRAY, "indptr");
+    PyArrayObject *neighbours_array = GetArray(neighbours_obj, NPY_INT64, NPY_ARRAY_IN_ARRAY, "neighbours");
+    PyArrayObject *cumulative_array = GetArray(cumulative_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY, "cumulative_rates");
+    PyArrayObject *decay_array = GetArray(decay_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY, "decay_rates");
+    PyArrayObject *total_array = GetArray(total_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY, "total_rates");
+
+    if (indptr_array == NULL || neighbours_array == NULL || cumulative_array == NULL ||
+        decay_array == NULL || total_array == NULL) {
+        Py_XDECREF(indptr_array);
+        Py_XDECREF(neighbours_array);
+        Py_XDECREF(cumulative_array);
+        Py_XDECREF(decay_array);
+        Py_XDECREF(total_array);
+        return NULL;
+    }
+
+    npy_int64 *Indptr     = (npy_int64*)PyArray_DATA(indptr_array);
+    npy_int64 *Neighbours = (npy_int64*)PyArray_DATA(neighbours_array);
+    double *Cumulative    = (double*)PyArray_DATA(cumulative_array);
+    double *Decay         = (double*)PyArray_DATA(decay_array);
+    double *Total         = (double*)PyArray_DATA(total_array);
+    npy_int64 *Hops       = (npy_int64*)PyArray_DATA((PyArrayObject*)hops_obj);
+    double *Times         = (double*)PyArray_DATA((PyArrayObject*)times_obj);
+
+    npy_intp NumberOfSites = PyArray_DIM(total_array, 0);
+    npy_intp MaxSteps = PyArray_DIM((PyArrayObject*)times_obj, 0);
+    if (PyArray_DIM((PyArrayObject*)hops_obj, 0) < MaxSteps) MaxSteps = PyArray_DIM((PyArrayObject*)hops_obj, 0);
+
+    // the walk runs without the GIL and without bounds checks, so the table is validated here
+    if (Site < 0 || Site >= NumberOfSites ||
+        !CheckRateTable(Indptr, PyArray_DIM(indptr_array, 0), Neighbours, PyArray_DIM(neighbours_array, 0),
+                        PyArray_DIM(cumulative_array, 0), Decay, PyArray_DIM(decay_array, 0), Total, NumberOfSites)) {
+        PyErr_SetString(PyExc_ValueError, "inconsistent rate table");
+        Py_DECREF(indptr_array);
+        Py_DECREF(neighbours_array);
+        Py_DECREF(cumulative_array);
+        Py_DECREF(decay_array);
+        Py_DECREF(total_array);
+        return NULL;
+    }
+
+    npy_intp NumberOfSteps = 0;
+    int Decayed = 0;
+
+    Py_BEGIN_ALLOW_THREADS
+
+    RandomState State;
+    SeedRandom(&State, Seed);
+
+    double Time = 0.0;
+    npy_int64 CurrentSite = Site;
+
+    while (NumberOfSteps < MaxSteps) {
+        double TotalRate = Total[CurrentSite];
+        if (TotalRate == 0) break;
+
+        double r = RandomUniform(&State) * TotalRate;
+        Time -= log(1.0 - RandomUniform(&State)) / TotalRate;
+        Times[NumberOfSteps] = Time;
+
+        if (r < Decay[CurrentSite]) {
+            NumberOfSteps++;
+            Decayed = 1;
+            break;
+        }
+
+        // first entry of the row with cumulative rate > r (binary search)
+        npy_int64 Low = Indptr[CurrentSite];
+        npy_int64 High = Indptr[CurrentSite + 1];
+        while (Low < High) {
+            npy_int64 Middle = Low + (High - Low) / 2;
+            if (Cumulative[Middle] > r) High = Middle;
+            else Low = Middle + 1;
+        }
+        if (Low == Indptr[CurrentSite + 1]) Low--;  // rounding error
+
+        Hops[NumberOfSteps] = Low;
+        CurrentSite = Neighbours[Low];
+        NumberOfSteps++;
+    }
+
+    Py_END_ALLOW_THREADS
+
+    // Free python memory
+    Py_DECREF(indptr_array);
+    Py_DECREF(neighbours_array);
+    Py_DECREF(cumulative_array);
+    Py_DECREF(decay_array);
+    Py_DECREF(total_array);
+
+    return Py_BuildValue("(ni)", NumberOfSteps, Decayed);
+}
@@ -1,42 +1,109 @@
 __version__ = '0.1'
 _ground_state_ = 'gs'
 from kimonet.core import do_simulation_step, system_test_info
+from kimonet.core.processes import precompute_rates, discard_realization
+from kimonet.core.catalog import RateCatalog
+from kimonet.core.lattice import calculate_kmc_walk
 from kimonet.analysis import Trajectory
 from warnings import warn
 import numpy as np
 import time
 
-def calculate_kmc(system, num_trajectories=100, max_steps=10000, silent=False):
-
+# precomputation stores opened by calculate_kmc_parallel (used by the forked workers, see _run_trajectory)
+_stores = {}
+
+
+def _open_store(filename, system):
+    # the neighbour graph is built if it was not stored (so it is stored for the next runs)
+    from kimonet.fileio import PrecomputationStore
+    store = PrecomputationStore(filename)
+    store.load(system)
+    if not system._has_neighbour_graph():
+        system.build_neighbour_graph()
+    return store
+
+
+def calculate_kmc(system, num_trajectories=100, max_steps=10000, silent=False, sampler='linear', disorder=None,
+                  initial_excitations=None, store=None):
+    """
+    :param disorder: function applied to the copy of the system of each trajectory (e.g. to generate a new
+                     realization of static disorder, see kimonet.system.disorder). The cached data of each
+                     realization is discarded after its trajectory (see discard_realization)
+    :param initial_excitations: dictionary {state: indices of the molecules excited at the start of each
+                                trajectory [num_trajectories, n]} (see kimonet.system.initial_conditions)
+    :param store: file name of a precomputation store (see kimonet.fileio.PrecomputationStore). The neighbours,
+                  couplings and overlaps of the system stored in previous runs are loaded, and the new ones are
+                  written after each trajectory (not with disorder, the data of each realization is not reused)
+    """
+    if store is not None:
+        store = _open_store(store, system)
+
+    # the store is closed when the trajectories are done (or one fails)
     trajectories = []
-    for j in range(num_trajectories):
-        system_copy = system.copy()
+    try:
+        for j in range(num_trajectories):
+            system_copy = system.copy()
+            system_copy.rate_catalog = RateCatalog(sampler=sampler)
+            if disorder is not None:
+                disorder(system_copy)
+            if initial_excitations is not None:
+                for state, indices in initial_excitations.items():
+                    system_copy.add_excitations(state, indices[j])
+
+            if not silent:
+                print('Trajectory: ', j)
 
-        if not silent:
-            print('Trajectory: ', j)
+            trajectory = Trajectory(system_copy)
 
-        trajectory = Trajectory(system_copy)
+            for i in range(max_steps):
 
-        for i in range(max_steps):
+                change_step, step_time = do_simulation_step(system_copy)
+                if system_copy.is_finished:
+                    break
 
-            change_step, step_time = do_simulation_step(system_copy)
-            if system_copy.is_finished:
-                break
+                trajectory.add_step(change_step, step_time)
 
-            trajectory.add_step(change_step, step_time)
+                if i == max_steps-1:
+                    warn('Maximum number of steps reached!!')
 
-            if i == max_steps-1:
-                warn('Maximum number of steps reached!!')
+            trajectories.append(trajectory)
 
-        trajectories.append(trajectory)
+            if disorder is not None:
+                discard_realization(system_copy, system)
+            if store is not None and disorder is None:
+                store.save(system)
+    finally:
+        if store is not None:
+            store.close()
 
     return trajectories
 
 
-def _run_trajectory(index, system, max_steps, silent):
-    np.random.seed(int(index * time.time() % 1 * 1e8))
+# systems loaded from file in this process, or shared by the parent process (see calculate_kmc_parallel)
+_loaded_systems = {}
+
+
+def _run_trajectory(index, system, max_steps, silent, sampler='linear', disorder=None, excitations=None,
+                    store=None, seed=None):
+    if seed is None:
+        np.random.seed(int(index * time.time() % 1 * 1e8))
+    else:
+        np.random.seed(seed + index)
+
+    if isinstance(system, str):
+        if system not in _loaded_systems:
+            from kimonet.fileio import load_system
+            _loaded_systems[system] = load_system(system)
+        system = _loaded_systems[system]
 
+    reference = system
     system = system.copy()
+    system.rate_catalog = RateCatalog(sampler=sampler)
+    if disorder is not None:
+        disorder(system)
+    if excitations is not None:
+        for state, indices in excitations.items():
+            system.add_excitations(state, indices)
     trajectory = Trajectory(system)
     for i in range(max_steps):
 
@@ -50,33 +117,105 @@ def _run_trajectory(index, system, max_steps, silent):
         if i == max_steps-1:
             warn('Maximum number of steps reached!!')
 
+    if disorder is not None:
+        discard_realization(system, reference)
+    if store is not None and disorder is None:
+        if store in _stores:
+            _stores[store].save(reference)
+        else:
+            from kimonet.fileio import PrecomputationStore
+            with PrecomputationStore(store) as precomputation_store:
+                precomputation_store.save(reference)
+
     if not silent:
         print('Trajectory {} done!'.format(index))
     return trajectory
 
 
-def calculate_kmc_parallel(system, num_trajectories=100, max_steps=10000, silent=False, processors=2):
+def calculate_kmc_parallel(system, num_trajectories=100, max_steps=10000, silent=False, processors=2,
+                           sampler='linear', disorder=None, initial_excitations=None, store=None, seed=None):
+    """
+    :param system: Instance of System class or name of a system file (see kimonet.fileio.store_system).
+                   Each process loads the file once with memory mapping instead of receiving a pickled
+                   copy of the system for each trajectory
+    :param disorder: function applied to the copy of the system of each trajectory (must be picklable)
+    :param initial_excitations: dictionary {state: indices of the molecules excited at the start of each
+                                trajectory [num_trajectories, n]} (see kimonet.system.initial_conditions)
+    :param store: file name of a precomputation store (see calculate_kmc). The data is loaded by this process
+                  and each worker writes the new data after each trajectory
+    :param seed: random seed of the first trajectory (trajectory i uses seed + i, so the results do not depend
+                 on the number of processors). By default each trajectory is seeded from the time
+
+    The rates of the unique sites (or of the initially excited molecules if there is no translational
+    symmetry) are computed by this process before the workers are created (see precompute_rates). Where fork
+    is available the workers inherit the caches and the system, so each coupling is computed only once.
+    """
     # This function only works in Python3
     import concurrent.futures as futures
-
-    # executor = futures.ThreadPoolExecutor(max_workers=processors)
-    executor = futures.ProcessPoolExecutor(max_workers=processors)
-
-    futures_list = []
-    for i in range(num_trajectories):
-        futures_list.append(executor.submit(_run_trajectory, i, system, max_steps, silent))
-
+    import multiprocessing
+
+    if isinstance(system, str):
+        if system not in _loaded_systems:
+            from kimonet.fileio import load_system
+            _loaded_systems[system] = load_system(system)
+        reference = _loaded_systems[system]
+    else:
+        reference = system
+
+    if store is not None:
+        _stores[store] = _open_store(store, reference)
+
+    # the store is closed, the shared system is removed from the registry and the workers are shut down
+    # even if a trajectory fails
+    shared_key = None
     trajectories = []
-    for f in futures.as_completed(futures_list):
-        trajectories.append(f.result())
+    try:
+        # the caches (couplings, overlaps and rate constants) are filled before the workers are created. With
+        # fork the workers share them (and the system) with this process instead of computing them again
+        if disorder is None:
+            centers = None
+            if initial_excitations is not None and reference.site_index is None:
+                centers = np.unique(np.concatenate([reference.centers.indices()] +
+                                                   [np.ravel(indices) for indices in initial_excitations.values()]))
+            precompute_rates(reference, centers)
+
+        if store is not None:
+            _stores[store].save(reference)
+
+        context = None
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+            if not isinstance(system, str):
+                shared_key = system = '<shared system {}>'.format(id(reference))
+                _loaded_systems[shared_key] = reference
+
+        # executor = futures.ThreadPoolExecutor(max_workers=processors)
+        with futures.ProcessPoolExecutor(max_workers=processors, mp_context=context) as executor:
+
+            futures_list = []
+            for i in range(num_trajectories):
+                excitations = None
+                if initial_excitations is not None:
+                    excitations = {state: indices[i] for state, indices in initial_excitations.items()}
+                futures_list.append(executor.submit(_run_trajectory, i, system, max_steps, silent, sampler,
+                                                    disorder, excitations, store, seed))
+
+            for f in futures.as_completed(futures_list):
+                trajectories.append(f.result())
+    finally:
+        if shared_key is not None:
+            del _loaded_systems[shared_key]
+        if store is not None:
+            _stores.pop(store).close()
 
     return trajectories
 
 
-def calculate_kmc_parallel_alternative(system, num_trajectories=100, max_steps=10000, silent=False, processors=2):
+def calculate_kmc_parallel_alternative(system, num_trajectories=100, max_steps=10000, silent=False, processors=2,
+                                       sampler='linear'):
 
     from multiprocessing import cpu_count, Pool
     from functools import partial
     pool = Pool(processes=processors)
-    trajectories = pool.map(partial(_run_trajectory, system=system, max_steps=max_steps, silent=silent), range(num_trajectories))
+    trajectories = pool.map(partial(_run_trajectory, system=system, max_steps=max_steps, silent=silent, sampler=sampler), range(num_trajectories))
     return trajectories
@@ -5,6 +5,8 @@ from mpl_toolkits.mplot3d import Axes3D
 
 from kimonet.analysis.trajectory_graph import TrajectoryGraph as Trajectory
 from kimonet.analysis.trajectory_analysis import TrajectoryAnalysis
+from kimonet.analysis.master_equation import MasterEquation
+from kimonet.analysis.rate_analysis import RateAnalysis
 
 
 def visualize_system(system, dipole=None):
@@ -0,0 +1,190 @@
+import numpy as np
+from scipy import sparse, stats
+from scipy.sparse.linalg import expm_multiply, splu
+
+
+class MasterEquation:
+    def __init__(self, system, state=None):
+        """
+        Deterministic alternative to the KMC sampling for a single (non-interacting) exciton in a static
+        system. The site to site rate matrix K (K[j, i] = rate i -> j, K[i, i] = -total rate of i) is built
+        from the transfer and decay processes of the system (see RateTable) and the populations p, first
+        moments m and second moments S of the unwrapped displacement are propagated together:
+
+        dp/dt = K p
+        dm_a/dt = K m_a + K_a p
+        dS_ab/dt = K S_ab + K_a m_b + K_b m_a + K_ab p
+
+        where K_a and K_ab contain the rates weighted by the components of the hop displacements.
+
+        :param system: Instance of System class. If state is None it must contain a single exciton
+        :param state: label of the exciton state
+        """
+        from kimonet.core.lattice import get_rate_table  # kimonet.core.lattice imports kimonet.analysis
+
+        if state is None:
+            if len(system.centers) != 1:
+                raise Exception('State must be defined for systems without a single exciton')
+            state = system.molecules[system.centers[0]].state.label
+
+        self.state = state
+        self.table = table = get_rate_table(system, state)
+        self.n_sites = n_sites = len(table.total_rates)
+        self.n_dim = n_dim = table.coordinates.shape[1]
+
+        if len(system.centers) == 1:
+            self.initial_site = system.centers[0]
+        else:
+            self.initial_site = None
+
+        donors = np.repeat(np.arange(n_sites), np.diff(table.indptr))
+        acceptors = table.neighbours
+        displacements = (table.coordinates[acceptors] - table.coordinates[donors] +
+                         np.dot(table.cell_increments, table.supercell))
+
+        def rate_matrix(weights):
+            return sparse.csr_matrix((table.rates * weights, (acceptors, donors)), shape=(n_sites, n_sites))
+
+        self.rate_matrix = rate_matrix(1.0) - sparse.diags(table.total_rates)
+        self._first = [rate_matrix(displacements[:, a]) for a in range(n_dim)]
+        self._second = [[rate_matrix(displacements[:, a] * displacements[:, b]) for b in range(n_dim)]
+                        for a in range(n_dim)]
+
+        self._generator = None
+        self._lu = None
+
+    def _get_initial(self, initial):
+        if initial is None:
+            if self.initial_site is None:
+                raise Exception('Initial site must be defined')
+            initial = self.initial_site
+
+        population = np.zeros(self.n_sites)
+        if np.ndim(initial) == 0:
+            population[initial] = 1.0
+        else:
+            population[:] = initial
+        return population
+
+    def _second_index(self, a, b):
+        return 1 + self.n_dim + a * self.n_dim + b
+
+    def get_generator(self):
+        """
+        :return: sparse generator of the populations and moments. The vector is ordered as
+                 [p, m_0 .. m_dim, S_00, S_01 .. S_dimdim], each block with one entry per site
+        """
+        if self._generator is None:
+            n_blocks = 1 + self.n_dim + self.n_dim**2
+            blocks = [[None] * n_blocks for _ in range(n_blocks)]
+            for i in range(n_blocks):
+                blocks[i][i] = self.rate_matrix
+
+            for a in range(self.n_dim):
+                blocks[1 + a][0] = self._first[a]
+                for b in range(self.n_dim):
+                    ab = self._second_index(a, b)
+                    blocks[ab][0] = self._second[a][b]
+                    blocks[ab][1 + b] = self._first[a]
+                    blocks[ab][1 + a] = self._first[b] if a != b else 2 * self._first[a]
+
+            self._generator = sparse.bmat(blocks, format='csr')
+        return self._generator
+
+    def propagate(self, times, initial=None):
+        """
+        propagate the populations and moments
+
+        :param times: list of times (increasing)
+        :param initial: initial site or site populations (default: the exciton of the system)
+        :return: site populations [n_times, n_sites], first moment [n_times, n_dim] and
+                 second moment tensor [n_times, n_dim, n_dim] of the displacement (not normalized)
+        """
+        generator = self.get_generator()
+        vector = np.zeros(generator.shape[0])
+        vector[:self.n_sites] = self._get_initial(initial)
+
+        n = self.n_sites
+        populations = []
+        first = []
+        second = []
+        time = 0
+        for t in times:
+            if t > time:
+                vector = expm_multiply(generator * (t - time), vector)
+                time = t
+
+            blocks = vector.reshape(-1, n).sum(axis=1)
+            populations.append(vector[:n].copy())
+            first.append(blocks[1:1 + self.n_dim])
+            second.append(blocks[1 + self.n_dim:].reshape(self.n_dim, self.n_dim))
+
+        return np.array(populations), np.array(first), np.array(second)
+
+    def population(self, times, initial=None):
+        """
+        :param times: list of times
+        :param initial: initial site or site populations
+        :return: exciton population at each time
+        """
+        populations, _, _ = self.propagate(times, initial)
+        return populations.sum(axis=1)
+
+    def msd_tensor(self, times, initial=None):
+        """
+        :param times: list of times
+        :param initial: initial site or site populations
+        :return: mean square displacement tensor of the surviving excitons at each time
+        """
+        populations, _, second = self.propagate(times, initial)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return second / populations.sum(axis=1)[:, None, None]
+
+    def diffusion_coeff_tensor(self, times, initial=None):
+        """
+        diffusion tensor from the linear fit of the mean square displacement tensor
+
+        DiffTensor = 1/2 * d<DiffLen^2>/dt
+
+        :param times: list of times used in the fit
+        :param initial: initial site or site populations
+        :return: diffusion tensor
+        """
+        msd = self.msd_tensor(times, initial)
+
+        tensor = np.zeros((self.n_dim, self.n_dim))
+        for a in range(self.n_dim):
+            for b in range(self.n_dim):
+                tensor[a, b] = stats.linregress(times, msd[:, a, b])[0]
+        return tensor / 2
+
+    def _solve(self, vector):
+        # time integral of the propagation: -K^-1 v
+        if self._lu is None:
+            if np.any(self.table.decay_rates == 0):
+                raise Exception('Lifetime is infinite: not all the sites decay')
+            self._lu = splu(sparse.csc_matrix(-self.rate_matrix))
+        return self._lu.solve(vector)
+
+    def lifetime(self, initial=None):
+        """
+        :param initial: initial site or site populations
+        :return: average time until the exciton decays
+        """
+        return np.sum(self._solve(self._get_initial(initial)))
+
+    def diffusion_length_square_tensor(self, initial=None):
+        """
+        :param initial: initial site or site populations
+        :return: average displacement tensor of the exciton when it decays
+        """
+        population = self._solve(self._get_initial(initial))
+        first = [self._solve(self._first[a].dot(population)) for a in range(self.n_dim)]
+
+        tensor = np.zeros((self.n_dim, self.n_dim))
+        for a in range(self.n_dim):
+            for b in range(self.n_dim):
+                second = self._solve(self._first[a].dot(first[b]) + self._first[b].dot(first[a]) +
+                                     self._second[a][b].dot(population))
+                tensor[a, b] = np.dot(self.table.decay_rates, second)
+        return tensor
@@ -0,0 +1,155 @@
+import numpy as np
+import warnings
+from scipy import sparse
+from scipy.sparse.linalg import spsolve, MatrixRankWarning
+from kimonet.core.processes import get_transfer_rates, get_decay_rates
+from kimonet import _ground_state_
+from kimonet.analysis.trajectory_analysis import normalize_cell
+
+
+def get_stationary_occupation(transfer_matrix):
+    """
+    :param transfer_matrix: sparse matrix of transfer rates between sites (transfer_matrix[j, i]: rate i -> j)
+    :return: stationary occupation of the sites (normalized)
+    """
+    n_sites = transfer_matrix.shape[0]
+    if n_sites == 1 or transfer_matrix.count_nonzero() == 0:
+        return np.ones(n_sites) / n_sites
+
+    # null vector of the rate matrix, with the condition sum(p) = 1 instead of the first equation
+    rate_matrix = sparse.lil_matrix(transfer_matrix - sparse.diags(np.ravel(transfer_matrix.sum(axis=0))))
+    rate_matrix[0, :] = 1
+    vector = np.zeros(n_sites)
+    vector[0] = 1
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', MatrixRankWarning)
+        occupation = spsolve(sparse.csc_matrix(rate_matrix), vector)
+
+    if not np.all(np.isfinite(occupation)):
+        raise Exception('The stationary occupation of the sites is not unique (sites not connected)')
+
+    return occupation
+
+
+class RateAnalysis:
+    def __init__(self, system, state=None, sites=None):
+        """
+        Closed-form estimation of the diffusion of a single exciton in a perfect periodic system from the
+        rates of its outgoing processes (no trajectories needed):
+
+        DiffTensor = 1/2 * sum_i p_i sum_j k_ij r_ij r_ij^T
+        lifetime = 1 / k_decay
+
+        where p_i is the stationary occupation of site i given by the transfer rates between the sites
+        (the molecules equivalent by translational symmetry are the same site, see System.get_reference).
+        The lifetime is only defined if all the sites have the same decay rate (see MasterEquation otherwise).
+
+        :param system: Instance of System class. If state is None it must contain a single exciton
+        :param state: label of the exciton state
+        :param sites: list of sites (default: the molecules of the first cell if translational symmetry is
+                      defined, otherwise all the molecules). For crystals it is enough to include the molecules
+                      of one unit cell
+        """
+        if state is None:
+            if len(system.centers) != 1:
+                raise Exception('State must be defined for systems without a single exciton')
+            state = system.molecules[system.centers[0]].state.label
+
+        if sites is None:
+            if system.site_index is not None:
+                sites = [system.get_reference(molecule)
+                         for molecule in np.unique(system.site_index, return_index=True)[1]]
+            else:
+                sites = range(system.get_num_molecules())
+        positions = {int(site): i for i, site in enumerate(sites)}
+
+        self.state = state
+        self.n_dim = system.molecules[0].get_dim()
+
+        system = system.copy()
+        system.reset()
+        supercell = np.array(system.supercell)
+
+        def get_position(molecule):
+            if molecule not in positions:
+                molecule = system.get_reference(molecule)
+            if molecule not in positions:
+                raise Exception('The transfers lead out of the sites of the analysis')
+            return positions[molecule]
+
+        n_sites = len(positions)
+        tensors = []
+        decay_rates = []
+        transfers = []      # (acceptor site, donor site, rate)
+        for i, site in enumerate(positions):
+            system.add_excitation_index(state, site)
+
+            origin = system.molecules[site].get_coordinates()
+            tensor = np.zeros((self.n_dim, self.n_dim))
+            for process, rate in zip(*get_transfer_rates(site, system)):
+                r_vector = (system.molecules[process['acceptor']].get_coordinates() - origin +
+                            np.dot(supercell.T, process['cell_increment']))
+                tensor += rate * np.outer(r_vector, r_vector)
+                transfers.append((get_position(process['acceptor']), i, rate))
+
+            tensors.append(tensor)
+            decay_rates.append(np.sum(get_decay_rates(site, system)[1]))
+
+            system.add_excitation_index(_ground_state_, site)
+
+        acceptors, donors, rates = np.array(transfers, dtype=float).reshape(-1, 3).T
+        transfer_matrix = sparse.csr_matrix((rates, (acceptors.astype(int), donors.astype(int))),
+                                            shape=(n_sites, n_sites))
+        self.occupation = get_stationary_occupation(transfer_matrix)
+        self._tensor = np.tensordot(self.occupation, tensors, axes=1) / 2
+        self._decay_rates = np.array(decay_rates)
+
+    def diffusion_coeff_tensor(self, unit_cell=None):
+        """
+        :param unit_cell: if defined the tensor is expressed in the (normalized) unit cell basis
+        :return: diffusion tensor
+        """
+        tensor = self._tensor
+
+        if unit_cell is not None:
+            trans_mat = normalize_cell(unit_cell)
+            mat_inv = np.linalg.inv(trans_mat)
+
+            tensor = np.dot(mat_inv.T, np.dot(tensor, mat_inv))
+
+        return tensor
+
+    def diffusion_coefficient(self):
+        """
+        :return: diffusion coefficient (1/z * trace of the diffusion tensor)
+        """
+        return np.trace(self._tensor) / self.n_dim
+
+    def lifetime(self):
+        """
+        :return: lifetime of the exciton (inf if it does not decay)
+        """
+        decay_rate = self._decay_rates[0]
+        if not np.allclose(self._decay_rates, decay_rate, rtol=1e-10, atol=0):
+            raise Exception('The lifetime has no closed form if the sites have different decay rates')
+
+        if decay_rate == 0:
+            return np.inf
+        return 1 / decay_rate
+
+    def diffusion_length_square_tensor(self, unit_cell=None):
+        """
+        DiffLenTen = 2 * DiffTensor * lifetime
+
+        :param unit_cell: if defined the tensor is expressed in the (normalized) unit cell basis
+        :return: diffusion length square tensor
+        """
+        return 2 * self.diffusion_coeff_tensor(unit_cell) * self.lifetime()
+
+    def diffusion_length(self):
+        """
+        DiffLen = SQRT(2 * z * DiffCoeff * LifeTime)
+
+        :return: diffusion length
+        """
+        return np.sqrt(2 * self.n_dim * self.diffusion_coefficient() * self.lifetime())
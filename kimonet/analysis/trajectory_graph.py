@@ -106,7 +106,7 @@ class TrajectoryGraph:
 
     def _add_node(self, from_node, new_on_molecule, process_label=None):
 
-        if self.system.molecules[new_on_molecule].set_state(_ground_state_):
+        if self.system.molecules[new_on_molecule].state.label == _ground_state_:
             print('Error in state: ', self.system.molecules[new_on_molecule].state.label)
             exit()
 
@@ -704,7 +704,7 @@ class TrajectoryGraph2(TrajectoryGraph):
 
     def _add_node(self, from_node, new_on_molecule, process_label=None):
 
-        if self.system.molecules[new_on_molecule].set_state(_ground_state_):
+        if self.system.molecules[new_on_molecule].state.label == _ground_state_:
             print('Error in state: ', self.system.molecules[new_on_molecule].state.label)
             exit()
 
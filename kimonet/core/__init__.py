@@ -1,4 +1,4 @@
-from kimonet.core.kmc import kmc_algorithm
+from kimonet.core.kmc import kmc_algorithm, next_reaction_algorithm
 from kimonet.core.processes import get_processes_and_rates
 from kimonet.core.processes import GoldenRule, DirectRate, DecayRate
 from kimonet import _ground_state_
@@ -17,30 +17,18 @@ def do_simulation_step(system):
     :return: the chosen process and the advanced time
     """
 
-    molecules = system.molecules                # list of all instances of Molecule
-    centre_indexes = system.centers              # tricky list with the indexes of all excited molecules
-
-    rate_collector = []                             # list with all the rates (for all centers)
-    process_collector = []                          # list with the respective processes (for all centers)
-    # the indexes of both lists coincide.
-
-    for center in system.centers:
-        if isinstance(center, int):
-            # looks for the all molecules in a circle of radius centered at the position of the excited molecule
-
-            process_list, rate_list = get_processes_and_rates(center, system)
-            # for each center computes all the decay rates and all the transfer rates for all neighbours
-            # return them as a list
-
-            rate_collector += rate_list
-            process_collector += process_list
-            # merging of the new list with the rates and processes previously computed
+    # the rates of each center are kept in the rate catalog of the system and only those centers
+    # whose neighbourhood has changed since the previous step are recomputed
+    process_collector, rate_collector = system.rate_catalog.get_processes_and_rates(system)
 
     # If no process available system cannot evolve and simulation is finished
-    if len(process_collector) == 0:
+    if system.rate_catalog.get_number_of_processes() == 0:
         system.is_finished = True
         return None, 0
-    chosen_process, time = kmc_algorithm(rate_collector, process_collector)
+    if system.rate_catalog.sampler == 'next_reaction':
+        chosen_process, time = next_reaction_algorithm(rate_collector, process_collector)
+    else:
+        chosen_process, time = kmc_algorithm(rate_collector, process_collector)
     # chooses one of the processes and gives it a duration using the Kinetic Monte-Carlo algorithm
     update_step(chosen_process, system)        # updates both lists according to the chosen process
 
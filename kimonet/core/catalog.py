@@ -0,0 +1,157 @@
+from kimonet.core.processes import get_processes_and_rates
+from kimonet.core.kmc import rate_samplers
+
+
+def _process_key(process):
+    # identifies a process of a center between recomputations
+    cell_increment = process.get('cell_increment')
+    if cell_increment is not None:
+        cell_increment = tuple(int(i) for i in cell_increment)
+    return id(process['process']), process['acceptor'], cell_increment
+
+
+class RateCatalog:
+    def __init__(self, sampler='linear'):
+        """
+        Persistent catalog of the processes and rates of every excited center of a system.
+        Entries are kept between simulation steps and only the centers marked as invalid
+        (because the occupancy of their neighbourhood changed) are recomputed.
+
+        :param sampler: selection backend. 'linear' (plain lists, same order as system.centers)
+                        or any of the samplers defined in kimonet.core.kmc.rate_samplers
+                        ('tree', 'composition_rejection', 'next_reaction')
+        """
+        if sampler != 'linear' and sampler not in rate_samplers:
+            raise Exception('Sampler {} not available'.format(sampler))
+
+        self.sampler = sampler
+        self.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, center):
+        return center in self._entries
+
+    def clear(self):
+        self._entries = {}      # center -> (process_list, rate_list) or {process key: slot}
+        self._invalid = set()   # centers that need to be recomputed
+
+        # slot storage (only used with sampler backends)
+        self._processes = []    # slot -> process (None if slot is free)
+        self._free_slots = []
+        self._n_processes = 0
+        if self.sampler != 'linear':
+            self._rates = rate_samplers[self.sampler]()
+
+    def invalidate(self, index):
+        """
+        mark a center as invalid. It will be recomputed (or removed if no longer excited) in the next refresh
+
+        :param index: index of the molecule
+        """
+        if index in self._entries:
+            self._invalid.add(index)
+
+    def refresh(self, system):
+        """
+        recompute the invalid centers and include the new ones
+
+        :param system: Instance of System class
+        """
+        if self.sampler != 'linear':
+            self._refresh_slots(system)
+            return
+
+        for center in self._invalid:
+            del self._entries[center]
+        self._invalid = set()
+
+        centers = set()
+        for center in system.centers:
+            if isinstance(center, int):
+                centers.add(center)
+                if center not in self._entries:
+                    self._entries[center] = get_processes_and_rates(center, system)
+
+        # remove centers that are no longer excited
+        for center in set(self._entries) - centers:
+            del self._entries[center]
+
+    def _refresh_slots(self, system):
+        centers = set(center for center in system.centers if isinstance(center, int))
+
+        for center in self._invalid:
+            old_slots = self._entries.pop(center)
+            if center in centers:
+                self._entries[center] = self._store_center(center, system, old_slots)
+            else:
+                self._release_slots(old_slots.values())
+        self._invalid = set()
+
+        for center in centers:
+            if center not in self._entries:
+                self._entries[center] = self._store_center(center, system, {})
+
+        # remove centers that are no longer excited
+        for center in set(self._entries) - centers:
+            self._release_slots(self._entries.pop(center).values())
+
+    def _store_center(self, center, system, old_slots):
+        # processes already present keep their slot, so the sampler only sees rate updates
+        slots = {}
+        for process, rate in zip(*get_processes_and_rates(center, system)):
+            key = _process_key(process)
+            if key in old_slots:
+                slot = old_slots.pop(key)
+            elif len(self._free_slots) > 0:
+                slot = self._free_slots.pop()
+                self._n_processes += 1
+            else:
+                slot = len(self._processes)
+                self._processes.append(None)
+                self._n_processes += 1
+
+            self._processes[slot] = process
+            self._rates.update(slot, rate)
+            slots[key] = slot
+
+        self._release_slots(old_slots.values())
+        return slots
+
+    def _release_slots(self, slots):
+        for slot in slots:
+            self._rates.update(slot, 0.0)
+            self._processes[slot] = None
+            self._free_slots.append(slot)
+            self._n_processes -= 1
+
+    def get_number_of_processes(self):
+        """
+        :return: the number of processes in the catalog
+        """
+        if self.sampler != 'linear':
+            return self._n_processes
+        return sum(len(process_list) for process_list, _ in self._entries.values())
+
+    def get_processes_and_rates(self, system):
+        """
+        :param system: Instance of System class
+        :return: process_list, rate_list of all the centers. With the linear sampler these are lists in the
+                 same order as system.centers, otherwise rate_list is the sampler and process_list is indexed
+                 by its slots
+        """
+        self.refresh(system)
+
+        if self.sampler != 'linear':
+            return self._processes, self._rates
+
+        process_collector = []
+        rate_collector = []
+        for center in system.centers:
+            if center in self._entries:
+                process_list, rate_list = self._entries[center]
+                process_collector += process_list
+                rate_collector += rate_list
+
+        return process_collector, rate_collector
@@ -1,9 +1,11 @@
 import numpy as np
+import math
 
 
 def kmc_algorithm(rate_list, process_list):
     """
-    :param rate_list: List with all the computed rates for all the neighbours for all the centers
+    :param rate_list: List with all the computed rates for all the neighbours for all the centers.
+    A rate sampler (ex: RateTree) can also be used instead of the list as selection backend
     :param process_list: List of elements dict(center, process, new molecule).
     The indexes of each rate in rate_list have the same index that the associated process in
     process_list.
@@ -27,6 +29,9 @@ def select_process(constant_list):
     :param constant_list: List with the constant rates
     :return: Chooses a position of the list chosen proportionally to its value.
     """
+    if hasattr(constant_list, 'select'):
+        return constant_list.select()
+
     r = np.sum(constant_list) * np.random.rand()
     # random number picked from the uniform distribution U(0, rates sum)
 
@@ -45,4 +50,396 @@ def time_advance(rate_list):
     :return: Process duration. Picks a random time from an exponential distribution
     """
     r = 1 - np.random.rand()  # interval [0, 1) -> (0, 1]
+    if hasattr(rate_list, 'total'):
+        return (-np.log(r)) / rate_list.total()
+
     return (-np.log(r)) / (np.sum(rate_list))
+
+
+class RateTree:
+    def __init__(self, rates=()):
+        """
+        Binary sum tree of rates. Each leaf holds a rate and each internal node the sum of its children,
+        so the root is the total rate. Selection of a rate proportionally to its value and point updates
+        are O(log M), and the total rate is O(1).
+
+        :param rates: initial list of rates
+        """
+        self._size = 0
+        self._capacity = 1
+        self._tree = [0.0, 0.0]
+        for rate in rates:
+            self.append(rate)
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        if not 0 <= index < self._size:
+            raise IndexError('rate index out of range')
+        return self._tree[self._capacity + index]
+
+    def _grow(self):
+        leaves = self._tree[self._capacity:self._capacity + self._size]
+        self._capacity *= 2
+        self._tree = [0.0] * (2 * self._capacity)
+        self._tree[self._capacity:self._capacity + self._size] = leaves
+        for i in range(self._capacity - 1, 0, -1):
+            self._tree[i] = self._tree[2 * i] + self._tree[2 * i + 1]
+
+    def append(self, rate):
+        """
+        :param rate: rate to add at the end of the tree
+        :return: the index of the new rate
+        """
+        if self._size == self._capacity:
+            self._grow()
+        self._size += 1
+        self.update(self._size - 1, rate)
+        return self._size - 1
+
+    def update(self, index, rate):
+        """
+        set the value of a rate. Parent nodes are recomputed from their children to avoid the
+        accumulation of rounding errors
+
+        :param index: index of the rate
+        :param rate: new value of the rate
+        """
+        while index >= self._size:
+            self.append(0.0)
+
+        tree = self._tree
+        i = self._capacity + index
+        tree[i] = float(rate)
+        i //= 2
+        while i > 0:
+            tree[i] = tree[2 * i] + tree[2 * i + 1]
+            i //= 2
+
+    def total(self):
+        """
+        :return: the sum of all the rates
+        """
+        return self._tree[1]
+
+    def search(self, value):
+        """
+        :param value: number in the interval [0, total)
+        :return: the index of the rate whose interval in the accumulated sum of rates contains value
+        """
+        tree = self._tree
+        i = 1
+        while i < self._capacity:
+            left = 2 * i
+            # rounding errors should never lead to a zero rate branch
+            if value < tree[left] or tree[left + 1] == 0:
+                i = left
+            else:
+                value -= tree[left]
+                i = left + 1
+        return i - self._capacity
+
+    def select(self):
+        """
+        :return: Chooses the index of a rate proportionally to its value
+        """
+        return self.search(self.total() * np.random.rand())
+
+
+class CompositionRejectionSampler:
+    def __init__(self, rates=()):
+        """
+        Composition-rejection sampler. Rates are grouped in bins [2^(e-1), 2^e), a bin is chosen
+        proportionally to the sum of its rates (composition) and then an element of the bin is chosen
+        uniformly and accepted with probability rate/2^e (rejection, acceptance >= 1/2).
+        Selection cost depends on the number of bins (the span in orders of magnitude of the rates)
+        but not on the number of rates, and updates are O(1) (amortized: the sum of a bin is recomputed
+        from its members after as many updates as members, so rounding errors do not accumulate).
+
+        :param rates: initial list of rates
+        """
+        self._rates = []
+        self._bin = []          # index -> bin exponent (None for zero rates)
+        self._position = []     # index -> position in the bin
+        self._bins = {}         # exponent -> [list of indices, sum of rates, updates since the last resum]
+        for rate in rates:
+            self.append(rate)
+
+    def __len__(self):
+        return len(self._rates)
+
+    def __getitem__(self, index):
+        return self._rates[index]
+
+    def append(self, rate):
+        """
+        :param rate: rate to add at the end
+        :return: the index of the new rate
+        """
+        self._rates.append(0.0)
+        self._bin.append(None)
+        self._position.append(None)
+        self.update(len(self._rates) - 1, rate)
+        return len(self._rates) - 1
+
+    def _remove_from_bin(self, index):
+        exponent = self._bin[index]
+        members = self._bins[exponent][0]
+
+        # swap with the last element of the bin
+        last = members.pop()
+        if last != index:
+            position = self._position[index]
+            members[position] = last
+            self._position[last] = position
+
+        if len(members) == 0:
+            del self._bins[exponent]
+        else:
+            self._bins[exponent][1] -= self._rates[index]
+            self._bin_changed(exponent)
+
+        self._bin[index] = None
+        self._position[index] = None
+
+    def update(self, index, rate):
+        """
+        set the value of a rate
+
+        :param index: index of the rate
+        :param rate: new value of the rate
+        """
+        while index >= len(self._rates):
+            self.append(0.0)
+
+        rate = float(rate)
+        if self._bin[index] is not None:
+            self._remove_from_bin(index)
+
+        self._rates[index] = rate
+        if rate > 0:
+            exponent = math.frexp(rate)[1]   # rate in [2^(e-1), 2^e)
+            if exponent not in self._bins:
+                self._bins[exponent] = [[], 0.0, 0]
+            members = self._bins[exponent]
+            self._position[index] = len(members[0])
+            self._bin[index] = exponent
+            members[0].append(index)
+            members[1] += rate
+            self._bin_changed(exponent)
+
+    def _bin_changed(self, exponent):
+        bin_data = self._bins[exponent]
+        bin_data[2] += 1
+        if bin_data[2] >= len(bin_data[0]):
+            bin_data[1] = math.fsum(self._rates[index] for index in bin_data[0])
+            bin_data[2] = 0
+
+    def total(self):
+        """
+        :return: the sum of all the rates
+        """
+        return sum(bin_data[1] for bin_data in self._bins.values())
+
+    def select(self):
+        """
+        :return: Chooses the index of a rate proportionally to its value
+        """
+        if len(self._bins) == 0:
+            raise Exception('All rates are zero')
+
+        # composition: choose a bin proportionally to the sum of its rates
+        r = self.total() * np.random.rand()
+        for exponent, (members, rate_sum, _) in self._bins.items():
+            if r < rate_sum:
+                break
+            r -= rate_sum
+
+        # rejection: choose a member of the bin uniformly and accept it with probability rate/2^e
+        rate_max = math.ldexp(1.0, exponent)
+        while True:
+            index = members[int(np.random.rand() * len(members))]
+            if np.random.rand() * rate_max < self._rates[index]:
+                return index
+
+
+class IndexedPriorityQueue:
+    def __init__(self):
+        """
+        Binary min-heap of (index, key) pairs with a position map, so the key of any index
+        can be changed in O(log M) and the minimum is obtained in O(1)
+        """
+        self._heap = []         # heap position -> index
+        self._keys = []         # index -> key
+        self._position = []     # index -> heap position
+
+    def __len__(self):
+        return len(self._keys)
+
+    def get_key(self, index):
+        return self._keys[index]
+
+    def top(self):
+        """
+        :return: index and key of the element with the minimum key
+        """
+        index = self._heap[0]
+        return index, self._keys[index]
+
+    def _swap(self, i, j):
+        heap = self._heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self._position[heap[i]] = i
+        self._position[heap[j]] = j
+
+    def _sift_up(self, i):
+        keys, heap = self._keys, self._heap
+        while i > 0:
+            parent = (i - 1) // 2
+            if keys[heap[i]] >= keys[heap[parent]]:
+                break
+            self._swap(i, parent)
+            i = parent
+
+    def _sift_down(self, i):
+        keys, heap = self._keys, self._heap
+        n = len(heap)
+        while True:
+            smallest = i
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < n and keys[heap[child]] < keys[heap[smallest]]:
+                    smallest = child
+            if smallest == i:
+                break
+            self._swap(i, smallest)
+            i = smallest
+
+    def update(self, index, key):
+        """
+        set the key of an index (new indices are added to the queue)
+
+        :param index: index of the element
+        :param key: new key
+        """
+        while index >= len(self._keys):
+            self._keys.append(np.inf)
+            self._position.append(len(self._heap))
+            self._heap.append(len(self._keys) - 1)
+
+        old_key = self._keys[index]
+        self._keys[index] = key
+        if key < old_key:
+            self._sift_up(self._position[index])
+        else:
+            self._sift_down(self._position[index])
+
+
+class NextReactionQueue:
+    def __init__(self, rates=()):
+        """
+        Putative firing times of all processes for the next reaction method of Gibson and Bruck.
+        When the rate of a process changes its firing time is rescaled reusing its random number,
+        so only the processes whose rate changed need to be updated after each event. The sum of the rates
+        is kept updated (and recomputed after as many updates as rates, so rounding errors do not accumulate).
+
+        :param rates: initial list of rates
+        """
+        self.time = 0.0
+        self._rates = []
+        self._total = 0.0
+        self._updates = 0       # updates since the last resum
+        self._queue = IndexedPriorityQueue()
+        for rate in rates:
+            self.append(rate)
+
+    def __len__(self):
+        return len(self._rates)
+
+    def __getitem__(self, index):
+        return self._rates[index]
+
+    def append(self, rate):
+        """
+        :param rate: rate to add at the end
+        :return: the index of the new rate
+        """
+        self.update(len(self._rates), rate)
+        return len(self._rates) - 1
+
+    def update(self, index, rate):
+        """
+        set the value of a rate and reschedule its firing time
+
+        :param index: index of the rate
+        :param rate: new value of the rate
+        """
+        while index >= len(self._rates):
+            self._rates.append(0.0)
+            self._queue.update(len(self._rates) - 1, np.inf)
+
+        rate = float(rate)
+        old_rate = self._rates[index]
+        old_time = self._queue.get_key(index)
+
+        if rate <= 0:
+            firing_time = np.inf
+        elif old_rate > 0 and old_time < np.inf:
+            # reuse the random number of the previous firing time
+            firing_time = self.time + old_rate / rate * (old_time - self.time)
+        else:
+            firing_time = self.time + time_advance([rate])
+
+        self._set_rate(index, rate)
+        self._queue.update(index, firing_time)
+
+    def _set_rate(self, index, rate):
+        self._total += rate - self._rates[index]
+        self._rates[index] = rate
+
+        self._updates += 1
+        if self._updates >= len(self._rates):
+            self._total = math.fsum(self._rates)
+            self._updates = 0
+
+    def total(self):
+        """
+        :return: the sum of all the rates
+        """
+        return self._total
+
+    def next_event(self):
+        """
+        :return: the index of the next process to occur and the time interval until it occurs
+        """
+        index, firing_time = self._queue.top()
+        if firing_time == np.inf:
+            raise Exception('All rates are zero')
+
+        time = firing_time - self.time
+        self.time = firing_time
+
+        # the process that occurs needs a new random number the next time it is scheduled
+        self._set_rate(index, 0.0)
+        self._queue.update(index, np.inf)
+
+        return index, time
+
+
+def next_reaction_algorithm(rate_queue, process_list):
+    """
+    :param rate_queue: NextReactionQueue with the firing times of all the processes
+    :param process_list: List of elements dict(center, process, new molecule) indexed as the queue
+    Chooses the process with the earliest putative firing time (next reaction method, Gibson & Bruck 2000).
+    Only one random number is used per event (the one of the new firing time of the process that occurs).
+    :return:    plan: The chosen proces and the new molecule affected
+                time: the duration of the process
+    """
+    process_index, time = rate_queue.next_event()
+    return process_list[process_index], time
+
+
+# selection backends available for the rate catalog (linear is the plain list used by select_process)
+rate_samplers = {'tree': RateTree,
+                 'composition_rejection': CompositionRejectionSampler,
+                 'next_reaction': NextReactionQueue}
@@ -0,0 +1,404 @@
+import numpy as np
+from warnings import warn
+from bisect import bisect_right
+from math import log
+from concurrent.futures import ThreadPoolExecutor
+from kimonet.core.processes import get_transfer_rates, get_decay_rates
+from kimonet.core.processes import forster
+from kimonet.analysis.trajectory_graph import TrajectoryGraph
+from kimonet import _ground_state_
+
+
+class RateTable:
+    def __init__(self, system, state):
+        """
+        Precomputed rates of a single exciton in a static system. For every site the outgoing transfer
+        processes are stored in flat arrays (CSR format): neighbour index, cell increment and
+        cumulative rate (starting at the decay rate of the site), so a trajectory can be run as
+        a pure array-indexed walk.
+
+        Only simple transfers (state, gs) -> (gs, state) and decays to the ground state are supported.
+
+        :param system: Instance of System class
+        :param state: label of the exciton state
+        """
+        self.state = state
+
+        system = system.copy()
+        system.reset()
+
+        n_sites = system.get_num_molecules()
+        n_dim = system.molecules[0].get_dim()
+
+        # with translational symmetry only the molecules of the first cell are computed
+        if system.site_index is None:
+            sites = range(n_sites)
+        else:
+            sites = sorted(set(system.get_reference(site) for site in range(n_sites)))
+
+        rows = {}
+        for site in sites:
+            system.add_excitation_index(state, site)
+
+            decay_processes, decay_list = get_decay_rates(site, system)
+            for process in decay_processes:
+                if process['process'].final != _ground_state_:
+                    raise Exception('Decay {} not supported in lattice walk'.format(process['process'].description))
+
+            transfer_processes, transfer_list = get_transfer_rates(site, system)
+            for process in transfer_processes:
+                if process['process'].final != (_ground_state_, state):
+                    raise Exception('Transfer {} not supported in lattice walk'.format(process['process'].description))
+
+            rows[site] = (np.sum(decay_list),
+                          np.array([process['acceptor'] for process in transfer_processes], dtype=int),
+                          np.array([process['cell_increment'] for process in transfer_processes],
+                                   dtype=int).reshape(-1, n_dim),
+                          np.array(transfer_list, dtype=float))
+
+            system.add_excitation_index(_ground_state_, site)
+
+        if system.site_index is None:
+            row_list = [rows[site] for site in range(n_sites)]
+            self.decay_rates = np.array([row[0] for row in row_list], dtype=float)
+            self.neighbours = np.concatenate([np.zeros(0, dtype=int)] + [row[1] for row in row_list])
+            self.cell_increments = np.concatenate([np.zeros((0, n_dim), dtype=int)] + [row[2] for row in row_list])
+            self.rates = np.concatenate([np.zeros(0)] + [row[3] for row in row_list])
+            self.indptr = np.concatenate([[0], np.cumsum([len(row[1]) for row in row_list])]).astype(int)
+        else:
+            self._translate_rows(system, rows, n_sites, n_dim)
+
+        # cumulative rates of each site start at its decay rate
+        donors = np.repeat(np.arange(n_sites), np.diff(self.indptr))
+        row_cumulative = np.cumsum(self.rates)
+        row_starts = np.concatenate([[0], row_cumulative])[self.indptr[:-1]]
+        self.cumulative_rates = self.decay_rates[donors] + row_cumulative - row_starts[donors]
+
+        self.total_rates = self.decay_rates + np.bincount(donors, weights=self.rates, minlength=n_sites)
+
+        self.coordinates = np.array([molecule.get_coordinates() for molecule in system.molecules])
+        self.supercell = np.array(system.supercell)
+
+        self._lists = None
+        self._global_cumulative_rates = None
+
+    def _translate_rows(self, system, rows, n_sites, n_dim):
+        # rows of the molecules of the first cell translated to all the cells
+        donors = []
+        neighbours = []
+        cell_increments = []
+        rates = []
+        self.decay_rates = np.zeros(n_sites)
+        for reference, (decay_rate, acceptors, increments, transfer_rates) in rows.items():
+            molecules = np.where(system.site_index == system.site_index[reference])[0]
+            self.decay_rates[molecules] = decay_rate
+
+            cells = system.cell_index[molecules][:, None, :] + system.cell_index[acceptors][None, :, :]
+            wraps, cells = np.divmod(cells, system.dimensions)
+            cells = np.ravel_multi_index(cells.reshape(-1, n_dim).T, system.dimensions)
+
+            donors.append(np.repeat(molecules, len(acceptors)))
+            neighbours.append(system._cell_table[np.tile(system.site_index[acceptors], len(molecules)), cells])
+            cell_increments.append((increments[None, :, :] + wraps).reshape(-1, n_dim))
+            rates.append(np.tile(transfer_rates, len(molecules)))
+
+        donors = np.concatenate(donors)
+        neighbours = np.concatenate(neighbours)
+        cell_increments = np.concatenate(cell_increments)
+
+        # same order as the direct computation: by donor, acceptor and cell increment (stable for processes)
+        order = np.lexsort(list(cell_increments.T[::-1]) + [neighbours, donors])
+
+        self.neighbours = neighbours[order]
+        self.cell_increments = cell_increments[order]
+        self.rates = np.concatenate(rates)[order]
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(donors, minlength=n_sites))])
+
+    def get_lists(self):
+        """
+        :return: the table as python lists (scalar indexing of lists is much faster than of numpy arrays)
+        """
+        if self._lists is None:
+            self._lists = (self.indptr.tolist(), self.neighbours.tolist(), self.cumulative_rates.tolist(),
+                           self.decay_rates.tolist(), self.total_rates.tolist())
+        return self._lists
+
+    def get_global_cumulative_rates(self):
+        """
+        :return: cumulative rates shifted by the total rate of all the previous sites. The result is monotonic
+                 over the whole table, so the hops of many sites can be selected with a single searchsorted
+        """
+        if self._global_cumulative_rates is None:
+            row = np.repeat(np.arange(len(self.total_rates)), np.diff(self.indptr))
+            self._row_offsets = np.concatenate([[0], np.cumsum(self.total_rates)[:-1]])
+            self._global_cumulative_rates = self.cumulative_rates + self._row_offsets[row]
+        return self._global_cumulative_rates, self._row_offsets
+
+
+def get_rate_table(system, state):
+    """
+    :param system: Instance of System class
+    :param state: label of the exciton state
+    :return: the rate table of the system for this state. It is computed only once per system
+    """
+    if state not in system.rate_tables:
+        system.rate_tables[state] = RateTable(system, state)
+    return system.rate_tables[state]
+
+
+def lattice_walk(table, site, max_steps, block_size=4096):
+    """
+    Runs a single exciton trajectory on a rate table using the BKL algorithm
+
+    :param table: RateTable instance
+    :param site: initial site
+    :param max_steps: maximum number of steps
+    :param block_size: number of random numbers generated at once
+    :return: hops (indices of the table entries of each hop), times (after each step) and
+             True if the last step is a decay
+    """
+    indptr, neighbours, cumulative_rates, decay_rates, total_rates = table.get_lists()
+
+    hops = []
+    times = []
+    time = 0.0
+    decayed = False
+    random_numbers = []
+    k = 0
+    for i in range(max_steps):
+        total = total_rates[site]
+        if total == 0:
+            break
+
+        if k == len(random_numbers):
+            random_numbers = np.random.rand(2 * block_size).tolist()
+            k = 0
+        r = random_numbers[k] * total
+        time -= log(1 - random_numbers[k + 1]) / total
+        k += 2
+
+        times.append(time)
+        if r < decay_rates[site]:
+            decayed = True
+            break
+
+        hop = bisect_right(cumulative_rates, r, indptr[site], indptr[site + 1])
+        if hop == indptr[site + 1]:
+            hop -= 1  # rounding error
+        hops.append(hop)
+        site = neighbours[hop]
+
+    return hops, times, decayed
+
+
+def lattice_walk_compiled(table, site, max_steps, seed=None):
+    """
+    Runs a single exciton trajectory on a rate table using the compiled BKL kernel (forster.kmc_walk).
+    The GIL is released during the walk so trajectories can be run concurrently in threads.
+
+    :param table: RateTable instance
+    :param site: initial site
+    :param max_steps: maximum number of steps
+    :param seed: seed of the random number generator of the kernel (if None it is taken from numpy)
+    :return: hops (indices of the table entries of each hop), times (after each step) and
+             True if the last step is a decay
+    """
+    if seed is None:
+        seed = np.random.randint(2**63, dtype=np.uint64)
+
+    hops = np.empty(max_steps, dtype=np.int64)
+    times = np.empty(max_steps, dtype=float)
+    n_steps, decayed = forster.kmc_walk(table.indptr, table.neighbours, table.cumulative_rates,
+                                        table.decay_rates, table.total_rates, int(site),
+                                        hops, times, int(seed))
+
+    return hops[:n_steps - decayed], times[:n_steps], bool(decayed)
+
+
+def lockstep_walk(table, site, num_trajectories, max_steps, cell_state=None):
+    """
+    Runs many independent single exciton trajectories at once. The state of the trajectories (site,
+    unwrapped position, time and alive flag) is stored in arrays and all the alive trajectories are
+    advanced together in each iteration.
+
+    :param table: RateTable instance
+    :param site: initial site
+    :param num_trajectories: number of trajectories
+    :param max_steps: maximum number of steps per trajectory
+    :param cell_state: initial cell state (default: zero)
+    :return: list with hops, times and decayed of each trajectory (see lattice_walk) and the final
+             unwrapped positions
+    """
+    global_cumulative_rates, row_offsets = table.get_global_cumulative_rates()
+
+    n_dim = table.coordinates.shape[1]
+    if cell_state is None:
+        cell_state = np.zeros(n_dim, dtype=int)
+
+    sites = np.full(num_trajectories, site, dtype=int)
+    positions = np.tile(table.coordinates[site] - np.dot(table.supercell.T, cell_state), (num_trajectories, 1))
+    times = np.zeros(num_trajectories)
+    alive = np.ones(num_trajectories, dtype=bool)
+    decayed = np.zeros(num_trajectories, dtype=bool)
+
+    # steps are stored in chunks (trajectory index, table entry, time) and split at the end
+    step_trajectories = []
+    step_hops = []
+    step_times = []
+
+    active = np.arange(num_trajectories)
+    for i in range(max_steps):
+        total = table.total_rates[sites[active]]
+        active = active[total > 0]
+        if len(active) == 0:
+            break
+
+        current = sites[active]
+        total = table.total_rates[current]
+
+        random_numbers = np.random.rand(2, len(active))
+        r = random_numbers[0] * total
+        times[active] -= np.log(1 - random_numbers[1]) / total
+
+        decay = r < table.decay_rates[current]
+        decayed[active[decay]] = True
+
+        hopping = active[~decay]
+        current = current[~decay]
+        hops = np.searchsorted(global_cumulative_rates, row_offsets[current] + r[~decay], side='right')
+        hops = np.minimum(hops, table.indptr[current + 1] - 1)  # rounding error
+
+        new_sites = table.neighbours[hops]
+        positions[hopping] += (table.coordinates[new_sites] - table.coordinates[current] +
+                               np.dot(table.cell_increments[hops], table.supercell))
+        sites[hopping] = new_sites
+
+        entries = np.full(len(active), -1, dtype=int)  # -1: decay
+        entries[~decay] = hops
+        step_trajectories.append(active)
+        step_hops.append(entries)
+        step_times.append(times[active])
+
+        active = hopping
+
+    alive[:] = False
+    alive[active] = True
+
+    if len(step_trajectories) > 0:
+        step_trajectories = np.concatenate(step_trajectories)
+        step_hops = np.concatenate(step_hops)
+        step_times = np.concatenate(step_times)
+    else:
+        step_trajectories = step_hops = np.array([], dtype=int)
+        step_times = np.array([])
+
+    order = np.argsort(step_trajectories, kind='stable')
+    splits = np.cumsum(np.bincount(step_trajectories, minlength=num_trajectories))[:-1]
+
+    walks = []
+    for j, (hops, times_j) in enumerate(zip(np.split(step_hops[order], splits),
+                                            np.split(step_times[order], splits))):
+        walks.append((hops[hops >= 0], times_j, bool(decayed[j])))
+
+    return walks, positions
+
+
+walk_engines = {'python': lattice_walk,
+                'compiled': lattice_walk_compiled,
+                'lockstep': lockstep_walk}
+
+
+def walk_trajectory(system, center, hops, times, decayed, table):
+    """
+    Builds a trajectory graph from the output of a lattice walk
+
+    :param system: Instance of System class with the initial exciton
+    :param center: initial site
+    :param hops: indices of the table entries of each hop
+    :param times: time after each step
+    :param decayed: True if the last step is a decay
+    :param table: RateTable instance
+    :return: Trajectory
+    """
+    trajectory = TrajectoryGraph(system)
+
+    hops = np.array(hops, dtype=int)
+
+    sites = np.concatenate([[center], table.neighbours[hops]])
+    cell_state = np.array(system.molecules[center].cell_state, dtype=int)
+    cell_states = cell_state - np.cumsum(np.vstack([np.zeros_like(cell_state),
+                                                    table.cell_increments[hops]]), axis=0)
+    node_times = [0] + list(times[:len(hops)])
+
+    node = trajectory.graph.nodes[0]
+    node['index'] = sites.tolist()
+    node['coordinates'] = table.coordinates[sites].tolist()
+    node['cell_state'] = cell_states.tolist()
+    node['time'] = node_times
+
+    trajectory.times = [0] + list(times)
+    excitons = trajectory.current_excitons[0]
+    trajectory.current_excitons += [excitons] * len(hops)
+
+    if decayed:
+        trajectory._finish_node(0)
+        trajectory.current_excitons.append({})
+
+    return trajectory
+
+
+def calculate_kmc_walk(system, num_trajectories=100, max_steps=10000, silent=False, engine='compiled',
+                       processors=1):
+    """
+    Fast kinetic Monte Carlo for a single exciton in a static system. The rates of all the sites are
+    precomputed once (see RateTable) and the trajectories are run as array-indexed walks.
+
+    :param system: Instance of System class with a single exciton
+    :param num_trajectories: number of trajectories
+    :param max_steps: maximum number of steps per trajectory
+    :param silent: if True do not print progress
+    :param engine: walk engine ('compiled', 'python' or 'lockstep'). The lockstep engine advances all
+                   the trajectories together using vectorized selection
+    :param processors: number of threads (only with the compiled engine, which releases the GIL)
+    :return: list of trajectories
+    """
+    if len(system.centers) != 1:
+        raise Exception('Lattice walk requires a system with a single exciton')
+
+    if engine not in walk_engines:
+        raise Exception('Engine {} not available'.format(engine))
+
+    center = system.centers[0]
+    table = get_rate_table(system, system.molecules[center].state.label)
+
+    if engine == 'lockstep':
+        cell_state = system.molecules[center].cell_state
+        walks, _ = lockstep_walk(table, center, num_trajectories, max_steps, cell_state=cell_state)
+        trajectories = []
+        for hops, times, decayed in walks:
+            if len(times) == max_steps and not decayed:
+                warn('Maximum number of steps reached!!')
+            trajectories.append(walk_trajectory(system, center, hops, times, decayed, table))
+        return trajectories
+
+    def run_walk(j, seed=None):
+        if not silent:
+            print('Trajectory: ', j)
+
+        if engine == 'compiled':
+            hops, times, decayed = lattice_walk_compiled(table, center, max_steps, seed=seed)
+        else:
+            hops, times, decayed = lattice_walk(table, center, max_steps)
+
+        if len(times) == max_steps and not decayed:
+            warn('Maximum number of steps reached!!')
+
+        return walk_trajectory(system, center, hops, times, decayed, table)
+
+    if engine == 'compiled' and processors > 1:
+        # seeds are drawn here so the result only depends on the numpy random state
+        seeds = np.random.randint(2**63, size=num_trajectories, dtype=np.uint64)
+        with ThreadPoolExecutor(max_workers=processors) as executor:
+            return list(executor.map(run_walk, range(num_trajectories), seeds))
+
+    return [run_walk(j) for j in range(num_trajectories)]
@@ -2,6 +2,24 @@ import numpy as np
 from kimonet.core.processes.fcwd import general_fcwd
 from kimonet.utils.units import HBAR_PLANCK
 from kimonet.core.processes.types import GoldenRule, DecayRate, DirectRate
+from kimonet import _ground_state_
+
+
+def discard_realization(system, reference):
+    """
+    removes from the caches the data of a realization of disorder of the reference system that is not used
+    anymore (see calculate_kmc): the couplings of its static data (if it is not the static data of reference)
+    and the spectral overlaps of the molecules with energy offsets
+
+    :param system: Instance of System class with the disorder
+    :param reference: Instance of System class from which it was copied
+    """
+    from kimonet.core.processes.couplings import discard_couplings
+    from kimonet.core.processes.fcwd import disorder_overlap_data
+
+    if system._static_id != reference._static_id:
+        discard_couplings(system._static_id)
+    disorder_overlap_data.clear()
 
 
 def get_processes_and_rates(centre, system):
@@ -40,23 +58,78 @@ def get_transfer_rates(center, system):
 
     donor = system.molecules[center]         # excited molecule
 
-    transfer_rates = []                         # list that collects the transfer rates (only the numerical values)
-    transfer_processes = []                     # list that collects the transfer processes dict(donor,process,acceptor)
+    # with translational symmetry the rate constants are computed only for the molecules of the first cell
+    entries = system.get_neighbour_entries(center)
+    if entries is not None:
+        site_key = (int(system.site_index[center]), hash(frozenset(conditions.items())))
 
-    for neighbour, cell_incr in zip(neighbour_indexes, cell_increment):
+    transfer_processes = []                     # list that collects the transfer processes dict(donor,process,acceptor)
+    acceptors = []
+    for k, (neighbour, cell_incr) in enumerate(zip(neighbour_indexes, cell_increment)):
         acceptor = system.molecules[neighbour]
 
-        allowed_processes = get_allowed_processes(donor, acceptor, system.transfer_scheme)
-
-        for process in allowed_processes:
-
-            transfer_rates.append(process.get_rate_constant(donor, acceptor, conditions, system.supercell, cell_incr))
+        for process in get_allowed_processes(donor, acceptor, system.transfer_scheme):
+            acceptors.append((k, acceptor))
             transfer_processes.append({'donor': int(center), 'process': process, 'acceptor': int(neighbour),
                                        'cell_increment': cell_incr})
 
+    transfer_rates = [None] * len(transfer_processes)   # list that collects the transfer rates (numerical values)
+    keys = [None] * len(transfer_processes)
+    missing = {}                                # transfer processes without rate constant (grouped by process)
+    for i, transfer in enumerate(transfer_processes):
+        k, acceptor = acceptors[i]
+        if entries is not None:
+            keys[i] = (transfer['process'], site_key, int(entries[k]), donor.state.label, acceptor.state.label)
+            if keys[i] in system.rate_constants:
+                transfer_rates[i] = system.rate_constants[keys[i]]
+                continue
+        missing.setdefault(transfer['process'], []).append(i)
+
+    # the rate constants of each process are computed at once for all the neighbours
+    for process, positions in missing.items():
+        rates = process.get_rate_constants(donor,
+                                           [acceptors[i][1] for i in positions],
+                                           conditions,
+                                           system.supercell,
+                                           np.array([transfer_processes[i]['cell_increment'] for i in positions]))
+
+        for i, rate in zip(positions, rates):
+            transfer_rates[i] = float(rate)
+            if keys[i] is not None:
+                system.rate_constants[keys[i]] = transfer_rates[i]
+
     return transfer_processes, transfer_rates
 
 
+def precompute_rates(system, centers=None):
+    """
+    computes the transfer and decay rates of the molecules excited in each donor state of the transfer scheme
+    (with the rest of the molecules in the ground state). This fills the caches (couplings, overlaps and rate
+    constants) before the system is shared, e.g. by the processes of calculate_kmc_parallel.
+
+    :param system: Instance of System class
+    :param centers: molecules whose rates are computed (default: one molecule of each site if translational
+                    symmetry is defined, otherwise the excited molecules)
+    """
+    if centers is None:
+        if system.site_index is not None:
+            centers = np.unique(system.site_index, return_index=True)[1]
+        else:
+            centers = system.centers.indices()
+
+    donor_states = {process.initial[0] for process in system.transfer_scheme}
+
+    # the copy shares the caches with the system
+    system = system.copy()
+    system.reset()
+    for center in centers:
+        for state in donor_states:
+            system.add_excitation_index(state, center)
+            get_transfer_rates(center, system)
+            get_decay_rates(center, system)
+            system.add_excitation_index(_ground_state_, center)
+
+
 def get_decay_rates(center, system):
     """
     :param center: index of the excited molecule
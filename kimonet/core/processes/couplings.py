@@ -1,61 +1,163 @@
 import numpy as np
 from kimonet.utils import distance_vector_periodic
-import inspect
 from kimonet.utils.units import VAC_PERMITTIVITY
+from kimonet.system.molecule import MoleculeView
 from kimonet import _ground_state_
 import kimonet.core.processes.forster as forster
+from kimonet.utils.cache import LRUCache
 
-coupling_data = {}
+coupling_data = LRUCache()      # default cache of the couplings (see set_coupling_cache)
+coupling_caches = {}            # caches of specific coupling functions {function name: cache}
 
 
-def generate_hash(function_name, donor, acceptor, conditions, supercell, cell_incr):
-    # return str(hash((donor, acceptor, function_name))) # No symmetry
+def set_coupling_cache(coupling_function, cache=None):
+    """
+    sets a separate cache for the couplings computed by a coupling function
+
+    :param coupling_function: coupling function (e.g. forster_coupling)
+    :param cache: instance of LRUCache (None: use the default cache coupling_data)
+    """
+    if cache is None:
+        coupling_caches.pop(coupling_function.__name__, None)
+    else:
+        coupling_caches[coupling_function.__name__] = cache
+
+
+def get_coupling_cache(function_name):
+    """
+    :param function_name: name of the coupling function
+    :return: the cache used by the coupling function
+    """
+    return coupling_caches.get(function_name, coupling_data)
+
+
+def discard_couplings(static_id):
+    """
+    removes the couplings of the molecules of a system from the caches (e.g. of a realization of disorder
+    that is not used anymore)
+
+    :param static_id: static id of the system
+    """
+    for cache in [coupling_data] + list(coupling_caches.values()):
+        for key in cache:
+            if isinstance(key, tuple) and len(key) == 5 and isinstance(key[1], tuple) and key[1][0] == static_id:
+                del cache[key]
+
+
+def _molecule_key(molecule):
+    # molecules of a system are identified by the static data of the system, their index and their state
+    # (the static id of the system is renewed when its static data is modified)
+    if isinstance(molecule, MoleculeView):
+        system = molecule._system
+        return system._static_id, molecule._index, system._state_index[molecule._index]
+    return (hash(molecule), tuple(np.ravel(molecule.get_coordinates())), tuple(np.ravel(molecule.orientation)),
+            molecule.state.label)
+
+
+def generate_key(function_name, donor, acceptor, cell_incr, *parameters):
+    """
+    key of the coupling in the cache of the coupling function
+
+    :param function_name: name of the coupling function
+    :param donor: donor molecule
+    :param acceptor: acceptor molecule
+    :param cell_incr: integer vector indicating the difference between supercells of acceptor and donor
+    :param parameters: conditions and arguments used by the coupling function
+    :return: tuple of integers and floats
+    """
+    if isinstance(cell_incr, np.ndarray):
+        cell_incr = cell_incr.tolist()
+
+    return function_name, _molecule_key(donor), _molecule_key(acceptor), tuple(cell_incr), parameters
+
+
+def batch_coupling(function):
+    # marks the coupling functions that also accept a list of acceptors (see GoldenRule.get_rate_constants)
+    function.batch = True
+    return function
+
+
+def _get_couplings(function_name, donor, acceptor, cell_incr, parameters, coupling_function):
+    """
+    cached couplings of the donor with an acceptor (or a list of acceptors). The couplings that are not
+    in the cache of the function are computed at once with coupling_function(acceptors, cell_increments)
+
+    :param function_name: name of the coupling function
+    :param donor: donor molecule
+    :param acceptor: acceptor molecule or list of acceptors
+    :param cell_incr: cell increment or array of cell increments [n_acceptors, dim]
+    :param parameters: conditions and arguments used by the coupling function
+    :param coupling_function: function that returns the array of couplings of a list of acceptors
+    :return: coupling or array of couplings
+    """
+    cache = get_coupling_cache(function_name)
 
-    return str(hash((donor, acceptor, function_name)) +
-               hash(frozenset(conditions.items()))
-               ) + np.array2string(np.array(supercell), precision=12) + np.array2string(np.array(cell_incr, dtype=int))
+    if not isinstance(acceptor, list):
+        key = generate_key(function_name, donor, acceptor, cell_incr, *parameters)
+        coupling = cache.get(key)
+        if coupling is None:
+            coupling = coupling_function([acceptor], np.array([cell_incr]))[0]
+            cache[key] = coupling
+        return coupling
 
+    keys = [generate_key(function_name, donor, acceptor_i, cell_incr_i, *parameters)
+            for acceptor_i, cell_incr_i in zip(acceptor, cell_incr)]
+    couplings = [cache.get(key) for key in keys]
 
+    missing = [i for i, coupling in enumerate(couplings) if coupling is None]
+    if len(missing) > 0:
+        new_couplings = coupling_function([acceptor[i] for i in missing], np.array(cell_incr)[missing])
+        for i, coupling in zip(missing, new_couplings):
+            couplings[i] = cache[keys[i]] = coupling
+
+    return np.array(couplings)
+
+
+@batch_coupling
 def forster_coupling(donor, acceptor, conditions, supercell, cell_incr):
     """
     Compute Forster coupling in eV
 
     :param donor: excited molecules. Donor
-    :param acceptor: neighbouring molecule. Possible acceptor
+    :param acceptor: neighbouring molecule. Possible acceptor (or list of acceptors)
     :param conditions: dictionary with physical conditions
     :param supercell: the supercell of the system
     :param cell_incr: integer vector indicating the difference between supercells of acceptor and donor
-    :return: Forster coupling
+                      (array of vectors [n_acceptors, dim] for a list of acceptors)
+    :return: Forster coupling (array of couplings for a list of acceptors)
     """
 
-    function_name = inspect.currentframe().f_code.co_name
+    ref_index = conditions['refractive_index']                      # refractive index of the material
 
-    # donor <-> acceptor interaction symmetry
-    hash_string = generate_hash(function_name, donor, acceptor, conditions, supercell, cell_incr)
+    def coupling_function(acceptors, cell_increments):
+        mu_d = donor.get_transition_moment(to_state=_ground_state_)      # transition dipole moment (donor) e*angs
+        mu_a = np.array([acceptor_i.get_transition_moment(to_state=donor.state.label)
+                         for acceptor_i in acceptors])                    # transition dipole moments (acceptors) e*angs
 
-    if hash_string in coupling_data:
-        return coupling_data[hash_string]
+        r_vector = intermolecular_vector(donor, acceptors, supercell, cell_increments)  # position vectors
+        return dipole_coupling(mu_d, mu_a, r_vector, ref_index)
 
-    mu_d = donor.get_transition_moment(to_state=_ground_state_)            # transition dipole moment (donor) e*angs
-    mu_a = acceptor.get_transition_moment(to_state=donor.state.label)  # transition dipole moment (acceptor) e*angs
+    # donor <-> acceptor interaction symmetry
+    return _get_couplings('forster_coupling', donor, acceptor, cell_incr, (ref_index,), coupling_function)
 
-    r_vector = intermolecular_vector(donor, acceptor, supercell, cell_incr) # position vector between donor and acceptor
 
-    ref_index = conditions['refractive_index']                      # refractive index of the material
+def dipole_coupling(mu_d, mu_a, r_vector, ref_index):
+    """
+    point dipole coupling in eV. The arguments can be arrays of vectors [n, dim] (broadcasting)
 
-    coupling_data[hash_string] = forster.dipole(mu_d, mu_a, r_vector, n=ref_index)
-    distance = np.linalg.norm(r_vector)
+    :param mu_d: transition dipole moment of the donor
+    :param mu_a: transition dipole moment of the acceptor
+    :param r_vector: position vector between donor and acceptor
+    :param ref_index: refractive index of the material
+    :return: coupling (array of couplings)
+    """
+    distance = np.linalg.norm(r_vector, axis=-1)
 
     k = orientation_factor(mu_d, mu_a, r_vector)              # orientation factor between molecules
 
     k_e = 1.0/(4.0*np.pi*VAC_PERMITTIVITY)
 
-    forster_coupling = k_e * k**2 * np.dot(mu_d, mu_a) / (ref_index**2 * distance**3)
-
-    coupling_data[hash_string] = forster_coupling                            # memory update for new couplings
-
-    # print('f:', forster_coupling, distance, cell_incr)
-    return forster_coupling
+    return k_e * k**2 * np.sum(np.multiply(mu_d, mu_a), axis=-1) / (ref_index**2 * distance**3)
 
 
 def forster_coupling_py(donor, acceptor, conditions, supercell, cell_incr):
@@ -70,13 +172,13 @@ def forster_coupling_py(donor, acceptor, conditions, supercell, cell_incr):
     :return: Forster coupling
     """
 
-    function_name = inspect.currentframe().f_code.co_name
-
     # donor <-> acceptor interaction symmetry
-    hash_string = generate_hash(function_name, donor, acceptor, conditions, supercell, cell_incr)
+    key = generate_key('forster_coupling_py', donor, acceptor, cell_incr, conditions['refractive_index'])
 
-    if hash_string in coupling_data:
-        return coupling_data[hash_string]
+    cache = get_coupling_cache('forster_coupling_py')
+    coupling = cache.get(key)
+    if coupling is not None:
+        return coupling
 
     mu_d = donor.get_transition_moment(to_state=_ground_state_)            # transition dipole moment (donor) e*angs
     mu_a = acceptor.get_transition_moment(to_state=donor.state.label)  # transition dipole moment (acceptor) e*angs
@@ -92,47 +194,45 @@ def forster_coupling_py(donor, acceptor, conditions, supercell, cell_incr):
 
     k_e = 1.0/(4.0*np.pi*VAC_PERMITTIVITY)
 
-    coupling_data[hash_string] = k_e * k**2 * np.dot(mu_d, mu_a) / (ref_index**2 * distance**3)
+    coupling = k_e * k**2 * np.dot(mu_d, mu_a) / (ref_index**2 * distance**3)
+    cache[key] = coupling
 
-    return coupling_data[hash_string]
+    return coupling
 
 
+@batch_coupling
 def forster_coupling_extended(donor, acceptor, conditions, supercell, cell_incr, longitude=3, n_divisions=300):
     """
     Compute Forster coupling in eV
 
     :param donor: excited molecules. Donor
-    :param acceptor: neighbouring molecule. Possible acceptor
+    :param acceptor: neighbouring molecule. Possible acceptor (or list of acceptors)
     :param conditions: dictionary with physical conditions
     :param supercell: the supercell of the system
     :param cell_incr: integer vector indicating the difference between supercells of acceptor and donor
+                      (array of vectors [n_acceptors, dim] for a list of acceptors)
     :param longitude: extension length of the dipole
     :param n_divisions: number of subdivisions. To use with longitude. Increase until convergence.
-    :return: Forster coupling
+    :return: Forster coupling (array of couplings for a list of acceptors)
     """
 
-    function_name = inspect.currentframe().f_code.co_name
-
-    # donor <-> acceptor interaction symmetry
-    hash_string = generate_hash(function_name, donor, acceptor, conditions, supercell, cell_incr)
-    # hash_string = str(hash((donor, acceptor, function_name))) # No symmetry
-
-    if hash_string in coupling_data:
-        return coupling_data[hash_string]
-
-    mu_d = donor.get_transition_moment(to_state=_ground_state_)              # transition dipole moment (donor) e*angs
-    mu_a = acceptor.get_transition_moment(to_state=donor.state.label)    # transition dipole moment (acceptor) e*angs
-
     ref_index = conditions['refractive_index']                      # refractive index of the material
 
-    r_vector = intermolecular_vector(donor, acceptor, supercell, cell_incr)  # position vector between donor and acceptor
+    def coupling_function(acceptors, cell_increments):
+        mu_d = donor.get_transition_moment(to_state=_ground_state_)          # transition dipole moment (donor) e*angs
+        r_vector = intermolecular_vector(donor, acceptors, supercell, cell_increments)  # position vectors
 
-    coupling_data[hash_string] = forster.dipole_extended(r_vector, mu_a, mu_d,
-                                                         n=ref_index,
-                                                         longitude=longitude,
-                                                         n_divisions=n_divisions)
+        return np.array([forster.dipole_extended(r_vector_i,
+                                                 acceptor_i.get_transition_moment(to_state=donor.state.label),
+                                                 mu_d,
+                                                 n=ref_index,
+                                                 longitude=longitude,
+                                                 n_divisions=n_divisions)
+                         for acceptor_i, r_vector_i in zip(acceptors, r_vector)])
 
-    return coupling_data[hash_string]
+    # donor <-> acceptor interaction symmetry
+    return _get_couplings('forster_coupling_extended', donor, acceptor, cell_incr,
+                          (ref_index, longitude, n_divisions), coupling_function)
 
 
 def forster_coupling_extended_py(donor, acceptor, conditions, supercell, cell_incr, longitude=3, n_divisions=300):
@@ -148,14 +248,15 @@ def forster_coupling_extended_py(donor, acceptor, conditions, supercell, cell_in
     :param n_divisions: number of subdivisions. To use with longitude. Increase until convergence.
     :return: Forster coupling
     """
-    function_name = inspect.currentframe().f_code.co_name
-
     # donor <-> acceptor interaction symmetry
-    hash_string = generate_hash(function_name, donor, acceptor, conditions, supercell, cell_incr)
-    # hash_string = str(hash((donor, acceptor, function_name))) # No symmetry
+    key = generate_key('forster_coupling_extended_py', donor, acceptor, cell_incr,
+                       conditions['refractive_index'], longitude, n_divisions)
+    # key = str(hash((donor, acceptor, function_name))) # No symmetry
 
-    if hash_string in coupling_data:
-        return coupling_data[hash_string]
+    cache = get_coupling_cache('forster_coupling_extended_py')
+    coupling = cache.get(key)
+    if coupling is not None:
+        return coupling
 
     mu_d = donor.get_transition_moment(to_state=_ground_state_)              # transition dipole moment (donor) e*angs
     mu_a = acceptor.get_transition_moment(to_state=donor.state.label)    # transition dipole moment (acceptor) e*angs
@@ -184,7 +285,7 @@ def forster_coupling_extended_py(donor, acceptor, conditions, supercell, cell_in
 
             forster_coupling += k_e * k**2 * np.dot(mu_ai, mu_di) / (ref_index**2 * distance**3)
 
-    coupling_data[hash_string] = forster_coupling                            # memory update for new couplings
+    cache[key] = forster_coupling                                    # memory update for new couplings
 
     return forster_coupling
 
@@ -192,11 +293,15 @@ def forster_coupling_extended_py(donor, acceptor, conditions, supercell, cell_in
 def intermolecular_vector(donor, acceptor, supercell, cell_incr):
     """
     :param donor: donor
-    :param acceptor: acceptor
-    :return: the distance between the donor and the acceptor
+    :param acceptor: acceptor (or list of acceptors)
+    :param cell_incr: cell increment (array of cell increments for a list of acceptors)
+    :return: the distance vector between the donor and the acceptor (array of vectors for a list of acceptors)
     """
     position_d = donor.get_coordinates()
-    position_a = acceptor.get_coordinates()
+    if isinstance(acceptor, list):
+        position_a = np.array([acceptor_i.get_coordinates() for acceptor_i in acceptor])
+    else:
+        position_a = acceptor.get_coordinates()
     r_vector = position_a - position_d
     r = distance_vector_periodic(r_vector, supercell, cell_incr)
     return r
@@ -209,7 +314,9 @@ def orientation_factor(u_d, u_a, r):
     :param r:  intermolecular_distance
     :type u_d: np.ndarray
     :type u_a: np.ndarray
-    :type r: float
+    :type r: np.ndarray
+
+    The arguments can also be arrays of vectors [n, dim]
 
     :return: the orientational factor between both molecules
     :rtype: float
@@ -217,49 +324,43 @@ def orientation_factor(u_d, u_a, r):
     nd = unit_vector(u_d)
     na = unit_vector(u_a)
     e = unit_vector(r)
-    return np.dot(nd, na) - 3*np.dot(e, nd)*np.dot(e, na)
+    return np.sum(nd * na, axis=-1) - 3*np.sum(e * nd, axis=-1)*np.sum(e * na, axis=-1)
 
 
 def unit_vector(vector):
     """
-    :param vector:
+    :param vector: vector (or array of vectors [n, dim])
     :return: computes a unity vector in the direction of vector
     """
-    return vector / np.linalg.norm(vector)
+    vector = np.asarray(vector)
+    return vector / np.linalg.norm(vector, axis=-1, keepdims=True)
 
 
+@batch_coupling
 def dexter_coupling(donor, acceptor, conditions, supercell, cell_incr):
     """
     Compute Dexter coupling in eV
 
     :param donor: excited molecules. Donor
-    :param acceptor: neighbouring molecule. Possible acceptor
+    :param acceptor: neighbouring molecule. Possible acceptor (or list of acceptors)
     :param conditions: dictionary with physical conditions
     :param supercell: the supercell of the system
-    :return: Dexter coupling
+    :param cell_incr: integer vector indicating the difference between supercells of acceptor and donor
+                      (array of vectors [n_acceptors, dim] for a list of acceptors)
+    :return: Dexter coupling (array of couplings for a list of acceptors)
     """
 
-    function_name = inspect.currentframe().f_code.co_name
-
-    # donor <-> acceptor interaction symmetry
-    hash_string = generate_hash(function_name, donor, acceptor, conditions, supercell, cell_incr)
-
-    # hash_string = str(hash((donor, acceptor, function_name))) # No symmetry
-
-    if hash_string in coupling_data:
-        return coupling_data[hash_string]
-
-    r_vector = intermolecular_vector(donor, acceptor, supercell, cell_incr)       # position vector between donor and acceptor
-
-    distance = np.linalg.norm(r_vector)
-
     k_factor = conditions['dexter_k']
-    vdw_radius_sum = donor.get_vdw_radius() + acceptor.get_vdw_radius()
-    dexter_coupling = k_factor * np.exp(-2 * distance / vdw_radius_sum)
 
-    coupling_data[hash_string] = dexter_coupling                            # memory update for new couplings
+    def coupling_function(acceptors, cell_increments):
+        r_vector = intermolecular_vector(donor, acceptors, supercell, cell_increments)   # position vectors
+        distance = np.linalg.norm(r_vector, axis=-1)
 
-    return dexter_coupling
+        vdw_radius_sum = donor.get_vdw_radius() + np.array([acceptor_i.get_vdw_radius() for acceptor_i in acceptors])
+        return k_factor * np.exp(-2 * distance / vdw_radius_sum)
+
+    # donor <-> acceptor interaction symmetry
+    return _get_couplings('dexter_coupling', donor, acceptor, cell_incr, (k_factor,), coupling_function)
 
 
 if __name__ == '__main__':
@@ -1,12 +1,14 @@
 import numpy as np
 from kimonet.utils.units import BOLTZMANN_CONSTANT
+from kimonet.utils.cache import LRUCache
 from scipy.integrate import quad
 import math
 
 ###########################################################################################################
 #                                 Frank-Condon weighted density
 ###########################################################################################################
-overlap_data = {}
+overlap_data = LRUCache()      # cache of the spectral overlaps
+disorder_overlap_data = LRUCache()      # spectral overlaps of molecules with energy offsets (see calculate_kmc)
 
 
 def general_fcwd(donor, acceptor, process, conditions):
@@ -29,12 +31,22 @@ def general_fcwd(donor, acceptor, process, conditions):
     donor_vib_dos = donor.get_vib_dos(transition_donor)
     acceptor_vib_dos = acceptor.get_vib_dos(transition_acceptor)
 
-    # print(donor_vib_dos)
-    info = str(hash(donor_vib_dos) + hash(acceptor_vib_dos))
+    # the spectra are defined by the vibrations model and the energies of the transitions
+    # (the spectrum functions themselves are created for each call and cannot be used as key)
+    info = (hash(donor.vibrations), transition_donor,
+            donor.get_state_energy(transition_donor[0]) - donor.get_state_energy(transition_donor[1]),
+            hash(acceptor.vibrations), transition_acceptor,
+            acceptor.get_state_energy(transition_acceptor[0]) - acceptor.get_state_energy(transition_acceptor[1]))
 
-    if info in overlap_data:
+    # the overlaps with energetic disorder are only reused within a realization
+    cache = overlap_data
+    if donor.energy_offset != 0 or acceptor.energy_offset != 0:
+        cache = disorder_overlap_data
+
+    spectral_overlap = cache.get(info)
+    if spectral_overlap is not None:
         # the memory is used if the overlap has been already computed
-        return overlap_data[info]
+        return spectral_overlap
 
     # test_donor = quad(donor_vib_dos, 0, np.inf,  epsabs=1e-20)[0]
     # test_acceptor = quad(acceptor_vib_dos, 0, np.inf,  epsabs=1e-20)[0]
@@ -48,9 +60,10 @@ def general_fcwd(donor, acceptor, process, conditions):
     def overlap(x):
         return donor_vib_dos(x) * acceptor_vib_dos(x)
 
-    overlap_data[info] = quad(overlap, 0, np.inf,  epsabs=1e-5, limit=1000)[0]
+    spectral_overlap = quad(overlap, 0, np.inf,  epsabs=1e-5, limit=1000)[0]
+    cache[info] = spectral_overlap
 
-    return overlap_data[info]
+    return spectral_overlap
 
     # return quad(integrand, 0, np.inf, args=(donor, acceptor))[0]
 
@@ -75,11 +88,8 @@ def marcus_fcwd_old(donor, acceptor, conditions):
     info = str(hash((T, gibbs_energy, reorganization, 'marcus')))
     # we define a compact string with the characteristic information of the spectral overlap
 
-    if info in overlap_data:
-        # the memory is used if the overlap has been already computed
-        overlap = overlap_data[info]
-
-    else:
+    overlap = overlap_data.get(info)
+    if overlap is None:
         overlap = 1.0 / (2 * np.sqrt(np.pi * BOLTZMANN_CONSTANT * T * reorganization)) * \
                   np.exp(-(gibbs_energy+reorganization)**2 / (4 * BOLTZMANN_CONSTANT * T * reorganization))
 
@@ -16,6 +16,18 @@ class BaseProcess:
         self.description = description
         self.arguments = arguments if arguments is not None else {}
 
+    def get_rate_constants(self, donor, acceptors, conditions, supercell, cell_increments):
+        """
+        rate constants of the transfer from donor to a list of acceptors (get_rate_constant is called for
+        each acceptor)
+
+        :param acceptors: list of acceptors
+        :param cell_increments: array of cell increments [n_acceptors, dim]
+        :return: list of rate constants
+        """
+        return [self.get_rate_constant(donor, acceptor, conditions, supercell, cell_incr)
+                for acceptor, cell_incr in zip(acceptors, cell_increments)]
+
 
 class GoldenRule(BaseProcess):
     def __init__(self,
@@ -37,6 +49,22 @@ class GoldenRule(BaseProcess):
         spectral_overlap = general_fcwd(donor, acceptor, self, conditions)
         return 2 * np.pi / HBAR_PLANCK * e_coupling ** 2 * spectral_overlap  # Fermi's Golden Rule
 
+    def get_rate_constants(self, donor, acceptors, conditions, supercell, cell_increments):
+        """
+        rate constants of the transfer from donor to a list of acceptors. If the coupling function supports
+        it (see couplings.batch_coupling) the couplings of all the acceptors are computed in one call
+
+        :param acceptors: list of acceptors
+        :param cell_increments: array of cell increments [n_acceptors, dim]
+        :return: list of rate constants
+        """
+        if not getattr(self._coupling_function, 'batch', False):
+            return BaseProcess.get_rate_constants(self, donor, acceptors, conditions, supercell, cell_increments)
+
+        e_couplings = self.get_electronic_coupling(donor, list(acceptors), conditions, supercell, cell_increments)
+        spectral_overlaps = np.array([general_fcwd(donor, acceptor, self, conditions) for acceptor in acceptors])
+        return list(2 * np.pi / HBAR_PLANCK * e_couplings ** 2 * spectral_overlaps)  # Fermi's Golden Rule
+
 
 class DirectRate(BaseProcess):
     def __init__(self,
@@ -1,6 +1,10 @@
 import h5py
 from kimonet.analysis.trajectory_graph import TrajectoryGraph
 import pickle
+import hashlib
+import sqlite3
+import io
+import os
 import numpy as np
 
 
@@ -44,3 +48,313 @@ def load_trajectory_list(filename):
         trajectory_list.append(trajectory)
 
     return trajectory_list
+
+
+# single file format of System (see store_system)
+_system_file_id = b'KIMONET1'
+_system_file_alignment = 4096
+
+# arrays of the state of the system (modifiable), the rest of arrays are static data (read only)
+_system_state_arrays = ('_state_index', '_cell_states')
+
+
+def _align(position):
+    return -(-position // _system_file_alignment) * _system_file_alignment
+
+
+def store_system(system, filename):
+    """
+    stores the system in a single file that can be loaded with memory mapping (see load_system).
+    The arrays (coordinates, orientations, types, state, neighbour graph..) are stored raw and the rest of the
+    data (molecule templates, conditions, transfer scheme..) is pickled in the header. The neighbour graph is
+    built if it is not available (in a copy, the system is not modified).
+
+    :param system: Instance of System class
+    :param filename: file name
+    """
+    from kimonet.system.state import get_state_label
+
+    if not system._has_neighbour_graph():
+        system = system.copy()
+        system.build_neighbour_graph()
+
+    data = system.__dict__.copy()
+    del data['molecules']
+
+    # caches are not stored (they are rebuilt when needed)
+    data.update({'neighbors': {}, '_neighbour_entries': {}, 'rate_constants': {}, 'rate_tables': {}, '_tree': None})
+    data['rate_catalog'] = system.rate_catalog.sampler
+
+    graph = data.pop('neighbour_graph')
+    data['neighbour_graph'] = graph.radius
+    for name in ['indptr', 'indices', 'cell_increments']:
+        data['neighbour_graph.' + name] = getattr(graph, name)
+
+    # the global table of states may be different when the system is loaded
+    data['_state_labels'] = [get_state_label(index) for index in range(int(np.max(system._state_index)) + 1)]
+
+    arrays = []
+    offset = 0
+    for name, value in list(data.items()):
+        if isinstance(value, np.ndarray) and value.size > 0:
+            data[name] = (value.dtype.str, value.shape, offset)
+            arrays.append((name, value))
+            offset = _align(offset + value.nbytes)
+
+    header = pickle.dumps((data, [name for name, _ in arrays]))
+
+    with open(filename, 'wb') as f:
+        f.write(_system_file_id)
+        f.write(np.uint64(len(header)).tobytes())
+        f.write(header)
+        start = _align(f.tell())
+        for name, array in arrays:
+            f.write(b'\0' * (start + data[name][2] - f.tell()))
+            np.ascontiguousarray(array).tofile(f)
+
+
+def load_system(filename, file_backed=False):
+    """
+    loads a system stored with store_system. The arrays are memory mapped (not read until they are used) so
+    the processes that load the same file share the memory. The static data is read only and the state of
+    the system (molecule states and cell states) is copy on write.
+
+    :param filename: file name
+    :param file_backed: if True the system and its copies (e.g. in the trajectories) are pickled with a reference
+                        to the file instead of the static arrays (the file must be available to unpickle them)
+    :return: Instance of System class
+    """
+    from kimonet.system import System, MoleculeList, NeighbourGraph
+    from kimonet.system.state import get_state_index
+    from kimonet.core.catalog import RateCatalog
+
+    with open(filename, 'rb') as f:
+        if f.read(len(_system_file_id)) != _system_file_id:
+            raise Exception('{} is not a system file'.format(filename))
+        header_size = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        data, array_names = pickle.loads(f.read(header_size))
+        start = _align(f.tell())
+
+    for name in array_names:
+        dtype, shape, offset = data[name]
+        mode = 'c' if name in _system_state_arrays else 'r'
+        data[name] = np.memmap(filename, dtype=dtype, mode=mode, offset=start + offset, shape=shape)
+
+    state_table = np.array([get_state_index(label) for label in data.pop('_state_labels')], dtype=np.int8)
+    if np.any(state_table != np.arange(len(state_table))):
+        data['_state_index'] = state_table[data['_state_index']]
+
+    data['neighbour_graph'] = NeighbourGraph(data['neighbour_graph'],
+                                             *[data.pop('neighbour_graph.' + name)
+                                               for name in ['indptr', 'indices', 'cell_increments']],
+                                             file_backed=file_backed)
+    data['file_backed'] = file_backed
+    data['rate_catalog'] = RateCatalog(sampler=data['rate_catalog'])
+
+    system = System.__new__(System)
+    system.__dict__.update(data)
+    system.molecules = MoleculeList(system)
+
+    return system
+
+
+def _array_to_bytes(array):
+    data = io.BytesIO()
+    np.save(data, np.asarray(array))
+    return data.getvalue()
+
+
+def _array_from_bytes(data):
+    return np.load(io.BytesIO(data))
+
+
+def _get_digest(data):
+    return hashlib.sha256(pickle.dumps(data, protocol=4)).hexdigest()
+
+
+class PrecomputationStore:
+    """
+    persistent store (SQLite file) of the data precomputed to set up the rates of a system: the neighbour
+    graph, the couplings (coupling_data) and the spectral overlaps (overlap_data). The data of each system is
+    identified by a content hash of its geometry, molecule templates, transfer scheme and conditions, so
+    re-running the same system (e.g. with other number of trajectories or seeds) skips the setup of the rates.
+    The molecule templates and the transfer scheme must be picklable.
+    """
+    def __init__(self, filename):
+        """
+        :param filename: file name of the store (it is created if it does not exist)
+        """
+        self.filename = filename
+        self._pid = os.getpid()
+        self._connection = sqlite3.connect(filename, timeout=60)
+        with self._connection:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS neighbours (record TEXT, radius REAL, '
+                                     'indptr BLOB, indices BLOB, cell_increments BLOB, PRIMARY KEY (record, radius))')
+            for table in ['couplings', 'overlaps']:
+                self._connection.execute('CREATE TABLE IF NOT EXISTS {} (record TEXT, key BLOB, value REAL, '
+                                         'PRIMARY KEY (record, key))'.format(table))
+
+        self._saved_neighbours = set()  # (record, radius) of the neighbour graphs that are already in the store
+        self._journals = {}             # cache -> keys inserted in the cache that are not in the store yet
+
+    def _get_journal(self, cache):
+        # the keys of the cache are followed from the first time it is used (see LRUCache.journal)
+        if cache not in self._journals:
+            self._journals[cache] = cache.journal()
+        return self._journals[cache]
+
+    def _get_connection(self):
+        # SQLite connections cannot be shared with forked processes
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._connection = sqlite3.connect(self.filename, timeout=60)
+        return self._connection
+
+    def get_record(self, system):
+        """
+        :param system: Instance of System class
+        :return: content hash that identifies the data of the system in the store (it is computed each time,
+                 the templates and the transfer scheme can be modified without renewing the static id)
+        """
+        digest = hashlib.sha256()
+        arrays = [system._coordinates, system._orientations, system._type_index,
+                  np.array(system.supercell, dtype=float)]
+        if system._energy_offsets is not None:
+            arrays.append(system._energy_offsets)
+        for array in arrays:
+            digest.update(str((array.dtype.str, array.shape)).encode())
+            digest.update(np.ascontiguousarray(array).tobytes())
+
+        # the decay rates cached in the templates (decay_dict) are not part of the content
+        templates = [{name: value for name, value in vars(template).items() if name != 'decay_dict'}
+                     for template in system._templates]
+        try:
+            digest.update(pickle.dumps((templates, system.transfer_scheme, system.conditions,
+                                        system.cutoff_radius), protocol=4))
+        except (pickle.PicklingError, AttributeError, TypeError) as error:
+            raise Exception('The system cannot be identified in the store: {}'.format(error))
+
+        return digest.hexdigest()
+
+    @staticmethod
+    def _get_vibrations_digests(system):
+        # the hash of the vibrations (used in the keys of overlap_data) is not the same in other processes
+        digests = {}
+        for template in system._templates:
+            try:
+                digests[hash(template.vibrations)] = _get_digest(template.vibrations)
+            except (pickle.PicklingError, AttributeError, TypeError):
+                pass
+        return digests
+
+    def load(self, system):
+        """
+        loads the data of the system stored in a previous run: sets the neighbour graph of the system
+        (if it was stored for the current cutoff radius) and fills the caches of couplings and overlaps
+
+        :param system: Instance of System class
+        """
+        from kimonet.system import NeighbourGraph
+        from kimonet.system.state import get_state_index
+        from kimonet.core.processes.couplings import get_coupling_cache
+        from kimonet.core.processes.fcwd import overlap_data
+
+        record = self.get_record(system)
+        connection = self._get_connection()
+
+        row = connection.execute('SELECT indptr, indices, cell_increments FROM neighbours '
+                                       'WHERE record=? AND radius=?', (record, system.cutoff_radius)).fetchone()
+        if row is not None:
+            system.neighbour_graph = NeighbourGraph(system.cutoff_radius, *[_array_from_bytes(data) for data in row])
+            self._saved_neighbours.add((record, system.cutoff_radius))
+
+        for data, value in connection.execute('SELECT key, value FROM couplings WHERE record=?', (record,)):
+            function_name, (index_d, state_d), (index_a, state_a), cell_incr, parameters = pickle.loads(data)
+            key = (function_name,
+                   (system._static_id, index_d, get_state_index(state_d)),
+                   (system._static_id, index_a, get_state_index(state_a)),
+                   cell_incr, parameters)
+            cache = get_coupling_cache(function_name)
+            cache[key] = value
+            self._get_journal(cache).discard(key)
+
+        vibrations = {digest: vibrations_hash
+                      for vibrations_hash, digest in self._get_vibrations_digests(system).items()}
+        for data, value in connection.execute('SELECT key, value FROM overlaps WHERE record=?', (record,)):
+            digest_d, transition_d, gap_d, digest_a, transition_a, gap_a = pickle.loads(data)
+            if digest_d in vibrations and digest_a in vibrations:
+                key = (vibrations[digest_d], transition_d, gap_d, vibrations[digest_a], transition_a, gap_a)
+                overlap_data[key] = value
+                self._get_journal(overlap_data).discard(key)
+
+    def save(self, system):
+        """
+        writes the data of the system that is not in the store yet: the neighbour graph of the system and
+        the couplings and overlaps of its molecules inserted in the caches since the last save (or load)
+
+        :param system: Instance of System class
+        """
+        from kimonet.system.state import get_state_label
+        from kimonet.core.processes.couplings import coupling_data, coupling_caches
+        from kimonet.core.processes.fcwd import overlap_data
+
+        record = self.get_record(system)
+
+        graph = system.neighbour_graph
+        neighbours = []
+        if graph is not None and (record, graph.radius) not in self._saved_neighbours:
+            neighbours.append((record, graph.radius, _array_to_bytes(graph.indptr), _array_to_bytes(graph.indices),
+                               _array_to_bytes(graph.cell_increments)))
+            self._saved_neighbours.add((record, graph.radius))
+
+        # only the couplings between molecules of this system (same static data), the new couplings of other
+        # systems are kept in the journal for their own save
+        couplings = []
+        for cache in [coupling_data] + list(coupling_caches.values()):
+            journal = self._get_journal(cache)
+            for key in list(journal):
+                if not isinstance(key, tuple) or len(key) != 5:
+                    journal.discard(key)
+                    continue
+                function_name, donor, acceptor, cell_incr, parameters = key
+                if not (isinstance(donor, tuple) and donor[0] == system._static_id and
+                        isinstance(acceptor, tuple) and acceptor[0] == system._static_id):
+                    continue
+                data = (function_name,
+                        (int(donor[1]), get_state_label(donor[2])),
+                        (int(acceptor[1]), get_state_label(acceptor[2])),
+                        cell_incr, parameters)
+                couplings.append((record, pickle.dumps(data, protocol=4), float(cache[key])))
+                journal.discard(key)
+
+        # only the overlaps between the vibrations of the molecules of this system
+        digests = self._get_vibrations_digests(system)
+        overlaps = []
+        journal = self._get_journal(overlap_data)
+        for key in list(journal):
+            if not isinstance(key, tuple) or len(key) != 6:
+                journal.discard(key)
+                continue
+            if key[0] not in digests or key[3] not in digests:
+                continue
+            data = (digests[key[0]], key[1], float(key[2]), digests[key[3]], key[4], float(key[5]))
+            overlaps.append((record, pickle.dumps(data, protocol=4), float(overlap_data[key])))
+            journal.discard(key)
+
+        connection = self._get_connection()
+        with connection:
+            connection.executemany('INSERT OR IGNORE INTO neighbours VALUES (?, ?, ?, ?, ?)', neighbours)
+            connection.executemany('INSERT OR IGNORE INTO couplings VALUES (?, ?, ?)', couplings)
+            connection.executemany('INSERT OR IGNORE INTO overlaps VALUES (?, ?, ?)', overlaps)
+
+    def close(self):
+        for cache, journal in self._journals.items():
+            cache.release_journal(journal)
+        self._journals = {}
+        self._get_connection().close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
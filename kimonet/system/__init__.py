@@ -1,73 +1,592 @@
 import numpy as np
 import itertools
-import copy
-from scipy.spatial import distance
+import uuid
+from scipy.spatial import cKDTree
+from scipy.optimize import lsq_linear
 from kimonet.utils import distance_vector_periodic
+from kimonet.core.catalog import RateCatalog
+from kimonet.system.molecule import MoleculeView, get_molecule_types
+from kimonet.system.state import get_state_index, get_state_label
+from kimonet.system.initial_conditions import sample_excitations
 from kimonet import _ground_state_
 
 
+def _pack_arrays(state, file_backed=False):
+    # memory mapped arrays (see kimonet.fileio.load_system) are pickled as arrays, or as a reference to their
+    # file if they are read only and file_backed is True
+    for name, value in state.items():
+        if not isinstance(value, np.memmap):
+            continue
+        if file_backed and value.mode == 'r' and value.filename is not None:
+            state[name] = _MappedArray(value.filename, value.dtype.str, value.shape, value.offset)
+        else:
+            state[name] = np.array(value)
+    return state
+
+
+def _unpack_arrays(state):
+    for name, value in state.items():
+        if isinstance(value, _MappedArray):
+            state[name] = np.memmap(value.filename, dtype=value.dtype, mode='r', offset=value.offset,
+                                    shape=value.shape)
+    return state
+
+
+class _MappedArray:
+    def __init__(self, filename, dtype, shape, offset):
+        self.filename = filename
+        self.dtype = dtype
+        self.shape = shape
+        self.offset = offset
+
+
+class NeighbourGraph:
+    def __init__(self, radius, indptr, indices, cell_increments, file_backed=False):
+        """
+        Neighbours of all the molecules of a system in CSR format
+
+        :param radius: cutoff radius
+        :param indptr: the neighbours of molecule i are the entries indptr[i]:indptr[i+1]
+        :param indices: index of the neighbour molecule of each entry
+        :param cell_increments: cell increment of each entry
+        :param file_backed: if True the memory mapped arrays are pickled as a reference to their file
+        """
+        self.radius = radius
+        self.indptr = indptr
+        self.indices = indices
+        self.cell_increments = cell_increments
+        self.file_backed = file_backed
+
+    def get_neighbours(self, center):
+        start, end = self.indptr[center], self.indptr[center + 1]
+        return [self.indices[start:end], self.cell_increments[start:end]]
+
+    def __getstate__(self):
+        return _pack_arrays(self.__dict__.copy(), self.file_backed)
+
+    def __setstate__(self, state):
+        self.__dict__.update(_unpack_arrays(state))
+
+
+def _read_only(array):
+    # the arrays of static data are shared between copies of the system, they are replaced instead of modified
+    array.flags.writeable = False
+    return array
+
+
+class MoleculeList:
+    def __init__(self, system):
+        """
+        Molecules of a system (see MoleculeView). The views are created when they are accessed
+
+        :param system: Instance of System class
+        """
+        self._system = system
+        self._views = {}
+
+    def __len__(self):
+        return len(self._system._type_index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        index = int(index)
+        if index not in self._views:
+            if index < 0:
+                return self[index + len(self)]
+            template = self._system._templates[self._system._type_index[index]]
+            self._views[index] = MoleculeView(template, self._system, index)
+        return self._views[index]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+class CenterList:
+    def __init__(self, centers=()):
+        """
+        Indices of the excited molecules of a system in order of excitation. The indices are the keys
+        of an (ordered) dictionary, so adding, removing and membership checks are O(1)
+
+        :param centers: initial list of indices
+        """
+        self._centers = dict.fromkeys(int(center) for center in centers)
+
+    def __len__(self):
+        return len(self._centers)
+
+    def __iter__(self):
+        return iter(list(self._centers))
+
+    def __contains__(self, center):
+        return center in self._centers
+
+    def __getitem__(self, index):
+        if index == 0 and len(self._centers) > 0:
+            return next(iter(self._centers))
+        return list(self._centers)[index]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def append(self, center):
+        self._centers[int(center)] = None
+
+    def remove(self, center):
+        del self._centers[center]
+
+    def indices(self):
+        """
+        :return: array with the indices of the excited molecules
+        """
+        return np.fromiter(self._centers, dtype=int, count=len(self._centers))
+
+
 class System:
     def __init__(self,
                  molecules,
                  conditions,
                  supercell,
                  transfers=None,
-                 cutoff_radius=10):
+                 cutoff_radius=10,
+                 neighbour_graph=False,
+                 type_index=None,
+                 coordinates=None,
+                 orientations=None):
+        """
+        :param molecules: list of molecules. If type_index is defined, list of template molecules (one for each type)
+        :param conditions: dictionary with physical conditions
+        :param supercell: supercell vectors
+        :param transfers: transfer scheme
+        :param cutoff_radius: maximum interaction distance
+        :param neighbour_graph: if True the neighbours of all the molecules are computed at once (see
+                                build_neighbour_graph) the first time they are needed for the current cutoff radius
+        :param type_index: type of each molecule (index in molecules)
+        :param coordinates: coordinates of each molecule (used with type_index)
+        :param orientations: orientation of each molecule (used with type_index)
+        """
+
+        if type_index is None:
+            n_molecules = len(molecules)
 
-        self.molecules = molecules
-        self.conditions = conditions
-        self.supercell = supercell
+            # one template molecule for each type of molecule (copied, the molecules of the list are not used by
+            # the system)
+            templates, self._type_index = get_molecule_types(molecules)
+            self._templates = [template.copy() for template in templates]
+            coordinates = [molecule.get_coordinates() for molecule in molecules]
+            orientations = [molecule.orientation for molecule in molecules]
+            state_index = [get_state_index(molecule.state.label) for molecule in molecules]
+            cell_states = [molecule.cell_state for molecule in molecules]
+        else:
+            n_molecules = len(type_index)
+
+            self._templates = list(molecules)
+            self._type_index = np.array(type_index, dtype=np.int32)
+            template_states = [get_state_index(molecule.state.label) for molecule in self._templates]
+            state_index = np.array(template_states, dtype=np.int8)[self._type_index]
+            cell_states = np.zeros_like(coordinates, dtype=np.int32)
+
+        # static data (shared between copies of the system)
+        self._coordinates = _read_only(np.array(coordinates, dtype=float).reshape(n_molecules, -1))
+        self._orientations = _read_only(np.array(orientations, dtype=float).reshape(n_molecules, -1))
+        self._energy_offsets = None  # energy offset of the excited states of each molecule (see set_disorder)
+        self._static_id = uuid.uuid4().int  # identifies the static data in the caches of the couplings
+
+        # state of the system (one copy for each trajectory)
+        self._state_index = np.array(state_index, dtype=np.int8)
+        self._cell_states = np.array(cell_states, dtype=np.int32).reshape(n_molecules, -1)
+        self.molecules = MoleculeList(self)
+
+        self._conditions = conditions
+        self._supercell = supercell
         self.neighbors = {}
         self.is_finished = False
+        self.rate_catalog = RateCatalog()
+        self.rate_tables = {}
+
+        # translational symmetry: (unit cell site, cell index) of each molecule
+        self.site_index = None
+        self.cell_index = None
+        self.dimensions = None
+        self._cell_table = None
+        self._neighbour_entries = {}
+        self.rate_constants = {}  # rate constants of the unique sites (shared between copies)
+        self._tree = None         # spatial index of the molecule coordinates (shared between copies)
+        self._supercell_increments = {}
+
+        self._transfer_scheme = transfers if transfers is not None else {}
+        self._cutoff_radius = cutoff_radius
 
-        self.transfer_scheme = transfers if transfers is not None else {}
-        self.cutoff_radius = cutoff_radius
+        self.neighbour_graph = None
+        self.use_neighbour_graph = neighbour_graph
+        self.file_backed = False    # see kimonet.fileio.load_system
 
         # search centers
-        self.centers = []
-        for i, molecule in enumerate(self.molecules):
-            if molecule.state.label != _ground_state_:
-                self.centers.append(i)
+        self.centers = CenterList(np.nonzero(self._state_index != get_state_index(_ground_state_))[0])
+
+    def set_translational_symmetry(self, site_index, cell_index, dimensions):
+        """
+        defines the decomposition of the molecules in (unit cell site, cell index). All the copies of a unit cell
+        site must be identical (besides translation), so neighbours and rates are computed only for the molecules
+        of the first cell and translated to the others.
+
+        :param site_index: unit cell site of each molecule
+        :param cell_index: cell index vector of each molecule (0 <= cell_index < dimensions)
+        :param dimensions: number of cells in each direction of the supercell
+        """
+        self.site_index = np.array(site_index, dtype=int)
+        self.cell_index = np.array(cell_index, dtype=int).reshape(len(self.site_index), -1)
+        self.dimensions = np.array(dimensions, dtype=int)
+
+        n_cells = int(np.prod(self.dimensions))
+        self._cell_table = np.full((np.max(self.site_index) + 1, n_cells), -1, dtype=int)
+        self._cell_table[self.site_index, np.ravel_multi_index(self.cell_index.T, self.dimensions)] = \
+            np.arange(len(self.site_index))
+
+        if np.any(self._cell_table < 0):
+            raise Exception('Incomplete translational symmetry decomposition')
+
+        # the rates of the molecules of the first cell are used for all the copies of each site
+        reference = self._cell_table[self.site_index, 0]
+        unitcell = np.array(self.supercell, dtype=float) / self.dimensions[:, None]
+        translations = np.dot(self.cell_index - self.cell_index[reference], unitcell)
+        if not (np.array_equal(self._type_index, self._type_index[reference]) and
+                np.allclose(self._orientations, self._orientations[reference]) and
+                (self._energy_offsets is None or np.allclose(self._energy_offsets, self._energy_offsets[reference])) and
+                np.allclose(self._coordinates - self._coordinates[reference], translations, atol=1e-6)):
+            raise Exception('The copies of the unit cell sites are not equivalent')
+
+        self.neighbors = {}
+        self._neighbour_entries = {}
+        self.rate_constants = {}
+
+    def set_disorder(self, energy_offsets=None, orientations=None):
+        """
+        sets the static disorder of the molecules (see kimonet.system.disorder). The arrays are replaced (not
+        modified) so the disorder of a copy of the system does not affect the original one. Disorder breaks
+        the translational symmetry, so the symmetry decomposition and the cached rates are discarded (the
+        cell index of the molecules is kept). The couplings do not depend on the energies, so they are only
+        discarded (new static id) if the orientations change.
+
+        :param energy_offsets: energy offset of the excited states of each molecule (eV)
+        :param orientations: orientation angles of each molecule
+        """
+        if energy_offsets is not None:
+            self._energy_offsets = _read_only(np.array(energy_offsets, dtype=float).reshape(len(self._type_index)))
+        if orientations is not None:
+            self._orientations = _read_only(np.array(orientations, dtype=float).reshape(self._orientations.shape))
+        self._static_data_changed(symmetry=True, couplings=orientations is not None)
+
+    def _static_data_changed(self, geometry=False, symmetry=False, couplings=True):
+        """
+        discards the data cached for the previous static data (couplings, rate constants..)
+
+        :param geometry: the coordinates or the supercell changed (the neighbours are computed again)
+        :param symmetry: the molecules of a site are not equivalent anymore (the translational symmetry is dropped,
+                         the cell index of the molecules is kept)
+        :param couplings: the couplings may have changed (the static id, used in the keys of the couplings,
+                          is renewed)
+        """
+        if couplings:
+            self._static_id = uuid.uuid4().int
+        self.rate_constants = {}
+        self.rate_tables = {}
+        self.rate_catalog.clear()
+
+        if geometry:
+            self._tree = None
+            self._supercell_increments = {}
+            self.neighbors = {}
+            self.neighbour_graph = None
+
+        if geometry or symmetry:
+            self.site_index = None
+            self._cell_table = None
+            self._neighbour_entries = {}
+
+    def _set_static_value(self, name, index, value):
+        # the arrays of static data are shared between copies (and may be read only), so they are replaced
+        array = np.array(getattr(self, name))
+        array[index] = value
+        setattr(self, name, _read_only(array))
+        self._static_data_changed(geometry=name == '_coordinates', symmetry=True)
+
+    def set_geometry(self, coordinates=None, orientations=None, indices=None):
+        """
+        sets the coordinates and/or the orientations of several molecules at once. Each change through a molecule
+        of the system (set_coordinates, set_orientation) replaces the whole array and discards the cached data
+        (O(N) per molecule, O(N^2) to move all the molecules), here this is done only once.
+
+        :param coordinates: coordinates of the molecules
+        :param orientations: orientation angles of the molecules
+        :param indices: indices of the molecules (default: all the molecules)
+        """
+        if indices is None:
+            indices = slice(None)
+
+        if coordinates is not None:
+            array = np.array(self._coordinates)
+            array[indices] = coordinates
+            self._coordinates = _read_only(array)
+            self._cell_states[indices] = 0
+        if orientations is not None:
+            array = np.array(self._orientations)
+            array[indices] = orientations
+            self._orientations = _read_only(array)
+        self._static_data_changed(geometry=coordinates is not None, symmetry=True)
+
+    @property
+    def supercell(self):
+        return self._supercell
+
+    @supercell.setter
+    def supercell(self, supercell):
+        self._supercell = supercell
+        self._static_data_changed(geometry=True)
+
+    @property
+    def transfer_scheme(self):
+        return self._transfer_scheme
+
+    @transfer_scheme.setter
+    def transfer_scheme(self, transfer_scheme):
+        self._transfer_scheme = transfer_scheme
+        self._static_data_changed()
+
+    @property
+    def conditions(self):
+        return self._conditions
+
+    @conditions.setter
+    def conditions(self, conditions):
+        self._conditions = conditions
+        self._static_data_changed()
+
+    @property
+    def cutoff_radius(self):
+        return self._cutoff_radius
+
+    @cutoff_radius.setter
+    def cutoff_radius(self, cutoff_radius):
+        self._cutoff_radius = cutoff_radius
+        self._static_data_changed()
+
+    def get_reference(self, center):
+        """
+        :param center: index of the molecule
+        :return: index of the equivalent molecule in the first cell (None if no translational symmetry is defined)
+        """
+        if self.site_index is None:
+            return None
+        return int(self._cell_table[self.site_index[center], 0])
 
     def get_neighbours(self, center):
 
         radius = self.cutoff_radius
-        center_position = self.molecules[center].get_coordinates()
 
-        def get_supercell_increments(supercell, radius):
-            # TODO: This function can be optimized as a function of the particular molecule coordinates
-            v = np.array(radius/np.linalg.norm(supercell, axis=1), dtype=int) + 1  # here extensive approximation
-            return list(itertools.product(*[range(-i, i+1) for i in v]))
+        if self.use_neighbour_graph and not self._has_neighbour_graph():
+            self.build_neighbour_graph()
 
-        cell_increments = get_supercell_increments(self.supercell, radius)
+        if self._has_neighbour_graph():
+            return self.neighbour_graph.get_neighbours(center)
 
         if not '{}_{}'.format(center, radius) in self.neighbors:
-            neighbours = []
-            jumps = []
-            for i, molecule in enumerate(self.molecules):
-                coordinates = molecule.get_coordinates()
-                for cell_increment in cell_increments:
-                    r_vec = distance_vector_periodic(coordinates - center_position, self.supercell, cell_increment)
-                    if 0 < np.linalg.norm(r_vec) < radius:
-                        neighbours.append(i)
-                        jumps.append(cell_increment)
-
-            neighbours = np.array(neighbours)
-            jumps = np.array(jumps)
+            reference = self.get_reference(center)
+            if reference is None or reference == center:
+                neighbours, jumps = self._compute_neighbours(center, radius)
+            else:
+                neighbours, jumps = self._translate_neighbours(center, reference)
 
             self.neighbors['{}_{}'.format(center, radius)] = [neighbours, jumps]
 
         return self.neighbors['{}_{}'.format(center, radius)]
 
+    def get_neighbour_entries(self, center):
+        """
+        :param center: index of the molecule
+        :return: position of each neighbour of center in the neighbour list of its reference molecule
+                 (see get_reference). None if no translational symmetry is defined
+        """
+        if self.site_index is None:
+            return None
+
+        key = '{}_{}'.format(center, self.cutoff_radius)
+        if key not in self._neighbour_entries:
+            reference = self.get_reference(center)
+            if reference == center:
+                self._neighbour_entries[key] = np.arange(len(self.get_neighbours(center)[0]))
+            else:
+                self._translate_neighbours(center, reference)
+        return self._neighbour_entries[key]
+
+    def _has_neighbour_graph(self):
+        return self.neighbour_graph is not None and self.neighbour_graph.radius == self.cutoff_radius
+
+    def build_neighbour_graph(self):
+        """
+        computes the neighbours of all the molecules at once for the current cutoff radius and stores them
+        in CSR format (see NeighbourGraph). The graph is used by get_neighbours and shared between copies
+        of the system.
+        """
+        radius = self.cutoff_radius
+        tree = self._get_tree()
+        coordinates = tree.data
+        cell_increments = self._get_supercell_increments(radius)
+
+        centers = []
+        neighbours = []
+        increment_index = []
+        for k, cell_increment in enumerate(cell_increments):
+            # candidates (slightly larger radius, the exact check is done below)
+            image_tree = cKDTree(coordinates + np.dot(cell_increment, self.supercell))
+            pairs = tree.sparse_distance_matrix(image_tree, radius * (1 + 1e-8), output_type='ndarray')
+
+            r_vec = distance_vector_periodic(coordinates[pairs['j']] - coordinates[pairs['i']], self.supercell,
+                                             np.tile(cell_increment, (len(pairs), 1)))
+            distances = np.linalg.norm(r_vec, axis=1)
+            mask = (0 < distances) & (distances < radius)
+
+            centers.append(pairs['i'][mask])
+            neighbours.append(pairs['j'][mask])
+            increment_index.append(np.full(np.count_nonzero(mask), k))
+
+        centers = np.concatenate(centers)
+        neighbours = np.concatenate(neighbours)
+        increment_index = np.concatenate(increment_index)
+
+        # same order as get_neighbours: by center, neighbour index and cell increment
+        order = np.lexsort([increment_index, neighbours, centers])
+
+        n_molecules = self.get_num_molecules()
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(centers, minlength=n_molecules))])
+        index_type = np.int32 if n_molecules < 2**31 else np.int64
+        increment_type = np.int8 if np.max(np.abs(cell_increments)) < 128 else np.int64
+
+        self.neighbour_graph = NeighbourGraph(radius,
+                                              indptr,
+                                              neighbours[order].astype(index_type),
+                                              cell_increments[increment_index[order]].astype(increment_type))
+
+    def _get_tree(self):
+        if self._tree is None:
+            self._tree = cKDTree(self._coordinates)
+        return self._tree
+
+    def _get_supercell_increments(self, radius):
+        # cell increments of the images that can contain molecules within radius of a molecule
+        if radius not in self._supercell_increments:
+            supercell = np.array(self.supercell, dtype=float)
+            reciprocal = np.linalg.inv(supercell)
+
+            # span of the molecules in the supercell basis
+            scaled_coordinates = np.dot(self._coordinates, reciprocal)
+            span = np.max(scaled_coordinates, axis=0) - np.min(scaled_coordinates, axis=0) + 1e-8
+
+            # the images are bounded by the spacing of the supercell planes
+            v = np.array(radius * np.linalg.norm(reciprocal, axis=0) + span, dtype=int)
+            cell_increments = np.array(list(itertools.product(*[range(-i, i+1) for i in v])), dtype=int)
+
+            # minimum distance between the molecules of the first cell and the ones of each image
+            reachable = [lsq_linear(supercell.T, np.zeros(len(span)), bounds=(increment - span, increment + span),
+                                    method='bvls').cost < radius ** 2 / 2 * (1 + 1e-6)
+                         for increment in cell_increments]
+            self._supercell_increments[radius] = cell_increments[reachable]
+
+        return self._supercell_increments[radius]
+
+    def _compute_neighbours(self, center, radius):
+        center_position = self.molecules[center].get_coordinates()
+        cell_increments = self._get_supercell_increments(radius)
+
+        # candidates of all the images at once (slightly larger radius, the exact check is done below)
+        tree = self._get_tree()
+        images = center_position - np.dot(cell_increments, self.supercell)
+        candidates = tree.query_ball_point(images, radius * (1 + 1e-8))
+
+        neighbours = np.concatenate([np.array(c, dtype=int) for c in candidates])
+        increment_index = np.repeat(np.arange(len(cell_increments)), [len(c) for c in candidates])
+
+        r_vec = distance_vector_periodic(tree.data[neighbours] - center_position, self.supercell,
+                                         cell_increments[increment_index])
+        distances = np.linalg.norm(r_vec, axis=1)
+        mask = (0 < distances) & (distances < radius)
+
+        if not np.any(mask):
+            return np.array([]), np.array([])
+
+        # same order as the loop over molecules and cell increments
+        neighbours, increment_index = neighbours[mask], increment_index[mask]
+        order = np.lexsort([increment_index, neighbours])
+
+        return neighbours[order], cell_increments[increment_index[order]]
+
+    def _translate_neighbours(self, center, reference):
+        # neighbours of center from the ones of the equivalent molecule in the first cell
+        neighbours, jumps = self.get_neighbours(reference)
+        if len(neighbours) == 0:
+            self._neighbour_entries['{}_{}'.format(center, self.cutoff_radius)] = np.array([], dtype=int)
+            return neighbours, jumps
+
+        cells = self.cell_index[neighbours] + self.cell_index[center]
+        wraps, cells = np.divmod(cells, self.dimensions)
+
+        neighbours = self._cell_table[self.site_index[neighbours], np.ravel_multi_index(cells.T, self.dimensions)]
+        jumps = jumps + wraps
+
+        # same order as the direct computation: by index and then by cell increment
+        order = np.lexsort(list(jumps.T[::-1]) + [neighbours])
+        self._neighbour_entries['{}_{}'.format(center, self.cutoff_radius)] = order
+
+        return neighbours[order], jumps[order]
+
     def reset(self):
-        for molecule in self.molecules:
-            molecule.set_state(_ground_state_)
-            molecule.cell_state = np.zeros(molecule.get_dim())
-        self.centers = []
+        # only the excited molecules are modified (the cell state of molecules in the ground state is zero)
+        centers = self.centers.indices()
+        self._state_index[centers] = get_state_index(_ground_state_)
+        self._cell_states[centers] = 0
+        self.centers = CenterList()
         self.is_finished = False
+        self.rate_catalog.clear()
 
     def copy(self):
-        return copy.deepcopy(self)
+        """
+        returns a copy of the system. Only the state (state of the molecules, cell states and centers) is copied,
+        the static data (molecules, conditions, supercell, transfer scheme, neighbours and cached rates)
+        is shared with the original system
+
+        :return: a copy of the system
+        """
+        # the neighbour graph is built before copying, so it is shared by the copies
+        if self.use_neighbour_graph and not self._has_neighbour_graph():
+            self.build_neighbour_graph()
+
+        system = System.__new__(System)
+        system.__dict__.update(self.__dict__)
+        system._state_index = self._state_index.copy()
+        system._cell_states = self._cell_states.copy()
+        system.molecules = MoleculeList(system)
+        system.centers = CenterList(self.centers)
+        system.rate_catalog = RateCatalog(sampler=self.rate_catalog.sampler)
+        return system
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['molecules']
+        # the global table of states may be different when the system is loaded
+        labels = [get_state_label(index) for index in range(int(np.max(self._state_index, initial=0)) + 1)]
+        state['_state_index'] = (labels, np.array(self._state_index))
+        return _pack_arrays(state, self.file_backed)
+
+    def __setstate__(self, state):
+        labels, state_index = state['_state_index']
+        state['_state_index'] = np.array([get_state_index(label) for label in labels], dtype=np.int8)[state_index]
+        self.__dict__.update(_unpack_arrays(state))
+        self.molecules = MoleculeList(self)
 
     def get_num_molecules(self):
         return len(self.molecules)
@@ -76,34 +595,59 @@ class System:
         return len(self.centers)
 
     def add_excitation_index(self, type, index):
-        self.molecules[index].set_state(type)
+        index = int(index)
+        if type not in self._templates[self._type_index[index]]._labels_to_state:
+            raise Exception('State {} not defined in molecule'.format(type))
+
+        self._state_index[index] = get_state_index(type)
+        self._invalidate_rates(index)
         if type == _ground_state_:
-            try:
+            if index in self.centers:
                 self.centers.remove(index)
-            except ValueError:
-                pass
         else:
             if not index in self.centers:
                 self.centers.append(index)
 
+    def _invalidate_rates(self, index):
+        # the rates of a center depend on the state of its neighbours (neighbourhood is symmetric)
+        if len(self.rate_catalog) == 0:
+            return
+
+        self.rate_catalog.invalidate(index)
+        for neighbour in self.get_neighbours(index)[0]:
+            self.rate_catalog.invalidate(int(neighbour))
+
+    def add_excitations(self, type, indices):
+        """
+        excites several molecules at once (see kimonet.system.initial_conditions)
+
+        :param type: state label
+        :param indices: indices of the molecules
+        """
+        indices = np.array(indices, dtype=int).reshape(-1)
+        for template_index in np.unique(self._type_index[indices]):
+            if type not in self._templates[template_index]._labels_to_state:
+                raise Exception('State {} not defined in molecule'.format(type))
+
+        self._state_index[indices] = get_state_index(type)
+        for index in indices:
+            self._invalidate_rates(index)
+            if type == _ground_state_:
+                if index in self.centers:
+                    self.centers.remove(index)
+            else:
+                self.centers.append(index)
+
     def add_excitation_random(self, type, n):
-        for i in range(n):
-            while True:
-                num = np.random.randint(0, self.get_num_molecules())
-                if self.molecules[num].set_state(_ground_state_):
-                    # self.molecules[num] = type
-                    self.add_excitation_index(type, num)
-                    break
+        self.add_excitations(type, sample_excitations(self, n)[0])
 
     def add_excitation_center(self, type):
         center_coor = np.diag(self.supercell)/2
-        min = np.linalg.norm(self.supercell[0])
-        index = 0
-        for i, molecule in enumerate(self.molecules):
-            dist = distance.euclidean(center_coor, molecule.get_coordinates())
-            if dist < min:
-                min = dist
-                index = i
+        distances = np.sqrt(np.sum((self._coordinates - center_coor) ** 2, axis=1))
+
+        index = int(np.argmin(distances))
+        if not distances[index] < np.linalg.norm(self.supercell[0]):
+            index = 0
 
         self.add_excitation_index(type, index)
 
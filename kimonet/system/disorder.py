@@ -0,0 +1,78 @@
+import numpy as np
+
+
+def gaussian_field(system, n_fields=1, correlation_length=None):
+    """
+    draws standard normal random values for all the molecules of the system at once. If the correlation length
+    is defined the values are spatially correlated with C(r) = exp(-r^2 / (2 * correlation_length^2)). The
+    correlated field is generated by filtering white noise on the (periodic) grid of cells of the system with FFT,
+    so the cell decomposition of the system is required (see set_translational_symmetry) and all the molecules
+    of the same cell share the same value (the correlation length should be larger than the unit cell).
+
+    :param system: Instance of System class
+    :param n_fields: number of independent fields
+    :param correlation_length: correlation length (Angstrom). If None the values are not correlated
+    :return: array with the values of the fields for each molecule [n_molecules, n_fields]
+    """
+    n_molecules = system.get_num_molecules()
+    if correlation_length is None:
+        return np.random.standard_normal((n_molecules, n_fields))
+
+    if system.cell_index is None:
+        raise Exception('Correlated disorder requires the cell decomposition of the system')
+
+    dimensions = system.dimensions
+    n_dim = len(dimensions)
+
+    # wave vectors of the grid of cells
+    unitcell = np.array(system.supercell, dtype=float) / dimensions[:, None]
+    reciprocal = 2 * np.pi * np.linalg.inv(unitcell).T
+    frequencies = np.meshgrid(*[np.fft.fftfreq(n) for n in dimensions], indexing='ij')
+    k_vectors = np.tensordot(reciprocal.T, np.array(frequencies), axes=1)
+
+    # filter (square root of the power spectrum) normalized to keep unit variance
+    spectrum_filter = np.exp(-np.sum(k_vectors ** 2, axis=0) * correlation_length ** 2 / 4)
+    spectrum_filter /= np.sqrt(np.mean(spectrum_filter ** 2))
+
+    axes = tuple(range(1, n_dim + 1))
+    noise = np.random.standard_normal((n_fields,) + tuple(dimensions))
+    fields = np.fft.ifftn(np.fft.fftn(noise, axes=axes) * spectrum_filter, axes=axes).real
+
+    return fields[(slice(None),) + tuple(system.cell_index.T)].T
+
+
+def energetic_disorder(system, deviation, correlation_length=None):
+    """
+    sets gaussian disorder of the excited state energies (one offset for each molecule).
+    To generate a new realization for each trajectory apply it to a copy of the system (see calculate_kmc)
+
+    :param system: Instance of System class
+    :param deviation: standard deviation of the energies (eV)
+    :param correlation_length: correlation length (Angstrom). If None the disorder is not correlated
+    :return: energy offsets of the molecules
+    """
+    offsets = deviation * gaussian_field(system, correlation_length=correlation_length)[:, 0]
+    system.set_disorder(energy_offsets=offsets)
+    return offsets
+
+
+def orientational_disorder(system, deviation=None, correlation_length=None):
+    """
+    sets random orientations of the molecules.
+    To generate a new realization for each trajectory apply it to a copy of the system (see calculate_kmc)
+
+    :param system: Instance of System class
+    :param deviation: standard deviation of the orientation angles (radians) around the current orientations.
+                      If None the angles are uniformly distributed in [0, 2pi)
+    :param correlation_length: correlation length (Angstrom) of the gaussian disorder
+    :return: orientations of the molecules
+    """
+    shape = system._orientations.shape
+    if deviation is None:
+        orientations = np.random.random_sample(shape) * 2 * np.pi
+    else:
+        fields = gaussian_field(system, n_fields=shape[1], correlation_length=correlation_length)
+        orientations = system._orientations + deviation * fields
+
+    system.set_disorder(orientations=orientations)
+    return orientations
@@ -1,6 +1,14 @@
 import numpy as np
-import itertools
 from kimonet.system import System
+from kimonet.utils import reduce_cell, get_minimal_supercell
+
+
+def _cell_grid(size):
+    """
+    :param size: number of cells in each direction
+    :return: index vector of all the cells [n_cells, n_dim] (in itertools.product order)
+    """
+    return np.indices(size).reshape(len(size), -1).T
 
 
 def regular_ordered_system(conditions,
@@ -12,18 +20,28 @@ def regular_ordered_system(conditions,
     if lattice is None:
         lattice = {'size': [1], 'parameters': [1.0]}  # default 1D 1 molecule system
 
-    molecules = []                              # list of instances of class molecule
-    for subset in itertools.product(*[list(range(n)) for n in lattice['size']]):
-        coordinates = np.multiply(subset, lattice['parameters'])
+    if orientation is None:
+        orientation = [0, 0, 0]
+
+    cell_index = _cell_grid(lattice['size'])
+    n_molecules = len(cell_index)
+
+    # all the sites share a single template molecule
+    template = molecule.copy()
+    template.set_orientation(orientation)
 
-        molecule = molecule.copy()  # copy of the generic instance
-        molecule.set_coordinates(coordinates)
-        molecule.set_orientation(orientation)
-        molecules.append(molecule)
+    coordinates = cell_index * np.array(lattice['parameters'])
+    orientations = np.broadcast_to(np.array(template.orientation, dtype=float), (n_molecules, len(template.orientation)))
 
     supercell = np.diag(np.multiply(lattice['size'], lattice['parameters']))
 
-    return System(molecules, conditions, supercell)
+    system = System([template], conditions, supercell,
+                    type_index=np.zeros(n_molecules, dtype=int),
+                    coordinates=coordinates,
+                    orientations=orientations)
+    system.set_translational_symmetry(np.zeros(n_molecules, dtype=int), cell_index, lattice['size'])
+
+    return system
 
 
 def regular_system(conditions,
@@ -35,21 +53,10 @@ def regular_system(conditions,
     if lattice is None:
         lattice = {'size': [1], 'parameters': [1.0]}  # default 1D 1 molecule system
 
-    molecules = []  # list of instances of class molecule
-    for subset in itertools.product(*[list(range(n)) for n in lattice['size']]):
-        coordinates = np.multiply(subset, lattice['parameters'])
-
-        if orientation is None:
-            orientation = np.random.random_sample(3) * 2*np.pi
+    if orientation is None:
+        orientation = np.random.random_sample(3) * 2*np.pi
 
-        molecule = molecule.copy()  # copy of the generic instance
-        molecule.set_coordinates(coordinates)
-        molecule.set_orientation(orientation)
-        molecules.append(molecule)
-
-    supercell = np.diag(np.multiply(lattice['size'], lattice['parameters']))
-
-    return System(molecules, conditions, supercell)
+    return regular_ordered_system(conditions, molecule, lattice=lattice, orientation=orientation)
 
 
 def crystal_system(conditions,
@@ -70,26 +77,69 @@ def crystal_system(conditions,
     if orientations is None:
         orientations = [None for _ in range(n_mol)]
 
-    molecules_list = []                              # list of instances of class molecule
+    cell_index = _cell_grid(dimensions)
+    n_cells = len(cell_index)
+
+    # position of each cell
+    r_cells = cell_index[:, 0, None] * unitcell[0]
+    for k in range(1, n_dim):
+        r_cells = r_cells + cell_index[:, k, None] * unitcell[k]
 
+    # one template molecule for each unit cell site
+    templates = []
+    coordinates_list = []
+    orientations_list = []
     for i, (coordinate, molecule) in enumerate(zip(scaled_site_coordinates, molecules)):
-        for subset in itertools.product(*[list(range(n)) for n in dimensions]):
+        template = molecule.copy()  # copy of the generic instance
+        template.name = 'a{}'.format(i+1)
+        templates.append(template)
 
-            r_cell = np.sum([s * lattice_vector for s, lattice_vector in zip(subset, unitcell)], axis=0)
-            coor = r_cell + np.dot(unitcell.T, coordinate)
+        coordinates_list.append(r_cells + np.dot(unitcell.T, coordinate))
 
-            molecule = molecule.copy()  # copy of the generic instance
-            molecule.set_coordinates(coor)
-            molecule.name = 'a{}'.format(i+1)
+        if orientations[i] is None:
+            orientations_list.append(np.random.random_sample((n_cells, 3)) * 2 * np.pi)
+        else:
+            orientations_list.append(np.broadcast_to(np.array(orientations[i], dtype=float),
+                                                     (n_cells, len(orientations[i]))))
 
-            if orientations[i] is None:
-                final_orientation = np.random.random_sample(3) * 2 * np.pi
-            else:
-                final_orientation = orientations[i]
+    site_index = np.repeat(np.arange(n_mol), n_cells)
+    supercell = np.dot(unitcell.T, np.diag(dimensions)).T
 
-            molecule.set_orientation(final_orientation)
-            molecules_list.append(molecule)
+    system = System(templates, conditions, supercell,
+                    type_index=site_index,
+                    coordinates=np.concatenate(coordinates_list),
+                    orientations=np.concatenate(orientations_list))
 
-    supercell = np.dot(unitcell.T, np.diag(dimensions)).T
+    # random orientations break the translational symmetry
+    if not any(orientation is None for orientation in orientations):
+        system.set_translational_symmetry(site_index, np.tile(cell_index, (n_mol, 1)), dimensions)
 
-    return System(molecules_list, conditions, supercell)
+    return system
+
+
+def minimal_crystal_system(conditions,
+                           molecules,
+                           scaled_site_coordinates,
+                           unitcell,
+                           cutoff_radius,
+                           orientations=None,
+                           ):
+    """
+    crystal system with the smallest supercell in which no molecule is within the cutoff radius of its own
+    images (see get_minimal_supercell). This is enough for single exciton simulations since the periodic
+    images are tracked with the cell state. The unit cell is reduced first (see reduce_cell), so the scaled
+    site coordinates of the system are the ones in the reduced cell.
+    """
+    reduced_cell, transformation = reduce_cell(unitcell)
+    inverse = np.round(np.linalg.inv(transformation))
+    scaled_site_coordinates = np.mod(np.dot(scaled_site_coordinates, inverse), 1)
+
+    system = crystal_system(conditions,
+                            molecules,
+                            scaled_site_coordinates,
+                            dimensions=get_minimal_supercell(reduced_cell, cutoff_radius),
+                            unitcell=reduced_cell,
+                            orientations=orientations)
+    system.cutoff_radius = cutoff_radius
+
+    return system
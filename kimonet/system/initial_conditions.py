@@ -0,0 +1,72 @@
+import numpy as np
+from kimonet.system.state import get_state_index
+from kimonet import _ground_state_
+
+
+def gaussian_profile(system, center, width, axes=None):
+    """
+    gaussian excitation profile (pump spot)
+
+    :param system: Instance of System class
+    :param center: coordinates of the center of the spot
+    :param width: standard deviation of the spot (Angstrom)
+    :param axes: directions used to compute the distance to the center (default: all)
+    :return: weight of each molecule
+    """
+    if axes is None:
+        axes = list(range(system._coordinates.shape[1]))
+
+    r_vector = system._coordinates[:, axes] - np.array(center, dtype=float)[axes]
+    return np.exp(-np.sum(r_vector ** 2, axis=1) / (2 * width ** 2))
+
+
+def absorption_profile(system, absorption_coefficient, axis=-1):
+    """
+    depth dependent excitation profile (Beer-Lambert absorption). The surface is at the minimum coordinate
+    of the molecules along axis
+
+    :param system: Instance of System class
+    :param absorption_coefficient: absorption coefficient (Angstrom^-1)
+    :param axis: direction of the depth
+    :return: weight of each molecule
+    """
+    depth = system._coordinates[:, axis] - np.min(system._coordinates[:, axis])
+    return np.exp(-absorption_coefficient * depth)
+
+
+def sample_excitations(system, n=None, density=None, profile=None, num_trajectories=1):
+    """
+    samples the initial positions of the excitons for a batch of trajectories (without replacement and only
+    molecules in the ground state). Each position is chosen with probability proportional to the profile
+    weight of the molecule among the ones not chosen yet. The molecules of each trajectory are selected at
+    once with Gumbel keys (the n largest of log(weight) + Gumbel noise).
+
+    :param system: Instance of System class
+    :param n: number of excitons of each trajectory
+    :param density: number of excitons per volume unit of the supercell (used if n is not defined)
+    :param profile: weight of each molecule (see gaussian_profile, absorption_profile). Default: uniform
+    :param num_trajectories: number of trajectories
+    :return: indices of the excited molecules of each trajectory [num_trajectories, n]
+    """
+    if n is None:
+        if density is None:
+            raise Exception('Number of excitons or density must be defined')
+        n = int(np.round(density * system.get_volume()))
+
+    n_molecules = system.get_num_molecules()
+    weights = np.ones(n_molecules) if profile is None else np.array(profile, dtype=float)
+    weights[system._state_index != get_state_index(_ground_state_)] = 0
+
+    if np.count_nonzero(weights) < n:
+        raise Exception('Not enough molecules in the ground state with non zero weight')
+
+    with np.errstate(divide='ignore'):
+        log_weights = np.log(weights)
+
+    indices = np.zeros((num_trajectories, n), dtype=int)
+    for i in range(num_trajectories):
+        keys = log_weights - np.log(-np.log(np.random.random_sample(n_molecules)))
+        selected = np.argpartition(-keys, n - 1)[:n] if n > 0 else np.array([], dtype=int)
+        indices[i] = selected[np.argsort(-keys[selected])]
+
+    return indices
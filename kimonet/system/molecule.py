@@ -3,10 +3,14 @@ from kimonet.utils import rotate_vector
 import copy
 from kimonet.utils.units import DEBYE_TO_ANGS_EL
 from kimonet.system.vibrations import NoVibration
+from kimonet.system.state import State, get_state_label
 from kimonet import _ground_state_
 
 
 class Molecule:
+    # energy offset of the excited states (see MoleculeView, the states of standalone molecules include it)
+    energy_offset = 0.0
+
 
     def __init__(self,
                  states,  # eV
@@ -162,3 +166,200 @@ class Molecule:
     @property
     def state(self):
         return self._state
+
+
+class MoleculeView(Molecule):
+    """
+    Molecule of a system. The data shared by all the molecules of the same type (states, transition moments,
+    vibrations, decays..) is the one of the template molecule of its type, while the coordinates, orientation,
+    state, cell state and energy offset of the excited states (energetic disorder) are stored in the arrays
+    of the system. Each change of the coordinates or the orientation replaces the whole array of the system
+    and discards its cached data, use System.set_geometry to change several molecules.
+    """
+    __slots__ = ('_system', '_index')
+
+    def __init__(self, template, system, index):
+        object.__setattr__(self, '__dict__', template.__dict__)
+        object.__setattr__(self, '_system', system)
+        object.__setattr__(self, '_index', index)
+
+    def __setattr__(self, name, value):
+        # the attributes of the template are shared by all the molecules of the same type (and the copies of
+        # the system), only the data stored in the arrays of the system can be modified through a view
+        if name not in _view_attributes:
+            raise AttributeError('{} is shared by all the molecules of the same type and cannot be modified '
+                                 'through a molecule of the system'.format(name))
+        object.__setattr__(self, name, value)
+
+    @property
+    def _coordinates(self):
+        return self._system._coordinates[self._index]
+
+    @_coordinates.setter
+    def _coordinates(self, coordinates):
+        self._system._set_static_value('_coordinates', self._index, coordinates)
+
+    @property
+    def orientation(self):
+        return self._system._orientations[self._index]
+
+    @orientation.setter
+    def orientation(self, orientation):
+        self._system._set_static_value('_orientations', self._index, orientation)
+
+    @property
+    def _state(self):
+        return self._labels_to_state[get_state_label(self._system._state_index[self._index])]
+
+    @_state.setter
+    def _state(self, state):
+        self.set_state(state.label)
+
+    def set_state(self, state_label):
+        # the state of the molecules of a system is changed through the system to keep the list of
+        # centers and the rates catalog up to date (see System.add_excitation_index)
+        self._system.add_excitation_index(state_label, self._index)
+
+    @property
+    def cell_state(self):
+        return self._system._cell_states[self._index].copy()
+
+    @cell_state.setter
+    def cell_state(self, cell_state):
+        self._system._cell_states[self._index] = cell_state
+
+    @property
+    def energy_offset(self):
+        offsets = self._system._energy_offsets
+        return 0.0 if offsets is None else float(offsets[self._index])
+
+    def get_state_energies(self):
+        """
+        :return: dictionary {'state': energy} including the energy offset of the excited states
+        """
+        offset = self.energy_offset
+        return {label: energy + offset if label != _ground_state_ else energy
+                for label, energy in self.vibrations.state_energies.items()}
+
+    def get_state_energy(self, state=None):
+        if state is None:
+            state = self._state.label
+        energy = self._labels_to_state[state].energy
+        if state != _ground_state_:
+            energy += self.energy_offset
+        return energy
+
+    def get_vib_dos(self, transition):
+        if self.energy_offset == 0:
+            return self.vibrations.get_vib_spectrum(transition)
+        return self.vibrations.get_vib_spectrum(transition, state_energies=self.get_state_energies())
+
+    def decay_rates(self):
+        """
+        returns the dacay rate for the current state
+        :return: decay rate.
+        """
+        if self.energy_offset == 0:
+            return Molecule.decay_rates(self)
+
+        # the decay rates of molecules with energetic disorder are not stored in the (shared) template
+        decay_rates = {}
+        for coupling in self.decays:
+            if coupling.initial == self._state.label:
+                decay_rates[coupling] = coupling.get_rate_constant(self)
+        return decay_rates
+
+    def copy(self):
+        """
+        returns a (standalone) copy of this molecule
+        :return: a copy of molecule
+        """
+        molecule = Molecule.__new__(Molecule)
+        molecule.__dict__ = copy.deepcopy(self.__dict__)
+        molecule._coordinates = self._coordinates.copy()
+        molecule.orientation = self.orientation.copy()
+        molecule.cell_state = self.cell_state
+
+        offset = self.energy_offset
+        if offset != 0:
+            # the energy offset is included in the states of the copy
+            molecule._states = [State(s.label, s.energy + offset if s.label != _ground_state_ else s.energy,
+                                      s.multiplicity) for s in molecule._states]
+            molecule._labels_to_state = {s.label: s for s in molecule._states}
+            molecule.vibrations.set_state_energies({s.label: s.energy for s in molecule._states})
+            molecule.decay_dict = {}
+
+        molecule._state = molecule._labels_to_state[self._state.label]
+        return molecule
+
+
+# attributes that are specific of each molecule (not part of the molecule type)
+_molecule_attributes = ('_coordinates', 'orientation', '_state', 'cell_state', 'decay_dict')
+
+# attributes of MoleculeView that are stored in the arrays of the system
+_view_attributes = ('_coordinates', 'orientation', '_state', 'cell_state')
+
+
+def _equal(a, b):
+    # structural comparison of the molecule data
+    if a is b:
+        return True
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, np.ndarray):
+        return a.shape == b.shape and np.array_equal(a, b)
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(_equal(a[k], b[k]) for k in a)
+    if isinstance(a, (list, tuple)):
+        return len(a) == len(b) and all(_equal(x, y) for x, y in zip(a, b))
+    if hasattr(a, '__dict__') and not callable(a):
+        return _equal(a.__dict__, b.__dict__)
+    try:
+        return bool(a == b)
+    except (TypeError, ValueError):
+        return False
+
+
+def _type_key(molecule):
+    # cheap key of the molecule type (equal molecules have the same key). The vibrations are only included
+    # if they define a hash of their parameters
+    vibrations = molecule.vibrations
+    if type(vibrations).__hash__ is object.__hash__:
+        vibrations_key = type(vibrations)
+    else:
+        vibrations_key = hash(vibrations)
+
+    transition_moments = tuple(sorted((key, tuple(np.ravel(value).tolist()))
+                                      for key, value in molecule.transition_moment.items()))
+
+    return (type(molecule), molecule.name, tuple((s.label, s.energy) for s in molecule._states),
+            vibrations_key, transition_moments)
+
+
+def get_molecule_types(molecules):
+    """
+    groups the molecules that are equal besides coordinates, orientation, state and cell state. The molecules
+    are only compared with the templates of the same key (see _type_key)
+
+    :param molecules: list of Molecule instances
+    :return: list of template molecules (one for each type) and the type index of each molecule
+    """
+    templates = []
+    templates_data = []
+    buckets = {}
+    type_index = np.zeros(len(molecules), dtype=np.int32)
+    for i, molecule in enumerate(molecules):
+        key = _type_key(molecule)
+        data = {k: v for k, v in molecule.__dict__.items() if k not in _molecule_attributes}
+
+        for index in buckets.setdefault(key, []):
+            if _equal(data, templates_data[index]):
+                type_index[i] = index
+                break
+        else:
+            buckets[key].append(len(templates))
+            type_index[i] = len(templates)
+            templates.append(molecule)
+            templates_data.append(data)
+
+    return templates, type_index
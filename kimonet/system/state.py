@@ -1,3 +1,5 @@
+from kimonet import _ground_state_
+
 
 class State:
     def __init__(self,
@@ -19,3 +21,27 @@ class State:
     @property
     def multiplicity(self):
         return self._multiplicity
+
+
+# global table of state labels. The state of the molecules of a system is stored as an index in this table
+_state_labels = [_ground_state_]
+_state_indices = {_ground_state_: 0}
+
+
+def get_state_index(label):
+    """
+    :param label: state label
+    :return: index of the label in the global table of states (the ground state is always 0)
+    """
+    if label not in _state_indices:
+        _state_indices[label] = len(_state_labels)
+        _state_labels.append(label)
+    return _state_indices[label]
+
+
+def get_state_label(index):
+    """
+    :param index: index in the global table of states
+    :return: state label
+    """
+    return _state_labels[index]
@@ -26,15 +26,20 @@ class MarcusModel:
         """
 
     def __hash__(self):
+        # all the parameters of the spectrum (used in the keys of the spectral overlaps)
         return hash((str(self.state_energies),
-                     str(self.reorganization_energies)))
+                     str(self.reorganization_energies),
+                     self.temperature))
 
     def set_state_energies(self, state_energies):
         self.state_energies = state_energies
 
-    def get_vib_spectrum(self, transition):
+    def get_vib_spectrum(self, transition, state_energies=None):
+
+        if state_energies is None:
+            state_energies = self.state_energies
 
-        elec_trans_ene = self.state_energies[transition[1]] - self.state_energies[transition[0]]
+        elec_trans_ene = state_energies[transition[1]] - state_energies[transition[0]]
 
         temp = self.temperature  # temperature (K)
         reorg_ene = np.sum(self.reorganization_energies[transition])
@@ -74,17 +79,22 @@ class LevichJortnerModel:
         """
 
     def __hash__(self):
+        # all the parameters of the spectrum (used in the keys of the spectral overlaps)
         return hash((str(self.state_energies),
                      str(self.frequencies),
                      str(self.external_reorganization_energies),
-                     str(self.reorganization_energies)))
+                     str(self.reorganization_energies),
+                     self.temperature))
 
     def set_state_energies(self, state_energies):
         self.state_energies = state_energies
 
-    def get_vib_spectrum(self, transition):
+    def get_vib_spectrum(self, transition, state_energies=None):
 
-        elec_trans_ene = self.state_energies[transition[1]] - self.state_energies[transition[0]]
+        if state_energies is None:
+            state_energies = self.state_energies
+
+        elec_trans_ene = state_energies[transition[1]] - state_energies[transition[0]]
 
         temp = self.temperature  # temperature (K)
         ext_reorg_ene = self.external_reorganization_energies[transition]
@@ -134,17 +144,36 @@ class EmpiricalModel:
 
         self.empirical_function = empirical_function
         self.state_energies = None
+        self.spectrum_energies = None   # state energies of the empirical spectra (the first ones that are set)
 
     def __hash__(self):
         return hash((str(self.state_energies),
                      str(self.empirical_function)))
 
     def set_state_energies(self, state_energies):
+        if self.spectrum_energies is None:
+            self.spectrum_energies = dict(state_energies)
         self.state_energies = state_energies
 
-    def get_vib_spectrum(self, transition):
+    def get_vib_spectrum(self, transition, state_energies=None):
         # Temperature is not actually used. This is to keep common interface
-        return self.empirical_function[transition]
+        if state_energies is None:
+            state_energies = self.state_energies
+
+        spectrum = self.empirical_function[transition]
+        if state_energies is None or self.spectrum_energies is None:
+            return spectrum
+
+        # the spectrum is shifted with the energy of the transition (e.g. energy offsets of disorder)
+        shift = (abs(state_energies[transition[1]] - state_energies[transition[0]]) -
+                 abs(self.spectrum_energies[transition[1]] - self.spectrum_energies[transition[0]]))
+        if shift == 0:
+            return spectrum
+
+        def vib_spectrum(e):
+            return spectrum(e - shift)
+
+        return vib_spectrum
 
 
 class GaussianModel:
@@ -171,7 +200,7 @@ class GaussianModel:
                      str(self.deviations),
                      str(self.reorganization_energies)))
 
-    def get_vib_spectrum(self, transition):
+    def get_vib_spectrum(self, transition, state_energies=None):
 
         """
         :param donor: energy diference between states
@@ -179,7 +208,10 @@ class GaussianModel:
         :return: Franck-Condon-weighted density of states in gaussian aproximation
         """
 
-        elec_trans_ene = self.state_energies[transition[1]] - self.state_energies[transition[0]]
+        if state_energies is None:
+            state_energies = self.state_energies
+
+        elec_trans_ene = state_energies[transition[1]] - state_energies[transition[0]]
         reorg_ene = np.sum(self.reorganization_energies[transition])
 
         deviation = self.deviations[transition]     # atomic units
@@ -204,8 +236,11 @@ class NoVibration:
     def set_state_energies(self, state_energies):
         self.state_energies = state_energies
 
-    def get_vib_spectrum(self, transition):
-        elec_trans_ene = self.state_energies[transition[1]] - self.state_energies[transition[0]]
+    def get_vib_spectrum(self, transition, state_energies=None):
+        if state_energies is None:
+            state_energies = self.state_energies
+
+        elec_trans_ene = state_energies[transition[1]] - state_energies[transition[0]]
 
         def vib_spectrum(e):
             if elec_trans_ene == e:
@@ -1,13 +1,14 @@
-from kimonet.system.generators import regular_system
+from kimonet.system.generators import regular_system, crystal_system
 from kimonet.analysis import Trajectory, TrajectoryAnalysis
 from kimonet.system.molecule import Molecule
 from kimonet.system.state import State
 from kimonet import do_simulation_step
 from kimonet.core.processes.couplings import forster_coupling
 from kimonet.core.processes.decays import einstein_radiative_decay
-from kimonet.core.processes import GoldenRule, DecayRate
+from kimonet.core.processes import GoldenRule, DecayRate, DirectRate
 from kimonet.system.vibrations import MarcusModel
 
+from functools import partial
 import unittest
 import numpy as np
 np.random.seed(0)  # set random seed in order for the examples to reproduce the exact references
@@ -24,6 +25,59 @@ decay_scheme = [DecayRate(initial='s1', final='gs',
                 ]
 
 
+def failing_disorder(system):
+    raise Exception('disorder failed')
+
+
+def constant_decay_rate(molecule, rate):
+    return rate
+
+
+def column_transfer_rate(donor, *args, rates=()):
+    # transfer rate of the column of the donor (even or odd)
+    return rates[int(round(donor.get_coordinates()[0] / 2.0)) % 2]
+
+
+def get_lattice_system(transfer_rates=(10.0, 10.0), decay_rates=(0.5, 0.5)):
+    """
+    4x4 lattice (parameters 2 and 3) with an exciton in molecule 5 and constant rates. The molecules of the
+    even and odd columns can have different transfer rates (to any neighbour) and decay rates
+    """
+    from kimonet.system import System
+
+    templates = []
+    for decay_rate in decay_rates:
+        decay = DecayRate(initial='s1', final='gs',
+                          decay_rate_function=partial(constant_decay_rate, rate=decay_rate),
+                          description='constant decay')
+
+        templates.append(Molecule(states=[State(label='gs', energy=0.0),
+                                          State(label='s1', energy=3.0)],
+                                  transition_moment={('s1', 'gs'): [1.0, 0]},
+                                  decays=[decay]))
+
+    transfer = DirectRate(initial=('s1', 'gs'), final=('gs', 's1'),
+                          rate_constant_function=partial(column_transfer_rate, rates=transfer_rates),
+                          description='constant transfer')
+
+    if transfer_rates[0] == transfer_rates[1] and decay_rates[0] == decay_rates[1]:
+        system = regular_system(conditions={},
+                                molecule=templates[0],
+                                lattice={'size': [4, 4], 'parameters': [2.0, 3.0]},
+                                orientation=[0, 0, 0])
+    else:
+        cell_index = np.indices([4, 4]).reshape(2, -1).T
+        system = System(templates, {}, np.diag([8.0, 12.0]),
+                        type_index=cell_index[:, 0] % 2,
+                        coordinates=cell_index * [2.0, 3.0],
+                        orientations=np.zeros((16, 3)))
+
+    system.cutoff_radius = 3.1
+    system.transfer_scheme = [transfer]
+    system.add_excitation_index('s1', 5)
+    return system
+
+
 def get_analytical_model(distance, dimension, transfer, decay):
 
     k_list = [transfer] * 2 * dimension
@@ -127,3 +181,1002 @@ class TestKimonet(unittest.TestCase):
             pass
 
         self.assertDictEqual(ref, test)
+
+    def test_rate_tree(self):
+        from kimonet.core.kmc import RateTree
+
+        rates = [0.5, 0.0, 2.0, 1.5, 0.0, 3.0]
+        tree = RateTree(rates)
+
+        self.assertEqual(len(tree), 6)
+        self.assertAlmostEqual(tree.total(), np.sum(rates))
+
+        # same choice as the accumulated sum used by select_process
+        for value in np.linspace(0, np.sum(rates), 50, endpoint=False):
+            self.assertEqual(tree.search(value), len(np.where(value >= np.cumsum(rates))[0]))
+
+        tree.update(2, 0.0)
+        tree.update(7, 1.0)
+        self.assertEqual(len(tree), 8)
+        self.assertAlmostEqual(tree.total(), 6.0)
+        self.assertEqual(tree.search(0.6), 3)
+        self.assertEqual(tree.search(5.99), 7)
+
+    def test_samplers(self):
+        from kimonet.core.kmc import rate_samplers
+
+        # rates spanning several orders of magnitude
+        rates = [1.0e-3, 2.5, 0.0, 7.0e2, 3.0e2, 1.2e-1, 9.9e2, 4.0]
+
+        def get_sampler(sampler_class):
+            sampler = sampler_class(rates)
+            sampler.update(5, 1.5e2)
+            sampler.update(8, 20.0)
+            return sampler
+
+        probabilities = np.array(rates[:5] + [1.5e2] + rates[6:] + [20.0])
+        probabilities /= np.sum(probabilities)
+
+        for label, sampler_class in rate_samplers.items():
+            self.assertAlmostEqual(get_sampler(sampler_class).total(), 2166.501)
+
+            if label == 'next_reaction':
+                # first event of independent queues
+                selection = [get_sampler(sampler_class).next_event()[0] for _ in range(20000)]
+
+                # the rate of the process that occurs is removed from the total
+                queue = get_sampler(sampler_class)
+                index, _ = queue.next_event()
+                self.assertAlmostEqual(queue.total(), 2166.501 - probabilities[index] * 2166.501)
+            else:
+                sampler = get_sampler(sampler_class)
+                selection = [sampler.select() for _ in range(20000)]
+
+            counts = np.bincount(selection, minlength=len(probabilities))
+            np.testing.assert_allclose(counts/20000., probabilities, atol=0.01, err_msg=label)
+            self.assertEqual(counts[2], 0)
+
+    def test_samplers_kmc(self):
+        import kimonet
+        from kimonet.core.kmc import rate_samplers
+
+        # rates spanning several orders of magnitude (even and odd columns)
+        system = get_lattice_system(transfer_rates=(5.0, 0.05), decay_rates=(1.0, 0.01))
+
+        random_state = np.random.get_state()
+        statistics = {}
+        for sampler in ['linear'] + list(rate_samplers):
+            np.random.seed(1)
+            serial = kimonet.calculate_kmc(system, num_trajectories=300, silent=True, sampler=sampler)
+            parallel = kimonet.calculate_kmc_parallel(system, num_trajectories=300, silent=True, processors=2,
+                                                      sampler=sampler, seed=1)
+
+            for engine, trajectories in [('serial', serial), ('parallel', parallel)]:
+                analysis = TrajectoryAnalysis(trajectories)
+                statistics[(sampler, engine)] = (analysis.lifetime('s1'),
+                                                 np.diag(analysis.diffusion_length_square_tensor('s1')))
+        np.random.set_state(random_state)
+
+        # same statistics as the linear sampler
+        lifetime, diffusion = statistics[('linear', 'serial')]
+        for (sampler, engine), (sampler_lifetime, sampler_diffusion) in statistics.items():
+            self.assertAlmostEqual(sampler_lifetime / lifetime, 1.0, delta=0.2, msg=(sampler, engine))
+            np.testing.assert_allclose(sampler_diffusion, diffusion, rtol=0.4, err_msg='{} {}'.format(sampler, engine))
+
+    def test_samplers_updates(self):
+        from kimonet.core.kmc import CompositionRejectionSampler, RateTree
+
+        # long run of updates of rates spanning several orders of magnitude
+        rates = 10 ** np.random.uniform(-3, 3, 40)
+        sampler = CompositionRejectionSampler(rates)
+        tree = RateTree(rates)
+        for index, rate in zip(np.random.randint(0, 50, 50000), 10 ** np.random.uniform(-3, 3, 50000)):
+            rate = 0.0 if rate < 2e-3 else rate
+            sampler.update(index, rate)
+            tree.update(index, rate)
+
+        # the sums of the bins do not drift from the sums of their rates
+        for members, rate_sum, _ in sampler._bins.values():
+            self.assertAlmostEqual(rate_sum / np.sum([sampler[i] for i in members]), 1.0, places=13)
+        self.assertAlmostEqual(sampler.total() / tree.total(), 1.0, places=13)
+
+        # same selection frequencies as RateTree
+        probabilities = np.array([tree[i] for i in range(len(tree))]) / tree.total()
+        counts = np.bincount([sampler.select() for _ in range(50000)], minlength=len(tree))
+        tree_counts = np.bincount([tree.select() for _ in range(50000)], minlength=len(tree))
+        np.testing.assert_allclose(counts / 50000., probabilities, atol=0.01)
+        np.testing.assert_allclose(counts / 50000., tree_counts / 50000., atol=0.01)
+        self.assertTrue(np.all(counts[probabilities == 0] == 0))
+
+    def test_rate_catalog(self):
+        from kimonet.core.catalog import RateCatalog
+        from kimonet.core.kmc import rate_samplers
+        from kimonet.core.processes import get_processes_and_rates
+
+        annihilation = DirectRate(initial=('s1', 's1'), final=('gs', 's1'),
+                                  rate_constant_function=lambda *args: 1.0,
+                                  description='constant annihilation')
+
+        def get_processes(process_list, rate_list):
+            return sorted((id(process['process']), process['donor'], process['acceptor'],
+                           tuple(process.get('cell_increment', ())), rate)
+                          for process, rate in zip(process_list, rate_list))
+
+        def get_catalog_processes(system):
+            process_list, rate_list = system.rate_catalog.get_processes_and_rates(system)
+            if system.rate_catalog.sampler != 'linear':
+                # skip the free slots of the sampler
+                slots = [slot for slot, process in enumerate(process_list) if process is not None]
+                process_list, rate_list = [process_list[slot] for slot in slots], [rate_list[slot] for slot in slots]
+            return get_processes(process_list, rate_list)
+
+        for sampler in ['linear'] + list(rate_samplers):
+            system = get_lattice_system(transfer_rates=(10.0, 4.0), decay_rates=(0.05, 0.1))
+            system.transfer_scheme = system.transfer_scheme + [annihilation]
+            system.rate_catalog = RateCatalog(sampler=sampler)
+            system.add_excitations('s1', [0, 2, 3, 7, 8, 9, 10, 12, 14])
+
+            for step in range(1000):
+                if step % 50 == 25:
+                    # excitation through the molecule of the system
+                    ground = np.nonzero([molecule.state.label == 'gs' for molecule in system.molecules])[0]
+                    system.molecules[int(ground[0])].set_state('s1')
+
+                # same processes and rates as a full recomputation of all the centers
+                process_list, rate_list = [], []
+                for center in system.centers:
+                    processes, rates = get_processes_and_rates(center, system)
+                    process_list += processes
+                    rate_list += rates
+
+                self.assertEqual(get_catalog_processes(system), get_processes(process_list, rate_list),
+                                 msg='{} (step {})'.format(sampler, step))
+
+                do_simulation_step(system)
+                if system.is_finished:
+                    break
+
+    def test_next_reaction(self):
+        from kimonet import calculate_kmc
+
+        # constant rates: same statistics as the linear sampler (and the analytical values)
+        system = get_lattice_system()
+
+        statistics = {}
+        for sampler in ['linear', 'next_reaction']:
+            trajectories = calculate_kmc(system, num_trajectories=400, silent=True, sampler=sampler)
+            analysis = TrajectoryAnalysis(trajectories)
+            statistics[sampler] = analysis.lifetime('s1'), np.diag(analysis.diffusion_length_square_tensor('s1'))
+
+            self.assertAlmostEqual(statistics[sampler][0], 2.0, delta=0.35)
+            np.testing.assert_allclose(statistics[sampler][1], [2 * 10.0 * 2.0**2 * 2.0, 2 * 10.0 * 3.0**2 * 2.0],
+                                       rtol=0.35, err_msg=sampler)
+
+        self.assertAlmostEqual(statistics['next_reaction'][0], statistics['linear'][0], delta=0.5)
+        np.testing.assert_allclose(statistics['next_reaction'][1], statistics['linear'][1], rtol=0.5)
+
+    def test_lattice_walk(self):
+        from kimonet import calculate_kmc_walk
+
+        # constant rates: D_xx = transfer * a^2, D_yy = transfer * b^2
+        system = get_lattice_system()
+
+        for engine, processors in [('python', 1), ('compiled', 2), ('lockstep', 1)]:
+            trajectories = calculate_kmc_walk(system, num_trajectories=1000, silent=True,
+                                              engine=engine, processors=processors)
+            analysis = TrajectoryAnalysis(trajectories)
+
+            self.assertAlmostEqual(analysis.lifetime('s1'), 2.0, delta=0.2)
+            np.testing.assert_allclose(analysis.diffusion_length_square_tensor('s1'),
+                                       [[2 * 10.0 * 2.0**2 * 2.0, 0], [0, 2 * 10.0 * 3.0**2 * 2.0]],
+                                       rtol=0.2, atol=20, err_msg=engine)
+
+        # the compiled kernel rejects inconsistent rate tables
+        import kimonet.core.processes.forster as forster
+        from kimonet.core.lattice import get_rate_table
+
+        table = get_rate_table(system, 's1')
+        arrays = [table.indptr, table.neighbours, table.cumulative_rates, table.decay_rates, table.total_rates]
+        neighbours = table.neighbours.copy()
+        neighbours[3] = len(table.total_rates)
+        indptr = table.indptr.copy()
+        indptr[2] = indptr[3] + 1
+        empty_row = table.indptr.copy()
+        empty_row[1] = 0
+        for position, array in [(1, neighbours), (0, indptr), (0, empty_row), (2, table.cumulative_rates[:-1]),
+                                (3, table.decay_rates[:-1]), (0, table.indptr[:-1])]:
+            arguments = list(arrays)
+            arguments[position] = array
+            self.assertRaises(ValueError, forster.kmc_walk, *arguments, 0, np.empty(10, dtype=np.int64),
+                              np.empty(10), 1)
+
+    def test_master_equation(self):
+        from kimonet.analysis import MasterEquation
+
+        # constant rates: lifetime = 1/decay, D_xx = transfer * a^2, D_yy = transfer * b^2,
+        # DiffLenTen = 2 * DiffTensor * lifetime and population = exp(-decay * t)
+        system = get_lattice_system()
+        master_equation = MasterEquation(system)
+        times = np.linspace(0, 4, 9)
+
+        self.assertAlmostEqual(master_equation.lifetime(), 2.0, places=8)
+        np.testing.assert_allclose(master_equation.population(times), np.exp(-0.5 * times), rtol=1e-6)
+        np.testing.assert_allclose(master_equation.diffusion_length_square_tensor(),
+                                   [[160, 0], [0, 360]], rtol=1e-6, atol=1e-6)
+        np.testing.assert_allclose(master_equation.diffusion_coeff_tensor(times),
+                                   [[40, 0], [0, 90]], rtol=1e-6, atol=1e-6)
+
+    def test_rate_analysis(self):
+        from kimonet.analysis import RateAnalysis
+
+        # constant rates (same values as test_master_equation)
+        rate_analysis = RateAnalysis(get_lattice_system(), sites=[0])
+        np.testing.assert_allclose(rate_analysis.occupation, [1.0])
+        self.assertAlmostEqual(rate_analysis.lifetime(), 2.0, places=8)
+        np.testing.assert_allclose(rate_analysis.diffusion_coeff_tensor(), [[40, 0], [0, 90]], atol=1e-8)
+        np.testing.assert_allclose(rate_analysis.diffusion_length_square_tensor(),
+                                   [[160, 0], [0, 360]], atol=1e-6)
+
+        # transfer rates 10 from the even columns and 30 from the odd columns: the occupation is proportional
+        # to the time spent in each site (3/4 and 1/4). Every hop along x is +-a, and a hop takes 1/30 on
+        # average, so D_xx = a^2 / (2 * 1/30) = 60. D_yy = 1/2 * b^2 * (3/4 * 2 * 10 + 1/4 * 2 * 30) = 135
+        rate_analysis = RateAnalysis(get_lattice_system(transfer_rates=(10.0, 30.0)))
+        np.testing.assert_allclose(rate_analysis.occupation, np.repeat([3/32, 1/32] * 2, 4), rtol=1e-10)
+        np.testing.assert_allclose(rate_analysis.diffusion_coeff_tensor(), [[60, 0], [0, 135]], atol=1e-8)
+        self.assertAlmostEqual(rate_analysis.lifetime(), 2.0, places=8)
+
+        # the lifetime depends on the transfer if the sites decay with different rates
+        rate_analysis = RateAnalysis(get_lattice_system(decay_rates=(0.5, 1.0)))
+        self.assertRaises(Exception, rate_analysis.lifetime)
+
+        # with translational symmetry only the sites of the first cell are included by default
+        system = crystal_system(conditions=self.system.conditions,
+                                molecules=[self.molecule, self.molecule],
+                                scaled_site_coordinates=[[0.0, 0.0], [0.5, 0.4]],
+                                unitcell=[[3.0, 0.0], [0.5, 3.5]],
+                                dimensions=[4, 4],
+                                orientations=[[0, 0, 0], [0, 0, 0.8]])
+        system.cutoff_radius = 4.0
+        system.transfer_scheme = transfer_scheme
+        references = [system.get_reference(molecule) for molecule in range(system.get_num_molecules())]
+
+        rate_analysis = RateAnalysis(system, 's1')
+        self.assertEqual(len(rate_analysis.occupation), 2)
+        self.assertAlmostEqual(np.sum(rate_analysis.occupation), 1.0)
+        np.testing.assert_allclose(rate_analysis.diffusion_coeff_tensor(),
+                                   RateAnalysis(system, 's1', sites=np.unique(references)).diffusion_coeff_tensor())
+        np.testing.assert_allclose(RateAnalysis(get_lattice_system()).occupation, [1.0])
+
+    def test_generators(self):
+        import itertools
+        from kimonet.system.generators import regular_ordered_system
+
+        def assert_equal_system(system, coordinates, orientations, supercell):
+            np.testing.assert_allclose([molecule.get_coordinates() for molecule in system.molecules], coordinates)
+            np.testing.assert_allclose([molecule.orientation for molecule in system.molecules], orientations)
+            np.testing.assert_allclose(system.supercell, supercell)
+
+        # molecule by molecule construction
+        lattice = {'size': [3, 2], 'parameters': [2.0, 1.5]}
+        coordinates = [np.multiply(subset, lattice['parameters'])
+                       for subset in itertools.product(*[list(range(n)) for n in lattice['size']])]
+        supercell = np.diag(np.multiply(lattice['size'], lattice['parameters']))
+
+        system = regular_ordered_system(conditions={}, molecule=self.molecule, lattice=lattice)
+        assert_equal_system(system, coordinates, [[0, 0, 0]] * 6, supercell)
+
+        system = regular_ordered_system(conditions={}, molecule=self.molecule, lattice=lattice,
+                                        orientation=[0.1, 0.2, 0.3])
+        assert_equal_system(system, coordinates, [[0.1, 0.2, 0.3]] * 6, supercell)
+
+        unitcell = np.array([[3.0, 0.2], [0.5, 2.5]])
+        scaled_site_coordinates = [[0, 0], [0.5, 0.4]]
+        dimensions = [2, 3]
+        for orientations in [[[0, 0, 0], [0.3, 0.2, 1.0]], None]:
+            np.random.seed(3)
+            system = crystal_system(conditions={}, molecules=[self.molecule, self.molecule],
+                                    scaled_site_coordinates=scaled_site_coordinates, dimensions=dimensions,
+                                    unitcell=unitcell, orientations=orientations)
+
+            np.random.seed(3)
+            coordinates = []
+            orientations_list = []
+            for i, coordinate in enumerate(scaled_site_coordinates):
+                for subset in itertools.product(*[list(range(n)) for n in dimensions]):
+                    r_cell = np.sum([s * lattice_vector for s, lattice_vector in zip(subset, unitcell)], axis=0)
+                    coordinates.append(r_cell + np.dot(unitcell.T, coordinate))
+                    if orientations is None:
+                        orientations_list.append(np.random.random_sample(3) * 2 * np.pi)
+                    else:
+                        orientations_list.append(orientations[i])
+
+            assert_equal_system(system, coordinates, orientations_list, np.dot(unitcell.T, np.diag(dimensions)).T)
+            self.assertEqual([molecule.name for molecule in system.molecules], ['a1'] * 6 + ['a2'] * 6)
+
+    def test_translational_symmetry(self):
+        from kimonet.core.lattice import RateTable
+
+        transfer = DirectRate(initial=('s1', 'gs'), final=('gs', 's1'),
+                              rate_constant_function=lambda donor, acceptor, conditions, supercell, cell_incr:
+                              1.0/np.linalg.norm(acceptor.get_coordinates() - donor.get_coordinates() +
+                                                 np.dot(cell_incr, supercell)),
+                              description='distance transfer')
+
+        molecule = Molecule(states=[State(label='gs', energy=0.0),
+                                    State(label='s1', energy=3.0)],
+                            transition_moment={('s1', 'gs'): [1.0, 0]},
+                            decays=decay_scheme)
+
+        system = crystal_system(conditions={},
+                                molecules=[molecule, molecule],
+                                scaled_site_coordinates=[[0.0, 0.0], [0.5, 0.4]],
+                                unitcell=[[3.0, 0.5], [0.3, 4.0]],
+                                dimensions=[4, 3],
+                                orientations=[[0, 0, 0], [0, 0, 1.0]])
+        system.cutoff_radius = 5.0
+        system.transfer_scheme = [transfer]
+        self.assertIsNotNone(system.site_index)
+
+        direct = system.copy()
+        direct.site_index = None
+
+        for center in range(system.get_num_molecules()):
+            for translated, reference in zip(system.get_neighbours(center), direct.get_neighbours(center)):
+                np.testing.assert_array_equal(translated, reference)
+
+        table = RateTable(system, 's1')
+        reference_table = RateTable(direct, 's1')
+        np.testing.assert_array_equal(table.neighbours, reference_table.neighbours)
+        np.testing.assert_array_equal(table.cell_increments, reference_table.cell_increments)
+        np.testing.assert_allclose(table.cumulative_rates, reference_table.cumulative_rates, rtol=1e-12)
+
+    def test_neighbour_graph(self):
+        system = self.system.copy()
+        system.cutoff_radius = 4.5
+        neighbours = [system.get_neighbours(center) for center in range(system.get_num_molecules())]
+
+        system.build_neighbour_graph()
+        self.assertIs(system.copy().neighbour_graph, system.neighbour_graph)
+
+        for center, (indices, cell_increments) in enumerate(neighbours):
+            graph_indices, graph_cell_increments = system.get_neighbours(center)
+            np.testing.assert_array_equal(graph_indices, indices)
+            np.testing.assert_array_equal(graph_cell_increments, cell_increments)
+
+    def test_lazy_neighbour_graph(self):
+        system = self.system.copy()
+        system.use_neighbour_graph = True
+        system.neighbour_graph = None
+
+        # the graph is built for the cutoff radius set after the construction
+        system.cutoff_radius = 4.5
+        self.assertIsNone(system.neighbour_graph)
+        copy = system.copy()
+        self.assertEqual(system.neighbour_graph.radius, 4.5)
+        self.assertIs(copy.neighbour_graph, system.neighbour_graph)
+
+        reference = self.system.copy()
+        reference.cutoff_radius = 4.5
+        for center in range(system.get_num_molecules()):
+            indices, cell_increments = reference.get_neighbours(center)
+            graph_indices, graph_cell_increments = system.get_neighbours(center)
+            np.testing.assert_array_equal(graph_indices, indices)
+            np.testing.assert_array_equal(graph_cell_increments, cell_increments)
+
+        # a new graph is built when the cutoff radius changes
+        system.cutoff_radius = 3.1
+        self.assertEqual(len(system.get_neighbours(0)[0]), 4)
+        self.assertEqual(system.neighbour_graph.radius, 3.1)
+
+    def test_system_copy(self):
+        import pickle
+
+        # all the molecules of the lattice are of the same type
+        self.assertEqual(len(self.system._templates), 1)
+        np.testing.assert_array_equal(self.system.molecules[4].get_coordinates(), [3.0, 3.0])
+
+        system = self.system.copy()
+        system.add_excitation_index('s1', 4)
+        system.molecules[4].cell_state = [1, -2]
+
+        # static data is shared and the state is independent
+        system_copy = system.copy()
+        self.assertIs(system_copy._templates, system._templates)
+        system_copy.add_excitation_index('gs', 4)
+        system_copy.add_excitation_index('s1', 2)
+        system_copy.molecules[4].cell_state = [0, 0]
+
+        self.assertEqual(system.centers, [4])
+        self.assertEqual(system_copy.centers, [2])
+        self.assertEqual(system.molecules[4].state.label, 's1')
+        self.assertEqual(system.molecules[2].state.label, 'gs')
+        np.testing.assert_array_equal(system.molecules[4].cell_state, [1, -2])
+
+        system_load = pickle.loads(pickle.dumps(system))
+        self.assertEqual(system_load.centers, [4])
+        self.assertEqual(system_load.molecules[4].state.label, 's1')
+        np.testing.assert_array_equal(system_load.molecules[4].cell_state, [1, -2])
+
+    def test_molecule_types(self):
+        from kimonet.system.molecule import get_molecule_types
+
+        # molecules with different transition moments (copies of two molecules of each)
+        molecules = []
+        for i in range(50):
+            molecule = Molecule(states=[State(label='gs', energy=0.0), State(label='s1', energy=3.0)],
+                                transition_moment={('s1', 'gs'): [1.0, 0.1 * i]},
+                                vibrations=MarcusModel(reorganization_energies={('s1', 'gs'): 0.5,
+                                                                                ('gs', 's1'): 0.5}),
+                                decays=decay_scheme)
+            molecules += [molecule.copy(), molecule.copy()]
+        # same type as the first molecule (other coordinates)
+        molecules.append(self.molecule.copy())
+        molecules[-1].set_coordinates([1.0, 2.0])
+
+        templates, type_index = get_molecule_types(molecules)
+        self.assertEqual(len(templates), 50)
+        np.testing.assert_array_equal(type_index, list(np.repeat(np.arange(50), 2)) + [0])
+
+        # other vibrations
+        molecule = self.molecule.copy()
+        molecule.vibrations = MarcusModel(reorganization_energies={('s1', 'gs'): 0.2, ('gs', 's1'): 0.2})
+        templates, type_index = get_molecule_types([self.molecule.copy(), molecule, molecule.copy()])
+        np.testing.assert_array_equal(type_index, [0, 1, 1])
+
+    def test_disorder(self):
+        from kimonet.system import System
+        from kimonet.system.disorder import energetic_disorder, orientational_disorder
+        from kimonet.core.processes import get_transfer_rates, get_decay_rates
+
+        np.random.seed(1)
+        system = self.system.copy()
+        offsets = energetic_disorder(system, 0.1)
+        orientational_disorder(system, 0.3)
+
+        # the original system is not modified
+        self.assertIsNone(self.system._energy_offsets)
+        np.testing.assert_array_equal(self.system._orientations, 0)
+        self.assertIsNone(system.site_index)
+        self.assertAlmostEqual(system.molecules[4].get_state_energy('s1'), 3.0 + offsets[4])
+
+        # same rates as the system of standalone molecules
+        reference = System([molecule.copy() for molecule in system.molecules], system.conditions,
+                           system.supercell, transfers=transfer_scheme, cutoff_radius=3.1)
+        system.add_excitation_index('s1', 4)
+        reference.add_excitation_index('s1', 4)
+        np.testing.assert_allclose(get_transfer_rates(4, system)[1], get_transfer_rates(4, reference)[1])
+        np.testing.assert_allclose(get_decay_rates(4, system)[1], get_decay_rates(4, reference)[1])
+
+    def test_disorder_caches(self):
+        from kimonet import calculate_kmc
+        from kimonet.system.disorder import energetic_disorder, orientational_disorder
+        from kimonet.core.processes import get_transfer_rates
+        from kimonet.core.processes.couplings import coupling_data
+        from kimonet.core.processes.fcwd import disorder_overlap_data
+        from kimonet.system.vibrations import EmpiricalModel
+
+        system = self.system.copy()
+        system.add_excitation_index('s1', 4)
+        get_transfer_rates(4, system)
+
+        # the couplings are kept with energetic disorder
+        np.random.seed(1)
+        disordered = system.copy()
+        energetic_disorder(disordered, 0.1)
+        self.assertEqual(disordered._static_id, system._static_id)
+        misses = coupling_data.misses
+        get_transfer_rates(4, disordered)
+        self.assertEqual(coupling_data.misses, misses)
+        self.assertGreater(len(disorder_overlap_data), 0)
+
+        orientational_disorder(disordered, 0.3)
+        self.assertNotEqual(disordered._static_id, system._static_id)
+
+        # the data of the realizations is discarded after each trajectory
+        def disorder(system_copy):
+            energetic_disorder(system_copy, 0.1)
+            orientational_disorder(system_copy, 0.3)
+
+        keys = set(coupling_data)
+        calculate_kmc(system, num_trajectories=3, max_steps=20, silent=True, disorder=disorder)
+        self.assertEqual([key for key in coupling_data if key not in keys], [])
+        self.assertEqual(len(disorder_overlap_data), 0)
+
+        # the empirical spectra are shifted with the energy offsets
+        def spectrum(e):
+            return np.exp(-(e - 2.5) ** 2)
+
+        molecule = Molecule(states=[State(label='gs', energy=0.0), State(label='s1', energy=3.0)],
+                            transition_moment={('s1', 'gs'): [1.0, 0]},
+                            vibrations=EmpiricalModel({('s1', 'gs'): spectrum, ('gs', 's1'): spectrum}))
+        system = regular_system(conditions={}, molecule=molecule, lattice={'size': [2], 'parameters': [3.0]},
+                                orientation=[0, 0, 0])
+        system.set_disorder(energy_offsets=[0.0, 0.2])
+        for transition in [('s1', 'gs'), ('gs', 's1')]:
+            self.assertEqual(system.molecules[0].get_vib_dos(transition)(2.7), spectrum(2.7))
+            self.assertAlmostEqual(system.molecules[1].get_vib_dos(transition)(2.7), spectrum(2.5))
+            self.assertAlmostEqual(system.molecules[1].copy().get_vib_dos(transition)(2.7), spectrum(2.5))
+
+    def test_system_file(self):
+        import os
+        import pickle
+        import tempfile
+        from kimonet.fileio import store_system, load_system
+
+        system = self.system.copy()
+        system.add_excitation_index('s1', 4)
+
+        filename = os.path.join(tempfile.mkdtemp(), 'system.kmn')
+        store_system(system, filename)
+        system_load = load_system(filename)
+
+        self.assertIsInstance(system_load._coordinates, np.memmap)
+        np.testing.assert_array_equal(system_load._coordinates, system._coordinates)
+        self.assertEqual(system_load.centers, [4])
+        self.assertEqual(system_load.molecules[4].state.label, 's1')
+        for neighbours, neighbours_load in zip(system.get_neighbours(4), system_load.get_neighbours(4)):
+            np.testing.assert_array_equal(neighbours, neighbours_load)
+
+        # the system stored is not modified
+        self.assertIsNone(system.neighbour_graph)
+
+        # the copies are pickled with the arrays (unless file backed pickling is requested)
+        data = pickle.dumps(system_load.copy())
+        data_mapped = pickle.dumps(load_system(filename, file_backed=True).copy())
+        self.assertGreater(len(data), len(data_mapped))
+
+        system_copy = pickle.loads(data_mapped)
+        self.assertIsInstance(system_copy._coordinates, np.memmap)
+        self.assertIsInstance(system_copy.neighbour_graph.indices, np.memmap)
+        self.assertEqual(system_copy.molecules[4].state.label, 's1')
+
+        del system_load, system_copy
+        os.remove(filename)
+        system_copy = pickle.loads(data)
+        self.assertNotIsInstance(system_copy._coordinates, np.memmap)
+        np.testing.assert_array_equal(system_copy._coordinates, system._coordinates)
+        self.assertEqual(system_copy.molecules[4].state.label, 's1')
+        for neighbours, neighbours_copy in zip(system.get_neighbours(4), system_copy.get_neighbours(4)):
+            np.testing.assert_array_equal(neighbours, neighbours_copy)
+
+    def test_excitations(self):
+        system = self.system.copy()
+        system.add_excitation_center('s1')
+        self.assertEqual(system.centers, [4])
+
+        np.random.seed(2)
+        system.add_excitation_random('s1', 8)
+        self.assertEqual(len(system.centers), 9)
+        self.assertEqual(sorted(system.centers), list(range(9)))
+        self.assertRaises(Exception, system.add_excitation_random, 's1', 1)
+
+        system.add_excitation_index('gs', 4)
+        self.assertNotIn(4, system.centers)
+        system.molecules[2].cell_state = [1, 1]
+
+        system.reset()
+        self.assertEqual(len(system.centers), 0)
+        np.testing.assert_array_equal(system._state_index, 0)
+        np.testing.assert_array_equal(system._cell_states, 0)
+
+    def test_initial_conditions(self):
+        from kimonet import calculate_kmc
+        from kimonet.system.initial_conditions import sample_excitations, gaussian_profile
+
+        np.random.seed(3)
+        profile = gaussian_profile(self.system, [0.0, 0.0], 1.0)
+        profile[4] = 0
+        indices = sample_excitations(self.system, 3, profile=profile, num_trajectories=5)
+        self.assertEqual(indices.shape, (5, 3))
+        self.assertNotIn(4, indices)
+        for row in indices:
+            self.assertEqual(len(set(row)), 3)
+
+        system = self.system.copy()
+        system.add_excitations('s1', indices[0])
+        self.assertEqual(list(system.centers), list(indices[0]))
+
+        trajectories = calculate_kmc(self.system, num_trajectories=5, max_steps=2, silent=True,
+                                     initial_excitations={'s1': indices})
+        self.assertEqual(trajectories[2].n_centers, 3)
+
+    def test_minimal_supercell(self):
+        from kimonet.system.generators import minimal_crystal_system
+        from kimonet.analysis import RateAnalysis
+
+        unitcell = [[3.0, 0.0], [7.0, 3.5]]  # skewed cell
+        arguments = {'conditions': self.system.conditions,
+                     'molecules': [self.molecule],
+                     'scaled_site_coordinates': [[0.0, 0.0]],
+                     'unitcell': unitcell,
+                     'orientations': [[0, 0, 0]]}
+
+        system = crystal_system(dimensions=[6, 6], **arguments)
+        system.cutoff_radius = 7.0
+        minimal = minimal_crystal_system(cutoff_radius=7.0, **arguments)
+        self.assertLess(minimal.get_num_molecules(), system.get_num_molecules())
+
+        system.transfer_scheme = minimal.transfer_scheme = transfer_scheme
+        np.testing.assert_allclose(RateAnalysis(minimal, 's1', sites=[0]).diffusion_coeff_tensor(),
+                                   RateAnalysis(system, 's1', sites=[0]).diffusion_coeff_tensor())
+
+    def test_batch_couplings(self):
+        from kimonet.core.processes.couplings import dexter_coupling, forster_coupling_py, coupling_data
+        from kimonet.core.processes.types import BaseProcess
+        from kimonet.system.disorder import orientational_disorder
+        from kimonet.utils.units import VAC_PERMITTIVITY
+
+        system = self.system.copy()
+        system.conditions = dict(system.conditions, dexter_k=1.0)
+        system.cutoff_radius = 3.1
+        system.add_excitation_index('s1', 4)
+
+        donor = system.molecules[4]
+        neighbours, cell_increments = system.get_neighbours(4)
+        acceptors = [system.molecules[i] for i in neighbours]
+
+        # point dipoles along x: the neighbours along x (distance 3, orientation factor -2)
+        # and along y (distance 3, orientation factor 1)
+        mu = np.linalg.norm(donor.get_transition_moment(to_state='gs'))
+        r_vectors = [system.molecules[i].get_coordinates() + np.dot(cell_incr, system.supercell) -
+                     donor.get_coordinates() for i, cell_incr in zip(neighbours, cell_increments)]
+        factors = [-2 if abs(r_vector[0]) > 1 else 1 for r_vector in r_vectors]
+        self.assertEqual(sorted(factors), [-2, -2, 1, 1])
+
+        coupling_data.clear()
+        couplings = forster_coupling(donor, acceptors, system.conditions, system.supercell, cell_increments)
+        analytic = [factor**2 * mu**2 / (4 * np.pi * VAC_PERMITTIVITY * 3**3) for factor in factors]
+        np.testing.assert_allclose(couplings, analytic, rtol=1e-10)
+
+        coupling_data.clear()
+        couplings = dexter_coupling(donor, acceptors, system.conditions, system.supercell, cell_increments)
+        vdw_radius = donor.get_vdw_radius()
+        np.testing.assert_allclose(couplings, [np.exp(-3 / vdw_radius)] * 4, rtol=1e-10)
+
+        # disordered orientations: the batch couplings match the scalar implementation
+        system.cutoff_radius = 6.5
+        orientational_disorder(system)
+        donor = system.molecules[4]
+        neighbours, cell_increments = system.get_neighbours(4)
+        acceptors = [system.molecules[i] for i in neighbours]
+
+        coupling_data.clear()
+        couplings = forster_coupling(donor, acceptors, system.conditions, system.supercell, cell_increments)
+        reference = [forster_coupling_py(donor, acceptor, system.conditions, system.supercell, cell_incr)
+                     for acceptor, cell_incr in zip(acceptors, cell_increments)]
+        np.testing.assert_allclose(couplings, reference, rtol=1e-10)
+
+        # the rate constants of all the neighbours are computed at once
+        process = transfer_scheme[0]
+        rates = process.get_rate_constants(donor, acceptors, system.conditions, system.supercell, cell_increments)
+        coupling_data.clear()
+        reference = [process.get_rate_constant(donor, acceptor, system.conditions, system.supercell, cell_incr)
+                     for acceptor, cell_incr in zip(acceptors, cell_increments)]
+        np.testing.assert_allclose(rates, reference)
+
+        # processes that only define get_rate_constant
+        class ConstantRate(BaseProcess):
+            def get_rate_constant(self, donor, acceptor, conditions, supercell, cell_incr):
+                return 2.0
+
+        process = ConstantRate(initial=('s1', 'gs'), final=('gs', 's1'))
+        rates = process.get_rate_constants(donor, acceptors, system.conditions, system.supercell, cell_increments)
+        self.assertEqual(rates, [2.0] * len(acceptors))
+
+        from kimonet.core.processes import get_transfer_rates
+        system.transfer_scheme = [process]
+        self.assertEqual(get_transfer_rates(4, system)[1], [2.0] * len(acceptors))
+
+    def test_coupling_cache(self):
+        from kimonet.utils.cache import LRUCache
+        from kimonet.core.processes.couplings import set_coupling_cache
+
+        cache = LRUCache(maxsize=2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(cache.get('a'), 1)
+        cache['c'] = 3                          # 'b' is the least recently used entry
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.info(), {'hits': 1, 'misses': 1, 'evictions': 1, 'size': 2, 'maxsize': 2})
+
+        # journal of the inserted keys (evicted and removed keys are discarded)
+        journal = cache.journal()
+        self.assertEqual(journal, {'a', 'c'})
+        journal.clear()
+        cache['a'] = 4
+        cache['d'] = 5                          # 'c' is evicted
+        cache['e'] = 6                          # 'a' is evicted
+        self.assertEqual(journal, {'d', 'e'})
+        del cache['e']
+        self.assertEqual(journal, {'d'})
+        cache.release_journal(journal)
+        cache['f'] = 7
+        self.assertEqual(journal, {'d'})
+
+        cache = LRUCache(maxsize=3)
+        set_coupling_cache(forster_coupling, cache)
+        try:
+            system = self.system.copy()
+            system.add_excitation_index('s1', 4)
+            couplings = [[forster_coupling(system.molecules[4], system.molecules[i], system.conditions,
+                                           system.supercell, cell_incr)
+                          for i, cell_incr in zip(*system.get_neighbours(4))] for _ in range(2)]
+        finally:
+            set_coupling_cache(forster_coupling)
+
+        np.testing.assert_allclose(couplings[1], couplings[0])
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.misses + cache.hits, 2 * len(couplings[0]))
+        self.assertGreater(cache.evictions, 0)
+
+    def test_precomputation_store(self):
+        import os
+        import tempfile
+        from kimonet import calculate_kmc
+        from kimonet.fileio import PrecomputationStore
+        from kimonet.core.processes.couplings import coupling_data
+        from kimonet.core.processes.fcwd import overlap_data
+
+        filename = os.path.join(tempfile.mkdtemp(), 'store.db')
+        system = self.system.copy()
+        system.add_excitation_index('s1', 4)
+        calculate_kmc(system, num_trajectories=2, max_steps=20, silent=True, store=filename)
+
+        couplings = {key: value for key, value in coupling_data.items() if key[1][0] == system._static_id}
+        coupling_data.clear()
+        overlap_data.clear()
+
+        # same system built again (other static data)
+        self.setUp()
+        with PrecomputationStore(filename) as store:
+            self.assertEqual(store.get_record(self.system), store.get_record(system))
+            store.load(self.system)
+
+            # only the data inserted in the caches after the load is written
+            import sqlite3
+            from kimonet.system.state import get_state_index
+
+            def count_couplings():
+                connection = sqlite3.connect(filename)
+                count, = connection.execute('SELECT COUNT(*) FROM couplings').fetchone()
+                connection.close()
+                return count
+
+            n_couplings = count_couplings()
+            store.save(self.system)
+            self.assertEqual(count_couplings(), n_couplings)
+
+            static_id, state = self.system._static_id, get_state_index('s1')
+            coupling_data[('forster_coupling', (static_id, 0, state), (static_id, 8, state), (0, 0), ())] = 1.0
+            store.save(self.system)
+            self.assertEqual(count_couplings(), n_couplings + 1)
+            self.assertEqual(len(store._get_journal(coupling_data)), 0)
+            del coupling_data[('forster_coupling', (static_id, 0, state), (static_id, 8, state), (0, 0), ())]
+
+            # the record follows the changes of the templates (that do not renew the static id)
+            template = system.copy()
+            record = store.get_record(template)
+            template._templates = [Molecule(states=[State(label='gs', energy=0.0), State(label='s1', energy=3.0)],
+                                            transition_moment={('s1', 'gs'): [0.5, 0]},
+                                            vibrations=self.molecule.vibrations,
+                                            decays=decay_scheme)]
+            self.assertNotEqual(store.get_record(template), record)
+
+        self.assertEqual(self.system.neighbour_graph.radius, self.system.cutoff_radius)
+        self.assertEqual(len(coupling_data), len(couplings))
+        self.assertGreater(len(overlap_data), 0)
+        for (name, donor, acceptor, cell_incr, parameters), value in couplings.items():
+            key = (name, (self.system._static_id,) + donor[1:], (self.system._static_id,) + acceptor[1:],
+                   cell_incr, parameters)
+            self.assertEqual(coupling_data.get(key), value)
+
+    def test_precompute_rates(self):
+        from kimonet.core.processes import precompute_rates, get_transfer_rates
+        from kimonet.core.processes.couplings import coupling_data
+        from kimonet.core.processes.fcwd import overlap_data
+
+        system = self.system.copy()
+        precompute_rates(system)
+        self.assertEqual(system.centers, [])
+        self.assertGreater(len(system.rate_constants), 0)
+
+        # the rates of any molecule are taken from the caches
+        misses = coupling_data.misses
+        system.add_excitation_index('s1', 7)
+        processes, rates = get_transfer_rates(7, system)
+        self.assertEqual(coupling_data.misses, misses)
+
+        # the reference rates are computed from scratch (new system and empty caches)
+        coupling_data.clear()
+        overlap_data.clear()
+        self.setUp()
+        reference = self.system
+        self.assertEqual(len(reference.rate_constants), 0)
+        reference.add_excitation_index('s1', 7)
+        np.testing.assert_allclose(rates, get_transfer_rates(7, reference)[1])
+        self.assertGreater(coupling_data.misses, 0)
+
+    def test_parallel_failure(self):
+        import os
+        import tempfile
+        import kimonet
+
+        filename = os.path.join(tempfile.mkdtemp(), 'store.db')
+        self.system.add_excitation_center('s1')
+        with self.assertRaises(Exception):
+            kimonet.calculate_kmc_parallel(self.system, num_trajectories=2, max_steps=10, silent=True,
+                                           disorder=failing_disorder, store=filename)
+        self.assertEqual(kimonet._loaded_systems, {})
+        self.assertEqual(kimonet._stores, {})
+
+    def test_overlap_temperature(self):
+        from kimonet.core.processes import get_transfer_rates
+        from kimonet.core.processes.fcwd import overlap_data
+
+        def get_rates(temperature):
+            vibrations = MarcusModel(reorganization_energies={('s1', 'gs'): 0.5, ('gs', 's1'): 0.5},
+                                     temperature=temperature)
+            molecule = Molecule(states=[State(label='gs', energy=0.0), State(label='s1', energy=3.0)],
+                                transition_moment={('s1', 'gs'): [1.0, 0]},
+                                vibrations=vibrations,
+                                decays=decay_scheme)
+            system = regular_system(conditions=self.system.conditions, molecule=molecule,
+                                    lattice={'size': [3, 3], 'parameters': self.parameters},
+                                    orientation=[0, 0, 0])
+            system.cutoff_radius = 3.1
+            system.transfer_scheme = transfer_scheme
+            system.add_excitation_index('s1', 4)
+            return get_transfer_rates(4, system)[1]
+
+        rates_100 = get_rates(100)
+        rates_400 = get_rates(400)
+
+        overlap_data.clear()
+        np.testing.assert_allclose(rates_400, get_rates(400))
+        self.assertGreater(rates_400[0], 1e3 * rates_100[0])
+
+    def test_static_data_changes(self):
+        system = self.system.copy()
+        system.add_excitation_index('s1', 4)
+        neighbours, cell_increments = system.get_neighbours(4)
+
+        def get_coupling():
+            return forster_coupling(system.molecules[4], system.molecules[neighbours[0]], system.conditions,
+                                    system.supercell, cell_increments[0])
+
+        coupling = get_coupling()
+        static_id = system._static_id
+
+        # the molecule is moved (the original system is not modified)
+        coordinates = system.molecules[neighbours[0]].get_coordinates()
+        system.molecules[neighbours[0]].set_coordinates(coordinates * 1.5)
+        self.assertNotEqual(system._static_id, static_id)
+        np.testing.assert_allclose(self.system.molecules[neighbours[0]].get_coordinates(), coordinates)
+        self.assertNotAlmostEqual(get_coupling(), coupling)
+
+        system.molecules[neighbours[0]].set_coordinates(coordinates)
+        self.assertAlmostEqual(get_coupling(), coupling)
+
+        system.molecules[neighbours[0]].set_orientation([0, 0, np.pi / 2])
+        self.assertNotAlmostEqual(get_coupling(), coupling)
+
+        static_id = system._static_id
+        system.supercell = np.array(system.supercell) * 2
+        self.assertNotEqual(system._static_id, static_id)
+
+    def test_neighbours_brute_force(self):
+        from kimonet.utils import distance_vector_periodic
+        import itertools
+
+        # disordered positions in a skewed cell
+        np.random.seed(5)
+        unitcell = [[3.0, 0.0], [2.4, 2.1]]
+        system = crystal_system(conditions=self.system.conditions, molecules=[self.molecule, self.molecule],
+                                scaled_site_coordinates=[[0.0, 0.0], [0.5, 0.5]], unitcell=unitcell,
+                                dimensions=[4, 3], orientations=[[0, 0, 0], [0, 0, 0]])
+        coordinates = system._coordinates + np.random.normal(scale=0.3, size=system._coordinates.shape)
+        for i, molecule in enumerate(system.molecules):
+            molecule.set_coordinates(coordinates[i])
+        system.cutoff_radius = 5.5
+
+        def get_neighbours_brute_force(center):
+            neighbours, jumps = [], []
+            for i, molecule in enumerate(system.molecules):
+                for cell_increment in itertools.product(range(-4, 5), repeat=2):
+                    r_vec = distance_vector_periodic(molecule.get_coordinates() - coordinates[center],
+                                                     system.supercell, cell_increment)
+                    if 0 < np.linalg.norm(r_vec) < system.cutoff_radius:
+                        neighbours.append(i)
+                        jumps.append(cell_increment)
+            return np.array(neighbours), np.array(jumps)
+
+        for center in [0, 5, 17]:
+            neighbours, jumps = system.get_neighbours(center)
+            neighbours_ref, jumps_ref = get_neighbours_brute_force(center)
+            np.testing.assert_array_equal(neighbours, neighbours_ref)
+            np.testing.assert_array_equal(jumps, jumps_ref)
+
+        # the neighbours follow the changes of the geometry
+        system.molecules[5].set_coordinates(coordinates[5] + [0.8, -0.4])
+        coordinates[5] += [0.8, -0.4]
+        for center in [0, 5]:
+            neighbours, jumps = system.get_neighbours(center)
+            neighbours_ref, jumps_ref = get_neighbours_brute_force(center)
+            np.testing.assert_array_equal(neighbours, neighbours_ref)
+            np.testing.assert_array_equal(jumps, jumps_ref)
+
+        system.build_neighbour_graph()
+        system.supercell = np.array(system.supercell) * 1.1
+        np.testing.assert_array_equal(system.get_neighbours(0)[0], get_neighbours_brute_force(0)[0])
+
+    def test_symmetry_rates_changes(self):
+        from kimonet.core.processes import get_transfer_rates
+
+        system = self.system.copy()
+        system.add_excitation_index('s1', 4)
+        rates = get_transfer_rates(4, system)[1]
+
+        # the rate constants of the sites are computed again after the changes
+        system.conditions = dict(system.conditions, refractive_index=2)
+        np.testing.assert_allclose(get_transfer_rates(4, system)[1], np.array(rates) / 16)
+
+        system.transfer_scheme = [GoldenRule(initial=('s1', 'gs'), final=('gs', 's1'),
+                                             electronic_coupling_function=lambda *args: 0.0)]
+        np.testing.assert_allclose(get_transfer_rates(4, system)[1], 0)
+
+        system.transfer_scheme = transfer_scheme
+        system.molecules[3].set_orientation([0, 0, np.pi / 2])
+        self.assertIsNone(system.site_index)
+        self.assertLess(get_transfer_rates(4, system)[1][1], 1e-20 * rates[1])
+
+        # the copies of each site must be equivalent
+        system = self.system.copy()
+        orientations = np.array(system._orientations)
+        orientations[3] = [0, 0, 1]
+        system._orientations = orientations
+        self.assertRaises(Exception, system.set_translational_symmetry, np.zeros(9, dtype=int),
+                          self.system.cell_index, [3, 3])
+
+    def test_molecule_view(self):
+        system = self.system.copy()
+        molecule = system.molecules[2]
+
+        # the data of the template is shared by all the molecules of the same type
+        with self.assertRaises(AttributeError):
+            molecule.vdw_radius = 2.0
+        with self.assertRaises(AttributeError):
+            molecule.transition_moment = {}
+
+        # the data of each molecule is stored in the arrays of the system (not shared with other copies)
+        molecule.set_orientation([0, 0, 1])
+        molecule.set_coordinates([1.0, 2.0])
+        np.testing.assert_array_equal(system.molecules[2].orientation, [0, 0, 1])
+        np.testing.assert_array_equal(system.molecules[3].orientation, [0, 0, 0])
+        np.testing.assert_array_equal(self.system.molecules[2].orientation, [0, 0, 0])
+        np.testing.assert_array_equal(self.system.molecules[2].get_coordinates(), [0.0, 6.0])
+        self.assertEqual(self.molecule.get_coordinates().tolist(), [0])
+
+        with self.assertRaises(ValueError):
+            molecule.orientation[0] = 1.0
+
+        # the templates of the system are copies of the molecules of the list
+        from kimonet.system import System
+
+        molecules = [self.molecule.copy() for _ in range(3)]
+        system = System(molecules, {}, np.diag([9.0]))
+        self.assertIsNot(system._templates[0], molecules[0])
+        molecules[0].vibrations.set_state_energies({'gs': 0.0, 's1': 2.0})
+        self.assertEqual(system.molecules[1].get_state_energy('s1'), 3.0)
+
+        # several molecules at once (the static data is replaced only once)
+        system = self.system.copy()
+        system.molecules[4].cell_state = [1, 1]
+        static_id = system._static_id
+        system.set_geometry(coordinates=[[1.0, 1.0], [2.0, 2.0]], orientations=[[0, 0, 1], [0, 0, 2]], indices=[4, 5])
+        np.testing.assert_array_equal(system.molecules[5].get_coordinates(), [2.0, 2.0])
+        np.testing.assert_array_equal(system.molecules[4].orientation, [0, 0, 1])
+        np.testing.assert_array_equal(system.molecules[4].cell_state, [0, 0])
+        np.testing.assert_array_equal(system.molecules[3].orientation, [0, 0, 0])
+        np.testing.assert_array_equal(self.system.molecules[4].orientation, [0, 0, 0])
+        self.assertNotEqual(system._static_id, static_id)
+        self.assertIsNone(system.site_index)
@@ -20,3 +20,90 @@ def minimum_distance_vector(r_vector, supercell):
 
 def distance_vector_periodic(r, supercell, cell_increment):
     return r + np.dot(cell_increment, supercell)
+
+
+def reduce_cell(unitcell, delta=0.75):
+    """
+    LLL reduction of the cell vectors (nearly orthogonal and short vectors of the same lattice)
+
+    :param unitcell: cell vectors (rows)
+    :param delta: LLL parameter
+    :return: reduced cell vectors, integer transformation matrix (reduced = transformation * unitcell)
+    """
+    unitcell = np.array(unitcell, dtype=float)
+    n_dim = len(unitcell)
+    transformation = np.identity(n_dim, dtype=int)
+
+    def gram_schmidt(basis):
+        ortho = np.array(basis)
+        for i in range(n_dim):
+            for j in range(i):
+                ortho[i] -= np.dot(basis[i], ortho[j]) / np.dot(ortho[j], ortho[j]) * ortho[j]
+        return ortho
+
+    k = 1
+    while k < n_dim:
+        basis = np.dot(transformation, unitcell)
+        ortho = gram_schmidt(basis)
+        for j in range(k - 1, -1, -1):
+            mu = int(np.round(np.dot(basis[k], ortho[j]) / np.dot(ortho[j], ortho[j])))
+            if mu != 0:
+                transformation[k] -= mu * transformation[j]
+                basis = np.dot(transformation, unitcell)
+
+        ortho = gram_schmidt(basis)
+        mu = np.dot(basis[k], ortho[k - 1]) / np.dot(ortho[k - 1], ortho[k - 1])
+        if np.dot(ortho[k], ortho[k]) >= (delta - mu ** 2) * np.dot(ortho[k - 1], ortho[k - 1]):
+            k += 1
+        else:
+            transformation[[k - 1, k]] = transformation[[k, k - 1]]
+            k = max(k - 1, 1)
+
+    # keep the handedness of the cell
+    if np.linalg.det(transformation) < 0:
+        transformation[-1] *= -1
+
+    return np.dot(transformation, unitcell), transformation
+
+
+def shortest_vector_length(cell):
+    """
+    :param cell: lattice vectors (rows)
+    :return: length of the shortest non zero vector of the lattice
+    """
+    cell = np.array(cell, dtype=float)
+    length = np.min(np.linalg.norm(cell, axis=1))
+
+    # the components of the vectors shorter than length are bounded by the spacing of the lattice planes
+    bounds = np.array(length * np.linalg.norm(np.linalg.inv(cell), axis=0) + 1e-8, dtype=int)
+    coefficients = np.indices(2 * bounds + 1).reshape(len(bounds), -1).T - bounds
+    coefficients = coefficients[np.any(coefficients != 0, axis=1)]
+    if len(coefficients) == 0:
+        return length
+
+    return min(length, np.min(np.linalg.norm(np.dot(coefficients, cell), axis=1)))
+
+
+def get_minimal_supercell(unitcell, cutoff_radius):
+    """
+    smallest supercell in which all the (non zero) lattice vectors are at least as long as the cutoff radius,
+    so no molecule is within the cutoff radius of its own images. This is enough for the simulation of single
+    excitons (the periodic images are tracked with the cell state). Use a reduced cell (see reduce_cell) for
+    skewed cells.
+
+    :param unitcell: cell vectors (rows)
+    :param cutoff_radius: cutoff radius
+    :return: number of cells in each direction
+    """
+    unitcell = np.array(unitcell, dtype=float)
+
+    # upper bound: the supercell planes are separated by more than the cutoff radius
+    bounds = np.maximum(np.ceil(cutoff_radius * np.linalg.norm(np.linalg.inv(unitcell), axis=0) - 1e-8), 1)
+
+    candidates = np.indices(bounds.astype(int)).reshape(len(bounds), -1).T + 1
+    candidates = candidates[np.lexsort([np.sum(candidates, axis=1), np.prod(candidates, axis=1)])]
+    for dimensions in candidates:
+        if shortest_vector_length(unitcell * dimensions[:, None]) >= cutoff_radius:
+            return dimensions
+
+    return bounds.astype(int)
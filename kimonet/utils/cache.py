@@ -0,0 +1,125 @@
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    dictionary with a maximum number of entries. When it is full the least recently used entry is evicted.
+    The lookups done with get are counted (hits and misses). The keys inserted can be followed with journals
+    (see journal), e.g. to write only the new entries to a file
+    """
+    def __init__(self, maxsize=None):
+        """
+        :param maxsize: maximum number of entries (None: unbounded)
+        """
+        self._data = OrderedDict()
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._journals = []     # sets of the keys inserted since they were taken (see journal)
+
+    def get(self, key, default=None):
+        """
+        :param key: key of the entry
+        :param default: value returned if the key is not in the cache
+        :return: the value of the entry
+        """
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        if self.maxsize is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        if self._journals and key not in self._data:
+            for journal in self._journals:
+                journal.add(key)
+        self._data[key] = value
+        if self.maxsize is not None:
+            self._data.move_to_end(key)
+            self._evict()
+
+    def __delitem__(self, key):
+        del self._data[key]
+        for journal in self._journals:
+            journal.discard(key)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        return iter(list(self._data))
+
+    def __repr__(self):
+        return 'LRUCache({})'.format(self.info())
+
+    def items(self):
+        return list(self._data.items())
+
+    def update(self, entries):
+        for key, value in dict(entries).items():
+            self[key] = value
+
+    def _evict(self):
+        while len(self._data) > self.maxsize:
+            key, _ = self._data.popitem(last=False)
+            self.evictions += 1
+            for journal in self._journals:
+                journal.discard(key)
+
+    def set_maxsize(self, maxsize):
+        """
+        changes the maximum number of entries (the least recently used entries are evicted at once)
+
+        :param maxsize: maximum number of entries (None: unbounded)
+        """
+        self.maxsize = maxsize
+        if maxsize is not None:
+            self._evict()
+
+    def clear(self):
+        """
+        removes all the entries and resets the counters
+        """
+        self._data.clear()
+        self.hits = self.misses = self.evictions = 0
+        for journal in self._journals:
+            journal.clear()
+
+    def journal(self):
+        """
+        :return: set with the keys of the cache. The keys inserted later are added to it (and the keys removed
+                 from the cache are discarded) until it is released, the owner removes the keys it has processed
+        """
+        journal = set(self._data)
+        self._journals.append(journal)
+        return journal
+
+    def release_journal(self, journal):
+        """
+        stops following the keys of the cache in a journal
+
+        :param journal: set returned by journal
+        """
+        self._journals = [j for j in self._journals if j is not journal]
+
+    def info(self):
+        """
+        :return: dictionary with the counters and the size of the cache
+        """
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._data),
+                'maxsize': self.maxsize}